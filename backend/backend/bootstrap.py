@@ -14,8 +14,13 @@ from backend.shared.unit_of_work.uow import UnitOfWorkFactory
 from backend.shared.unit_of_work.uow_postgres import SqlUowFactory
 from backend.shared.utils.cache_manager import CacheManager, InMemoryCacheManager
 from backend.shared.utils.worker import Worker
-from backend.webhook.application.encrypt_service import GDPRCompliantEncryptor
-from backend.webhook.application.telegraph import Telegraph
+from backend.webhook.application.circuit_breaker import CircuitBreaker
+from backend.webhook.application.delivery_governor import DeliveryGovernor
+from backend.webhook.application.delivery_queue import DeliveryQueue
+from backend.webhook.application.telegraph import Telegraph, RequestClient
+from backend.webhook.application.webhook_cache import WebhookCache
+from backend.webhook.infra.delivery_task_repo_sql import parse_inserted_deliveries
+from backend.webhook.infra.webhook_repo_sql import parse_changed_webhooks
 
 
 class Bootstrap:
@@ -27,12 +32,14 @@ class Bootstrap:
         self._auth_service = None
         self._auth_closure_factory = None
         self._subscription_client = None
-        self._encryptor = None
         self._uow_factory = None
         self._telegraph_worker = None
+        self._delivery_queue = None
+        self._delivery_governor = None
         self._fastapi_users = None
         self._cache_manager = None
         self._auth_token_cache_manager = None
+        self._webhook_cache = None
 
     def set_dependency(self, name: str, value):
         name = "_" + name
@@ -68,6 +75,12 @@ class Bootstrap:
         if not self._uow_factory:
             if isinstance(self.database(), AsyncEngine):
                 self._uow_factory = SqlUowFactory(self.database())
+                self._uow_factory.add_commit_listener(
+                    lambda logs: self.delivery_queue().push_many(parse_inserted_deliveries(logs))
+                )
+                self._uow_factory.add_commit_listener(
+                    lambda logs: self.webhook_cache().invalidate_webhooks(parse_changed_webhooks(logs))
+                )
             else:
                 raise TypeError(type(self.database()))
         return self._uow_factory
@@ -80,10 +93,53 @@ class Bootstrap:
             self._auth_closure_factory = complex_factory
         return self._auth_closure_factory
 
+    def delivery_queue(self) -> DeliveryQueue:
+        if not self._delivery_queue:
+            self._delivery_queue = DeliveryQueue(on_push=lambda: self.telegraph_worker().wake())
+        return self._delivery_queue
+
+    def delivery_governor(self) -> DeliveryGovernor:
+        if not self._delivery_governor:
+            self._delivery_governor = DeliveryGovernor(
+                max_concurrency=config.TELEGRAPH_MAX_CONCURRENCY,
+                max_concurrency_per_host=config.TELEGRAPH_MAX_CONCURRENCY_PER_HOST,
+            )
+        return self._delivery_governor
+
     def telegraph_worker(self) -> Worker:
         if not self._telegraph_worker:
-            telegraph = Telegraph(self.unit_of_work_factory())
-            self._telegraph_worker = Worker(telegraph.notify, sleep_time=10, safe=True, task_name="Telegraph worker")
+            client = RequestClient(
+                governor=self.delivery_governor(),
+                connect_timeout=config.TELEGRAPH_CONNECT_TIMEOUT,
+                read_timeout=config.TELEGRAPH_READ_TIMEOUT,
+                keepalive_connections=config.TELEGRAPH_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.TELEGRAPH_KEEPALIVE_EXPIRY,
+                http2=config.TELEGRAPH_HTTP2,
+                compression_threshold=config.WEBHOOK_COMPRESSION_THRESHOLD,
+            )
+            telegraph = Telegraph(
+                self.unit_of_work_factory(),
+                queue=self.delivery_queue(),
+                poll_interval=config.TELEGRAPH_POLL_INTERVAL,
+                batch_limit=config.TELEGRAPH_BATCH_LIMIT,
+                lease_time=config.TELEGRAPH_LEASE_TIME,
+                tenant_quota=config.TELEGRAPH_TENANT_QUOTA or None,
+                client=client,
+                breaker=CircuitBreaker(
+                    window=config.WEBHOOK_CIRCUIT_WINDOW,
+                    failure_rate=config.WEBHOOK_CIRCUIT_FAILURE_RATE,
+                    min_requests=config.WEBHOOK_CIRCUIT_MIN_REQUESTS,
+                    open_time=config.WEBHOOK_CIRCUIT_OPEN_TIME,
+                ),
+                auto_disable_after=config.WEBHOOK_AUTO_DISABLE_AFTER,
+            )
+            self._telegraph_worker = Worker(
+                telegraph.notify,
+                sleep_time=config.TELEGRAPH_POLL_INTERVAL,
+                safe=True,
+                task_name="Telegraph worker",
+                next_run_delay=telegraph.next_run_delay,
+            )
         return self._telegraph_worker
 
     def apikey_cache_manager(self) -> CacheManager[Apikey]:
@@ -96,6 +152,11 @@ class Bootstrap:
             self._auth_token_cache_manager = InMemoryCacheManager(config.AUTHENTICATION_CACHE_TIME)
         return self._auth_token_cache_manager
 
+    def webhook_cache(self) -> WebhookCache:
+        if not self._webhook_cache:
+            self._webhook_cache = WebhookCache(InMemoryCacheManager(config.WEBHOOK_CACHE_TIME))
+        return self._webhook_cache
+
 
 container = Bootstrap()
 
@@ -27,10 +27,51 @@ AUTHENTICATION_CACHE_TIME = int(os.getenv("AUTHENTICATION_CACHE_TIME", 3600))
 AUTHENTICATION_TOKEN_LIFETIME = int(os.getenv("AUTHENTICATION_TOKEN_LIFETIME", 86_400))
 SECRET = os.getenv("SECRET", "sample_secret")
 
+# Webhooks
+WEBHOOK_CACHE_TIME = int(os.getenv("WEBHOOK_CACHE_TIME", 60))
+# Тела меньше порога отправляются без сжатия даже при включенной компрессии
+WEBHOOK_COMPRESSION_THRESHOLD = int(os.getenv("WEBHOOK_COMPRESSION_THRESHOLD", 1024))
+# Telegraph просыпается к ближайшему next_retry_at, интервал опроса - только страховка
+TELEGRAPH_POLL_INTERVAL = int(os.getenv("TELEGRAPH_POLL_INTERVAL", 300))
+TELEGRAPH_BATCH_LIMIT = int(os.getenv("TELEGRAPH_BATCH_LIMIT", 500))
+TELEGRAPH_LEASE_TIME = int(os.getenv("TELEGRAPH_LEASE_TIME", 60))
+# Максимум доставок одного клиента за цикл. 0 - без ограничения, клиенты только чередуются в пачке
+TELEGRAPH_TENANT_QUOTA = int(os.getenv("TELEGRAPH_TENANT_QUOTA", 0))
+TELEGRAPH_MAX_CONCURRENCY = int(os.getenv("TELEGRAPH_MAX_CONCURRENCY", 100))
+TELEGRAPH_MAX_CONCURRENCY_PER_HOST = int(os.getenv("TELEGRAPH_MAX_CONCURRENCY_PER_HOST", 10))
+TELEGRAPH_KEEPALIVE_CONNECTIONS = int(os.getenv("TELEGRAPH_KEEPALIVE_CONNECTIONS", 20))
+TELEGRAPH_KEEPALIVE_EXPIRY = float(os.getenv("TELEGRAPH_KEEPALIVE_EXPIRY", 30))
+TELEGRAPH_CONNECT_TIMEOUT = float(os.getenv("TELEGRAPH_CONNECT_TIMEOUT", 5))
+TELEGRAPH_READ_TIMEOUT = float(os.getenv("TELEGRAPH_READ_TIMEOUT", 10))
+TELEGRAPH_HTTP2 = os.getenv("TELEGRAPH_HTTP2", "false").lower() == "true"
+WEBHOOK_CIRCUIT_WINDOW = float(os.getenv("WEBHOOK_CIRCUIT_WINDOW", 60))
+WEBHOOK_CIRCUIT_FAILURE_RATE = float(os.getenv("WEBHOOK_CIRCUIT_FAILURE_RATE", 0.5))
+WEBHOOK_CIRCUIT_MIN_REQUESTS = int(os.getenv("WEBHOOK_CIRCUIT_MIN_REQUESTS", 5))
+WEBHOOK_CIRCUIT_OPEN_TIME = float(os.getenv("WEBHOOK_CIRCUIT_OPEN_TIME", 30))
+# 0 - не отключать вебхуки автоматически
+WEBHOOK_AUTO_DISABLE_AFTER = float(os.getenv("WEBHOOK_AUTO_DISABLE_AFTER", 0))
+
 # Subscription manager
+# Менеджер просыпается к ближайшему сроку истечения или обновления usages, период - только страховка
 SUBSCRIPTION_MANAGER_CHECK_PERIOD = int(os.getenv("SUBSCRIPTION_MANAGER_CHECK_PERIOD", 3600))
 SUBSCRIPTION_MANAGER_BULK_LIMIT = int(os.getenv("SUBSCRIPTION_MANAGER_BULK_LIMIT", 100))
+# Подписки делятся на шарды по подписчику, реплики разбирают шарды через advisory lock
+SUBSCRIPTION_MANAGER_SHARDS = int(os.getenv("SUBSCRIPTION_MANAGER_SHARDS", 1))
+# Сколько шардов одна реплика обрабатывает одновременно
+SUBSCRIPTION_MANAGER_PARALLELISM = int(os.getenv("SUBSCRIPTION_MANAGER_PARALLELISM", 1))
+# Сколько ближайших сроков держать в памяти
+SUBSCRIPTION_MANAGER_SCHEDULER_CAPACITY = int(os.getenv("SUBSCRIPTION_MANAGER_SCHEDULER_CAPACITY", 1000))
+
+# Usage ingestion
+USAGE_BATCH_CHUNK_SIZE = int(os.getenv("USAGE_BATCH_CHUNK_SIZE", 500))
+# Наибольшее число инкрементов в одном запросе /subscription/usage-batch
+USAGE_BATCH_MAX_SIZE = int(os.getenv("USAGE_BATCH_MAX_SIZE", 5000))
 
 # Cleaners
 LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 7))
 DELIVERY_RETENTION_DAYS = int(os.getenv("DELIVERY_RETENTION_DAYS", 7))
+# На сколько дней вперед создавать партиции log_table и delivery_archive
+PARTITIONS_AHEAD_DAYS = int(os.getenv("PARTITIONS_AHEAD_DAYS", 3))
+# Cron-расписания очистки в UTC, по умолчанию в часы минимальной нагрузки
+LOG_CLEANER_CRON = os.getenv("LOG_CLEANER_CRON", "0 3 * * *")
+DELIVERY_CLEANER_CRON = os.getenv("DELIVERY_CLEANER_CRON", "30 3 * * *")
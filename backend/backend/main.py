@@ -16,7 +16,7 @@ from backend.shared.exceptions import ItemNotExist, ItemAlreadyExist, Validation
 from backend.startup_service import StartupShutdownManager
 from backend.subscription.adapters.plan_api import plan_router
 from backend.subscription.adapters.subscription_api import subscription_router
-from backend.subscription.domain.exceptions import ActiveStatusConflict
+from backend.subscription.domain.exceptions import ActiveStatusConflict, UsageLimitExceeded
 from backend.webhook.adapters.webhook_api import webhook_router
 
 logger.remove()
@@ -81,6 +81,15 @@ async def handle_item_active_status_conflict(_request: Request, exc: ActiveStatu
     )
 
 
+@app.exception_handler(UsageLimitExceeded)
+async def handle_usage_limit_exceeded(_request: Request, exc: UsageLimitExceeded):
+    logger.error(exc)
+    return JSONResponse(
+        status_code=409,
+        content=exc.to_json(),
+    )
+
+
 # @app.exception_handler(RequestValidationError)
 async def handle_request_validation_error(_request: Request, exc: RequestValidationError):
     logger.error(exc)
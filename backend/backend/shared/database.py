@@ -1,6 +1,6 @@
 import asyncpg
 from loguru import logger
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, text
 from sqlalchemy.ext.asyncio import create_async_engine
 
 metadata = MetaData()
@@ -69,3 +69,27 @@ class DatabaseManager:
             await conn.run_sync(metadata.create_all)
             await conn.commit()
         logger.info(f"Tables in {self._db_name} are ready")
+
+    async def prepare_tables(self, statements: list[str]) -> None:
+        """Runs idempotent statements that must precede create_all, e.g. moving an old table out of its way"""
+        async with self._async_engine.begin() as conn:
+            for stmt in statements:
+                await conn.execute(text(stmt))
+
+    async def upgrade_tables(self, upgrades: list[str]) -> None:
+        """
+        Runs idempotent upgrade statements for tables created by older versions,
+        then creates the indexes missing on existing tables.
+        """
+        async with self._async_engine.begin() as conn:
+            for stmt in upgrades:
+                await conn.execute(text(stmt))
+            # create_all пропускает существующие таблицы вместе с их новыми индексами
+            await conn.run_sync(self._create_missing_indexes)
+        logger.info(f"Tables in {self._db_name} are upgraded")
+
+    @staticmethod
+    def _create_missing_indexes(sync_conn) -> None:
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(sync_conn, checkfirst=True)
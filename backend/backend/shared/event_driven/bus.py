@@ -10,11 +10,13 @@ class Context:
 
 
 Subscriber = Callable[[Event, Context], Awaitable[None]]
+BatchSubscriber = Callable[[list[Event], Context], Awaitable[None]]
 
 
 class Bus:
     def __init__(self):
         self._subscribers: dict[Type[Event], set[Subscriber]] = {}
+        self._batch_subscribers: dict[Type[Event], set[BatchSubscriber]] = {}
 
     def subscribe(self, event_type: Type[Event], subscriber: Subscriber) -> None:
         code = event_type.get_event_code()
@@ -26,10 +28,31 @@ class Bus:
         if not self._subscribers[code]:
             self._subscribers.pop(code)
 
+    def subscribe_batch(self, event_type: Type[Event], subscriber: BatchSubscriber) -> None:
+        """Batch subscriber receives all matching events of one publishing round in a single call"""
+        code = event_type.get_event_code()
+        self._batch_subscribers.setdefault(code, set()).add(subscriber)
+
+    def unsubscribe_batch(self, event_type: Type[Event], subscriber: BatchSubscriber) -> None:
+        code = event_type.get_event_code()
+        self._batch_subscribers[code].remove(subscriber)
+        if not self._batch_subscribers[code]:
+            self._batch_subscribers.pop(code)
+
     async def publish(self, event: Event, context: Context) -> None:
-        subscribers = self._subscribers.get(event.get_event_code(), set())
-        for sub in subscribers:
-            await sub(event, context)
+        await self.publish_many([event], context)
+
+    async def publish_many(self, events: list[Event], context: Context) -> None:
+        batches: dict[BatchSubscriber, list[Event]] = {}
+        for event in events:
+            subscribers = self._subscribers.get(event.get_event_code(), set())
+            for sub in subscribers:
+                await sub(event, context)
+            for sub in self._batch_subscribers.get(event.get_event_code(), set()):
+                batches.setdefault(sub, []).append(event)
+
+        for sub, batch in batches.items():
+            await sub(batch, context)
 
     async def publish_from_unit_of_work(self, uow: UnitOfWork):
         while True:
@@ -37,5 +60,4 @@ class Bus:
             if not new_events:
                 break
 
-            for ev in new_events:
-                await self.publish(ev, Context(uow))
+            await self.publish_many(new_events, Context(uow))
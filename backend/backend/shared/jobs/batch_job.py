@@ -0,0 +1,197 @@
+import asyncio
+import random
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+
+from backend.shared.jobs.checkpoint import Cursor
+from backend.shared.unit_of_work.uow import UnitOfWork, UnitOfWorkFactory
+
+
+async def process_batch[T](
+        uow: UnitOfWork,
+        items: list[T],
+        process: Callable[[UnitOfWork, T], Awaitable[None]],
+        refetch: Callable[[], Awaitable[list[T]]],
+) -> list[T]:
+    """
+    Processes the items in one savepoint, so their changes are flushed together as one statement per table.
+
+    If that fails, the items are fetched again, because the failed attempt may have changed them in memory,
+    and processed one savepoint per item. Returns the processed items.
+    """
+    if not items:
+        return []
+    try:
+        async with uow.savepoint():
+            for item in items:
+                await process(uow, item)
+        return items
+    except Exception as err:
+        logger.warning(f"Batch of {len(items)} items failed, processing them one by one: {err!r}")
+
+    processed = []
+    for item in await refetch():
+        try:
+            # Ошибка базы на одном элементе откатывает только его точку сохранения, а не весь батч
+            async with uow.savepoint():
+                await process(uow, item)
+            processed.append(item)
+        except Exception as err:
+            logger.exception(err)
+    return processed
+
+
+class BatchJob[T](ABC):
+    """
+    A job that walks over rows in keyset order, one transaction and one savepoint per batch.
+    Only a failed batch is processed again with a savepoint per item.
+
+    The cursor moves past every fetched item, including failed ones, so a bad row is retried
+    on the next pass instead of being selected again and again within the same one.
+    """
+    name: str
+
+    @abstractmethod
+    async def fetch(self, uow: UnitOfWork, after: Optional[Cursor], limit: int, part: int, parts: int) -> list[T]:
+        """Items of the part after the cursor, in the cursor order. Called again if the batch fails."""
+        pass
+
+    @abstractmethod
+    def cursor_of(self, item: T) -> Cursor:
+        """Called right after fetch, before the item is processed."""
+        pass
+
+    @abstractmethod
+    async def process(self, uow: UnitOfWork, item: T) -> None:
+        pass
+
+    async def try_acquire(self, uow: UnitOfWork, part: int, parts: int) -> bool:
+        """Called at the start of every batch transaction, False skips the part for this run."""
+        return True
+
+    async def after_batch(self, uow: UnitOfWork, items: list[T]) -> None:
+        """Called after the items of the batch were processed, before the commit."""
+        pass
+
+    async def commit(self, uow: UnitOfWork) -> None:
+        await uow.commit()
+
+    def lag_of(self, item: T) -> Optional[float]:
+        """How late the item is picked up, in seconds. None if the job has no notion of lateness."""
+        return None
+
+
+@dataclass
+class JobStats:
+    processed: int = 0
+    failed: int = 0
+    batches: int = 0
+    started_at: Optional[float] = None
+    duration: float = 0
+    max_lag: Optional[float] = None
+
+    @property
+    def throughput(self) -> float:
+        """Items per second of the last run"""
+        return self.processed / self.duration if self.duration else 0.0
+
+
+class BatchJobRunner:
+    def __init__(
+            self,
+            uow_factory: UnitOfWorkFactory,
+            batch_size: int = 100,
+            parts: int = 1,
+            parallelism: int = 1,
+    ):
+        """
+        :param batch_size: Items per transaction.
+        :param parts: The job is split into this many parts, every part has its own checkpoint.
+        :param parallelism: How many parts run concurrently.
+        """
+        self._uow_factory = uow_factory
+        self._batch_size = batch_size
+        self._parts = parts
+        self._parallelism = parallelism
+        self.stats: dict[str, JobStats] = {}
+
+    def _checkpoint_name(self, job: BatchJob, part: int) -> str:
+        return job.name if self._parts == 1 else f"{job.name}:{part}/{self._parts}"
+
+    async def run_parts(
+            self,
+            try_acquire: Callable[[UnitOfWork, int, int], Awaitable[bool]],
+            run_batch: Callable[[UnitOfWork, int, int], Awaitable[bool]],
+    ) -> None:
+        """
+        Calls run_batch(uow, part, parts) for every part, one transaction per call, until it returns False.
+        run_batch commits the unit of work itself. try_acquire is called at the start of every transaction,
+        False skips the part for this run.
+        """
+        semaphore = asyncio.Semaphore(self._parallelism)
+
+        async def run_part(part: int):
+            async with semaphore:
+                while True:
+                    async with self._uow_factory.create_uow() as uow:
+                        if not await try_acquire(uow, part, self._parts):
+                            return
+                        if not await run_batch(uow, part, self._parts):
+                            return
+
+        # Реплики начинают с разных частей, чтобы реже сталкиваться на блокировках
+        offset = random.randrange(self._parts)
+        await asyncio.gather(*[run_part((offset + i) % self._parts) for i in range(self._parts)])
+
+    async def run(self, job: BatchJob) -> JobStats:
+        stats = JobStats(started_at=time.time())
+        self.stats[job.name] = stats
+
+        async def run_batch(uow: UnitOfWork, part: int, parts: int) -> bool:
+            return await self._run_batch(job, uow, part, stats)
+
+        started = time.monotonic()
+        try:
+            await self.run_parts(job.try_acquire, run_batch)
+        finally:
+            stats.duration = time.monotonic() - started
+            logger.info(
+                f"Job {job.name}: processed {stats.processed}, failed {stats.failed}, batches {stats.batches}, "
+                f"{stats.throughput:.1f} items/s, max lag {stats.max_lag}"
+            )
+        return stats
+
+    async def _run_batch(self, job: BatchJob, uow: UnitOfWork, part: int, stats: JobStats) -> bool:
+        checkpoint_name = self._checkpoint_name(job, part)
+        checkpoints = uow.job_checkpoint_repo()
+        cursor = await checkpoints.get_cursor(checkpoint_name)
+        items = await job.fetch(uow, cursor, self._batch_size, part, self._parts)
+        if not items:
+            # Проход завершен, следующий запуск начнет сначала и повторит упавшие элементы
+            if cursor is not None:
+                await checkpoints.save_cursor(checkpoint_name, None)
+                await uow.commit()
+            return False
+        # Курсор и задержка берутся до обработки: она может изменить колонки сортировки
+        next_cursor = job.cursor_of(items[-1])
+        lags = [lag for lag in map(job.lag_of, items) if lag is not None]
+
+        processed = await process_batch(
+            uow, items, job.process, lambda: job.fetch(uow, cursor, self._batch_size, part, self._parts)
+        )
+        await job.after_batch(uow, processed)
+
+        # Чекпоинт коммитится вместе с батчем: после падения процесс продолжит с того же места
+        await checkpoints.save_cursor(checkpoint_name, next_cursor)
+        await job.commit(uow)
+
+        stats.batches += 1
+        stats.processed += len(processed)
+        stats.failed += len(items) - len(processed)
+        if lags:
+            stats.max_lag = max(lags + ([stats.max_lag] if stats.max_lag is not None else []))
+        return True
@@ -0,0 +1,16 @@
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+# Позиция keyset-курсора: значения колонок сортировки последнего обработанного элемента, JSON-совместимые
+Cursor = list[Any]
+
+
+class JobCheckpointRepo(ABC):
+    @abstractmethod
+    async def get_cursor(self, job_name: str) -> Optional[Cursor]:
+        pass
+
+    @abstractmethod
+    async def save_cursor(self, job_name: str, cursor: Optional[Cursor]) -> None:
+        """Saved in the current transaction, None means the next run starts from the beginning."""
+        pass
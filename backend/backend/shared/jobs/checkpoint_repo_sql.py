@@ -0,0 +1,37 @@
+from typing import Optional
+
+from sqlalchemy import Table, Column, String, select
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.shared.database import metadata
+from backend.shared.jobs.checkpoint import JobCheckpointRepo, Cursor
+from backend.shared.unit_of_work.base_repo_sql import AwareDateTime
+from backend.shared.utils.dt import get_current_datetime
+
+job_checkpoint_table = Table(
+    "job_checkpoint",
+    metadata,
+    Column("job_name", String, primary_key=True),
+    Column("cursor", JSONB, nullable=True),
+    Column("updated_at", AwareDateTime(timezone=True), nullable=False),
+)
+
+
+class SqlJobCheckpointRepo(JobCheckpointRepo):
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_cursor(self, job_name: str) -> Optional[Cursor]:
+        stmt = select(job_checkpoint_table.c["cursor"]).where(job_checkpoint_table.c["job_name"] == job_name)
+        result = await self.session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    async def save_cursor(self, job_name: str, cursor: Optional[Cursor]) -> None:
+        values = {"job_name": job_name, "cursor": cursor, "updated_at": get_current_datetime()}
+        stmt = (
+            insert(job_checkpoint_table)
+            .values(values)
+            .on_conflict_do_update(index_elements=["job_name"], set_=values)
+        )
+        await self.session.execute(stmt)
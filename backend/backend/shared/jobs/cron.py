@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+# (min, max) значений для полей minute, hour, day of month, month, day of week.
+# В cron воскресенье можно записать и как 0, и как 7
+_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+# Дальше этого next_after не ищет: такое выражение не совпадет никогда, например "0 0 31 2 *"
+_SEARCH_LIMIT = timedelta(days=366 * 5)
+
+
+def _parse_field(field: str, low: int, high: int) -> set[int]:
+    values = set()
+    for part in field.split(","):
+        value_range, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if step < 1:
+            raise ValueError(f"Invalid step in '{field}'")
+
+        if value_range == "*":
+            start, end = low, high
+        elif "-" in value_range:
+            start, end = (int(x) for x in value_range.split("-", 1))
+        else:
+            start = int(value_range)
+            # "5/15" означает "с 5 до конца с шагом 15"
+            end = high if step > 1 else start
+
+        if start < low or end > high or start > end:
+            raise ValueError(f"Value out of range in '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """
+    Standard 5-field cron expression: minute, hour, day of month, month, day of week.
+
+    Supports "*", lists, ranges and steps. As in cron, when both day fields are restricted,
+    a day matches if either of them does.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, _FIELD_RANGES)
+        )
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        # isoweekday: понедельник 1 ... воскресенье 7, в cron воскресенье 0
+        weekday_matches = dt.isoweekday() % 7 in self.weekdays
+        day_matches = dt.day in self.days
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_after(self, dt: datetime) -> datetime:
+        """The first matching minute strictly after dt, in the timezone of dt."""
+        current = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + _SEARCH_LIMIT
+        while current <= limit:
+            if current.month not in self.months:
+                current = (current.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(current):
+                current = current.replace(hour=0, minute=0) + timedelta(days=1)
+            elif current.hour not in self.hours:
+                current = current.replace(minute=0) + timedelta(hours=1)
+            elif current.minute not in self.minutes:
+                current += timedelta(minutes=1)
+            else:
+                return current
+        raise ValueError(f"Cron expression never matches: '{self.expression}'")
+
+    def __repr__(self):
+        return f"CronExpression('{self.expression}')"
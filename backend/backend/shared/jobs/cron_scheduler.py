@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from backend.shared.jobs.cron import CronExpression
+from backend.shared.jobs.job_run_repo_sql import SqlJobRunRepo
+from backend.shared.utils.dt import get_current_datetime
+
+
+@dataclass
+class CronJob:
+    name: str
+    schedule: CronExpression
+    # Возвращает количество затронутых строк, если оно известно
+    callback: Callable[[], Awaitable[Optional[int]]]
+    # Пропущенный слот (процесс был остановлен) еще запускается, если опоздание не больше этого
+    misfire_grace: timedelta = timedelta(hours=1)
+
+
+class CronScheduler:
+    """
+    Runs jobs at the slots of their cron schedules, in UTC.
+
+    Every slot is claimed by inserting a job_run row, the unique (job_name, slot) key guarantees
+    a single run per slot across all replicas. A run that crashed midway is not repeated.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession], jobs: list[CronJob]):
+        self._session_factory = session_factory
+        self._jobs = jobs
+        now = get_current_datetime()
+        self._next_slots = {job.name: job.schedule.next_after(now - job.misfire_grace) for job in jobs}
+
+    def next_run_delay(self) -> float:
+        """Seconds until the nearest slot"""
+        if not self._next_slots:
+            return 3600
+        nearest = min(self._next_slots.values())
+        return max(0.0, (nearest - get_current_datetime()).total_seconds())
+
+    async def run(self):
+        now = get_current_datetime()
+        for job in self._jobs:
+            slot = None
+            # Из нескольких пропущенных слотов запускаем только последний
+            while self._next_slots[job.name] <= now:
+                slot = self._next_slots[job.name]
+                self._next_slots[job.name] = job.schedule.next_after(slot)
+            if slot is not None and now - slot <= job.misfire_grace:
+                await self._run_job(job, slot)
+
+    async def _run_job(self, job: CronJob, slot) -> None:
+        async with self._session_factory() as session:
+            run_id = await SqlJobRunRepo(session).claim(job.name, slot, get_current_datetime())
+            await session.commit()
+        if run_id is None:
+            logger.info(f"Job {job.name} for slot {slot} is run by another process")
+            return
+
+        logger.info(f"Run job {job.name} for slot {slot}")
+        rows_affected, error = None, None
+        try:
+            rows_affected = await job.callback()
+        except Exception as err:
+            logger.exception(err)
+            error = repr(err)
+
+        async with self._session_factory() as session:
+            await SqlJobRunRepo(session).finish(run_id, get_current_datetime(), rows_affected, error)
+            await session.commit()
@@ -0,0 +1,63 @@
+from typing import Optional
+
+from pydantic import AwareDatetime
+from sqlalchemy import Table, Column, String, BigInteger, Identity, Integer, UniqueConstraint, update, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.shared.database import metadata
+from backend.shared.unit_of_work.base_repo_sql import AwareDateTime
+
+job_run_table = Table(
+    "job_run",
+    metadata,
+    Column("id", BigInteger, Identity(), primary_key=True),
+    Column("job_name", String, nullable=False),
+    Column("slot", AwareDateTime(timezone=True), nullable=False),
+    Column("started_at", AwareDateTime(timezone=True), nullable=False),
+    Column("finished_at", AwareDateTime(timezone=True), nullable=True),
+    Column("rows_affected", Integer, nullable=True),
+    Column("error", String, nullable=True),
+    # Один запуск на слот расписания во всем кластере
+    UniqueConstraint("job_name", "slot", name="uq_job_run_job_name_slot"),
+)
+
+
+class SqlJobRunRepo:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def claim(self, job_name: str, slot: AwareDatetime, started_at: AwareDatetime) -> Optional[int]:
+        """Returns the run id, None if the slot was already taken by another process."""
+        stmt = (
+            insert(job_run_table)
+            .values(job_name=job_name, slot=slot, started_at=started_at)
+            .on_conflict_do_nothing(index_elements=["job_name", "slot"])
+            .returning(job_run_table.c["id"])
+        )
+        result = await self.session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    async def finish(
+            self,
+            run_id: int,
+            finished_at: AwareDatetime,
+            rows_affected: Optional[int],
+            error: Optional[str],
+    ) -> None:
+        stmt = (
+            update(job_run_table)
+            .where(job_run_table.c["id"] == run_id)
+            .values(finished_at=finished_at, rows_affected=rows_affected, error=error)
+        )
+        await self.session.execute(stmt)
+
+    async def get_last_runs(self, job_name: str, limit: int = 10) -> list[dict]:
+        stmt = (
+            select(job_run_table)
+            .where(job_run_table.c["job_name"] == job_name)
+            .order_by(job_run_table.c["slot"].desc())
+            .limit(limit)
+        )
+        result = await self.session.execute(stmt)
+        return [dict(x) for x in result.mappings()]
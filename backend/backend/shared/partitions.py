@@ -0,0 +1,88 @@
+from datetime import date, timedelta, datetime
+
+from loguru import logger
+from sqlalchemy import Table, DDL, text, event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class DailyPartitions:
+    """
+    Daily range partitions of a table declared with postgresql_partition_by="RANGE (<column>)".
+
+    Rows outside of the created days go to the default partition, so inserts never fail when maintenance lags.
+    Retention is a cheap DROP TABLE of whole days instead of a DELETE.
+    """
+
+    def __init__(self, table: Table):
+        self._table = table
+        event.listen(
+            table,
+            "after_create",
+            DDL(f"CREATE TABLE IF NOT EXISTS {self.default_partition} PARTITION OF {table.name} DEFAULT"),
+        )
+
+    @property
+    def default_partition(self) -> str:
+        return f"{self._table.name}_default"
+
+    def get_partition_name(self, day: date) -> str:
+        return f"{self._table.name}_{day.strftime('%Y%m%d')}"
+
+    async def create_partitions(self, session: AsyncSession, start: date, days: int) -> None:
+        for i in range(days):
+            day = start + timedelta(days=i)
+            name = self.get_partition_name(day)
+            lower, upper = day.isoformat(), (day + timedelta(days=1)).isoformat()
+            stmt = (
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self._table.name} "
+                f"FOR VALUES FROM ('{lower} 00:00:00+00') TO ('{upper} 00:00:00+00')"
+            )
+            try:
+                async with session.begin_nested():
+                    await session.execute(text(stmt))
+            except Exception as err:
+                # Например, строки за этот день уже лежат в default партиции
+                logger.error(f"Partition {name} was not created: {err}")
+
+    async def get_partition_days(self, session: AsyncSession) -> dict[str, date]:
+        stmt = text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        )
+        result = await session.execute(stmt, {"table": self._table.name})
+        days = {}
+        prefix = f"{self._table.name}_"
+        for (name,) in result:
+            try:
+                days[name] = datetime.strptime(name.removeprefix(prefix), "%Y%m%d").date()
+            except ValueError:
+                continue
+        return days
+
+    async def delete_default_rows_before(self, session: AsyncSession, dt: datetime) -> int:
+        """Rows older than dt that ended up in the default partition, the dated ones are dropped as a whole"""
+        # postgresql_partition_by имеет вид "RANGE (<column>)"
+        column = self._table.dialect_options["postgresql"]["partition_by"].split("(")[1].rstrip(")").strip()
+        stmt = text(f"DELETE FROM {self.default_partition} WHERE {column} < :dt")
+        return (await session.execute(stmt, {"dt": dt})).rowcount
+
+    async def drop_partitions_before(self, session: AsyncSession, day: date) -> dict[str, int]:
+        """
+        Commits the session: every partition is detached and dropped in transactions of its own.
+        Returns the number of rows of every dropped partition.
+        """
+        dropped = {}
+        for name, partition_day in (await self.get_partition_days(session)).items():
+            if partition_day < day:
+                # DETACH держит блокировку родительской таблицы до конца транзакции, поэтому коммитим сразу
+                # после него, а DROP блокирует уже только отсоединенную таблицу.
+                # DETACH CONCURRENTLY недоступен: у таблицы есть default партиция
+                await session.execute(text(f"ALTER TABLE {self._table.name} DETACH PARTITION {name}"))
+                await session.commit()
+                # В отсоединенную партицию уже никто не пишет, поэтому счет точный
+                dropped[name] = await session.scalar(text(f"SELECT count(*) FROM {name}"))
+                await session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                await session.commit()
+        return dropped
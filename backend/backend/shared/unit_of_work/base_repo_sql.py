@@ -68,6 +68,7 @@ class SqlBaseRepo:
         self.table = table
         self._transaction_id = transaction_id
         self._logs = []
+        self._applied_logs = []
 
     async def add_one(self, item: HasId) -> None:
         data = self.mapper.entity_to_mapping(item)
@@ -189,11 +190,30 @@ class SqlBaseRepo:
         plans = [self.mapper.mapping_to_entity(mapping) for mapping in result.mappings()]
         return plans
 
+    def add_applied_updates(self, items: Iterable[HasId]) -> None:
+        """Records updates that were already executed by a bulk statement, the UoW only saves their logs."""
+        for item in items:
+            self._applied_logs.append(
+                Log(
+                    collection_name=self.table.name,
+                    action="update",
+                    model_state=self.mapper.entity_to_mapping(item),
+                    created_at=get_current_datetime(),
+                    transaction_id=self._transaction_id,
+                    model_id=item.id,
+                )
+            )
+
     def parse_logs(self):
         result = self._logs
         self._logs = []
         return result
 
+    def parse_applied_logs(self):
+        result = self._applied_logs
+        self._applied_logs = []
+        return result
+
 
 class AwareDateTime(TypeDecorator):
     """Преобразует ISO 8601 строки в datetime.datetime при вставке в БД"""
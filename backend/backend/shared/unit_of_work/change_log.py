@@ -2,10 +2,11 @@ from collections import defaultdict
 from typing import Literal, NamedTuple, Iterable, Any, Self, Optional, cast, Mapping
 
 from pydantic import AwareDatetime, TypeAdapter
-from sqlalchemy import Table, Column, UUID, String, DateTime, BigInteger, select, func
+from sqlalchemy import Table, Column, UUID, String, DateTime, BigInteger, Identity, select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.shared.database import metadata
+from backend.shared.partitions import DailyPartitions
 from backend.shared.utils.dt import get_current_datetime
 
 Action = Literal[
@@ -41,15 +42,19 @@ class Log(NamedTuple):
 log_table = Table(
     "log_table",
     metadata,
-    Column("pk", BigInteger, autoincrement=True, primary_key=True),
+    Column("pk", BigInteger, Identity(), primary_key=True),
     Column('action', String, nullable=False),
     Column('transaction_id', UUID, nullable=False, index=True),
     Column('model_id', UUID, index=True),
     Column('model_state', String, nullable=False),
     Column('collection_name', String, nullable=False, index=True),
-    Column('created_at', DateTime(timezone=True), index=True),
+    # Ключ партиционирования обязан входить в первичный ключ
+    Column('created_at', DateTime(timezone=True), primary_key=True),
+    postgresql_partition_by="RANGE (created_at)",
 )
 
+log_partitions = DailyPartitions(log_table)
+
 
 class SqlLogMapper:
     @staticmethod
@@ -86,21 +91,32 @@ class SqlLogRepo:
             stmt = log_table.insert()
             await self._session.execute(stmt, data)
 
-    async def delete_old_logs(self, dt: AwareDatetime) -> None:
+    async def delete_old_logs(self, dt: AwareDatetime) -> int:
+        """
+        Drops whole daily partitions older than the day of dt.
+        Only rows which ended up in the default partition are deleted row by row.
+        Returns the number of deleted rows.
+        """
+        day = dt.date()
+        dropped = await log_partitions.drop_partitions_before(self._session, day)
+        day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
         stmt = (
             log_table
             .delete()
-            .where(log_table.c["created_at"] < dt)
+            .where(log_table.c["created_at"] < day_start)
         )
-        await self._session.execute(stmt)
+        deleted = (await self._session.execute(stmt)).rowcount
+        return sum(dropped.values()) + deleted
 
-    async def get_logs_by_transaction_id(self, trs_id: UUID) -> list[Log]:
+    async def get_logs_by_transaction_id(self, trs_id: UUID, since: AwareDatetime = None) -> list[Log]:
         stmt = (
             log_table
             .select()
             .where(log_table.c["transaction_id"] == trs_id)
             .order_by(log_table.c["pk"])
         )
+        if since is not None:
+            stmt = stmt.where(log_table.c["created_at"] >= since)
         mappings = (await self._session.execute(stmt)).mappings()
         logs = [self._mapper.mapping_to_entity(mapping) for mapping in mappings]
         return logs
@@ -0,0 +1,58 @@
+# Переводит log_table, созданную прежними версиями обычной таблицей, на партиции по дням.
+# Таблица переименовывается до create_all, чтобы тот создал партиционированную log_table,
+# после него строки копируются в партиции своих дней. Оба шага идемпотентны и выполняются при каждом старте
+
+LOG_SCHEMA_PRE_CREATE = [
+    # Имена индексов и последовательности освобождаются для новой таблицы
+    """
+    DO $$
+    DECLARE
+        idx record;
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'log_table' AND relkind = 'r') THEN
+            ALTER TABLE log_table RENAME TO log_table_legacy;
+            FOR idx IN SELECT indexname FROM pg_indexes WHERE tablename = 'log_table_legacy' LOOP
+                EXECUTE format(
+                    'ALTER INDEX %I RENAME TO %I',
+                    idx.indexname, replace(idx.indexname, 'log_table', 'log_table_legacy')
+                );
+            END LOOP;
+            ALTER SEQUENCE IF EXISTS log_table_pk_seq RENAME TO log_table_legacy_pk_seq;
+        END IF;
+    END $$
+    """,
+]
+
+LOG_SCHEMA_UPGRADES = [
+    # Партиции называются и нарезаются так же, как в DailyPartitions, иначе очистка их не найдет.
+    # Строки старше срока хранения удалит очередной запуск очистки вместе с их партициями
+    """
+    DO $$
+    DECLARE
+        day date;
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'log_table_legacy') THEN
+            FOR day IN
+                SELECT DISTINCT (COALESCE(created_at, now()) AT TIME ZONE 'UTC')::date FROM log_table_legacy
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF log_table FOR VALUES FROM (%L) TO (%L)',
+                    'log_table_' || to_char(day, 'YYYYMMDD'),
+                    day::text || ' 00:00:00+00',
+                    (day + 1)::text || ' 00:00:00+00'
+                );
+            END LOOP;
+
+            INSERT INTO log_table (pk, action, transaction_id, model_id, model_state, collection_name, created_at)
+            SELECT pk, action, transaction_id, model_id, model_state, collection_name, COALESCE(created_at, now())
+            FROM log_table_legacy;
+            PERFORM setval(
+                pg_get_serial_sequence('log_table', 'pk'),
+                (SELECT COALESCE(max(pk), 0) + 1 FROM log_table),
+                false
+            );
+            DROP TABLE log_table_legacy;
+        END IF;
+    END $$
+    """,
+]
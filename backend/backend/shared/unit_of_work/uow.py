@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Self
+from typing import Self, AsyncContextManager
 
 from backend.auth.domain.apikey import ApikeyRepo
 from backend.shared.event_driven.base_event import Event
+from backend.shared.jobs.checkpoint import JobCheckpointRepo
 from backend.subscription.domain.plan_repo import PlanRepo
 from backend.subscription.domain.subscription_repo import SubscriptionRepo
 from backend.webhook.domain.delivery_task import DeliveryTaskRepo
@@ -18,6 +19,14 @@ class UnitOfWork(ABC):
     async def rollback(self):
         pass
 
+    @abstractmethod
+    def savepoint(self) -> AsyncContextManager[None]:
+        """
+        Scopes the changes and events made inside the block to a nested transaction.
+        If the block fails, only its changes are rolled back and the transaction stays usable.
+        """
+        pass
+
     @abstractmethod
     def push_event(self, event: Event) -> None:
         pass
@@ -46,6 +55,10 @@ class UnitOfWork(ABC):
     def apikey_repo(self) -> ApikeyRepo:
         pass
 
+    @abstractmethod
+    def job_checkpoint_repo(self) -> JobCheckpointRepo:
+        pass
+
     @abstractmethod
     async def __aenter__(self) -> Self:
         pass
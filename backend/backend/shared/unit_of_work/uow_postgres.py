@@ -1,15 +1,20 @@
-from typing import Self, Optional
+from contextlib import asynccontextmanager
+from typing import Self, Optional, Callable
 from uuid import uuid4
 
+from loguru import logger
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, AsyncEngine
 
 from backend.auth.domain.apikey import ApikeyRepo
 from backend.auth.infra.apikey.apikey_repo_sql import SqlApikeyRepo, apikey_table
 from backend.shared.event_driven.base_event import Event
-from backend.shared.unit_of_work.change_log import SqlLogRepo, LogConverter
+from backend.shared.jobs.checkpoint import JobCheckpointRepo
+from backend.shared.jobs.checkpoint_repo_sql import SqlJobCheckpointRepo
+from backend.shared.unit_of_work.change_log import SqlLogRepo, LogConverter, Log
 from backend.shared.unit_of_work.sql_statement_parser import SqlStatementBuilder
 from backend.shared.unit_of_work.uow import UnitOfWorkFactory, UnitOfWork
+from backend.shared.utils.dt import get_current_datetime
 from backend.subscription.domain.exceptions import ActiveStatusConflict
 from backend.subscription.domain.plan_repo import PlanRepo
 from backend.subscription.domain.subscription_repo import SubscriptionRepo
@@ -17,7 +22,9 @@ from backend.subscription.infra.plan_repo_sql import SqlPlanRepo, plan_table
 from backend.subscription.infra.subscription_repo_sql import SqlSubscriptionRepo, subscription_table
 from backend.webhook.domain.delivery_task import DeliveryTaskRepo
 from backend.webhook.domain.webhook_repo import WebhookRepo
-from backend.webhook.infra.delivery_task_repo_sql import SqlDeliveryTaskRepo, delivery_task_table
+from backend.webhook.infra.delivery_task_repo_sql import (
+    SqlDeliveryTaskRepo, delivery_task_table, webhook_message_table, delivery_archive_table
+)
 from backend.webhook.infra.webhook_repo_sql import SqlWebhookRepo, webhook_table
 
 
@@ -35,21 +42,36 @@ TABLES = {
     webhook_table.name: webhook_table,
     subscription_table.name: subscription_table,
     delivery_task_table.name: delivery_task_table,
+    webhook_message_table.name: webhook_message_table,
+    delivery_archive_table.name: delivery_archive_table,
     apikey_table.name: apikey_table,
 }
 
+# Вызывается после успешного коммита с логами закоммиченных изменений
+CommitListener = Callable[[list[Log]], None]
+
 
 class NewUow(UnitOfWork):
-    def __init__(self, session_factory: async_sessionmaker[AsyncSession]):
+    def __init__(
+            self,
+            session_factory: async_sessionmaker[AsyncSession],
+            commit_listeners: Optional[list[CommitListener]] = None,
+    ):
+        self._commit_listeners = commit_listeners or []
         self._transaction_id = None
+        self._started_at = None
         self._session_factory = session_factory
         self._session: Optional[AsyncSession] = None
         self._repos = {}
         self._log_repo: Optional[SqlLogRepo] = None
         self._events = []
+        # Логи изменений, уже выполненных в текущей транзакции
+        self._flushed_logs: list[Log] = []
 
     async def __aenter__(self) -> Self:
         self._transaction_id = uuid4()
+        # Все логи транзакции создаются не раньше этого момента - по нему отсекаются лишние партиции log_table
+        self._started_at = get_current_datetime()
         self._session = self._session_factory()
         self._log_repo = SqlLogRepo(self._session)
         self._repos = {
@@ -57,15 +79,18 @@ class NewUow(UnitOfWork):
             "webhook_repo": SqlWebhookRepo(self._session, self._transaction_id),
             "subscription_repo": SqlSubscriptionRepo(self._session, self._transaction_id),
             "delivery_task_repo": SqlDeliveryTaskRepo(self._session, self._transaction_id),
-            "apikey_repo": SqlApikeyRepo(self._session)
+            "apikey_repo": SqlApikeyRepo(self._session),
+            "job_checkpoint_repo": SqlJobCheckpointRepo(self._session),
         }
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
         self._repos = {}
+        self._flushed_logs = []
         await self._session.close()
         self._session = None
         self._transaction_id = None
+        self._started_at = None
 
     def push_event(self, event: Event) -> None:
         self._events.append(event)
@@ -75,30 +100,70 @@ class NewUow(UnitOfWork):
         self._events = []
         return events
 
-    async def commit(self):
+    async def _flush(self) -> None:
+        logs = []
+        for repo in self._repos.values():
+            if hasattr(repo, "parse_logs"):
+                logs.extend(repo.parse_logs())
+        statements = SqlStatementBuilder(TABLES).load_logs(logs).parse_action_statements()
+
+        # Выполняем запросы к базе
+        for stmt, data in statements:
+            await self._session.execute(stmt, data) if data else await self._session.execute(stmt)
+        self._flushed_logs.extend(logs)
+
+        # Изменения из applied_logs уже в базе (bulk-запросы репозиториев), нужны только их логи
+        for repo in self._repos.values():
+            if hasattr(repo, "parse_applied_logs"):
+                self._flushed_logs.extend(repo.parse_applied_logs())
+
+    @asynccontextmanager
+    async def savepoint(self):
+        # Накопленные до точки сохранения изменения выполняются в основной транзакции
+        await self._flush()
+        logs_mark, events_mark = len(self._flushed_logs), len(self._events)
         try:
-            logs = []
+            async with self._session.begin_nested():
+                yield
+                await self._flush()
+        except Exception as err:
+            # Откатываем и логи, и события блока, иначе commit запишет то, чего нет в базе
             for repo in self._repos.values():
                 if hasattr(repo, "parse_logs"):
-                    logs.extend(repo.parse_logs())
-            statements = SqlStatementBuilder(TABLES).load_logs(logs).parse_action_statements()
+                    repo.parse_logs()
+                if hasattr(repo, "parse_applied_logs"):
+                    repo.parse_applied_logs()
+            del self._flushed_logs[logs_mark:]
+            del self._events[events_mark:]
+            raise convert_error(err)
 
-            # Выполняем запросы к базе
-            for stmt, data in statements:
-                await self._session.execute(stmt, data) if data else await self._session.execute(stmt)
+    async def commit(self):
+        try:
+            await self._flush()
+            logs, self._flushed_logs = self._flushed_logs, []
 
             # Сохраняем логи
             await self._log_repo.add_many_logs(logs)
 
             await self._session.commit()
         except Exception as err:
+            self._flushed_logs = []
             await self._session.rollback()
             err = convert_error(err)
             raise err
 
+        self._notify_commit_listeners(logs)
+
+    def _notify_commit_listeners(self, logs: list[Log]) -> None:
+        for listener in self._commit_listeners:
+            try:
+                listener(logs)
+            except Exception as err:
+                logger.exception(err)
+
     async def rollback(self):
         try:
-            current_logs = await self._log_repo.get_logs_by_transaction_id(self._transaction_id)
+            current_logs = await self._log_repo.get_logs_by_transaction_id(self._transaction_id, since=self._started_at)
 
             model_ids = [x.model_id for x in current_logs]
             previous_logs = await self._log_repo.get_previous_logs(model_ids, self._transaction_id)
@@ -132,11 +197,18 @@ class NewUow(UnitOfWork):
     def apikey_repo(self) -> ApikeyRepo:
         return self._repos["apikey_repo"]
 
+    def job_checkpoint_repo(self) -> JobCheckpointRepo:
+        return self._repos["job_checkpoint_repo"]
+
 
 class SqlUowFactory(UnitOfWorkFactory):
     def __init__(self, engine: AsyncEngine):
         self._engine = engine
         self._session_factory = async_sessionmaker(self._engine, expire_on_commit=False, class_=AsyncSession)
+        self._commit_listeners: list[CommitListener] = []
+
+    def add_commit_listener(self, listener: CommitListener) -> None:
+        self._commit_listeners.append(listener)
 
     def create_uow(self) -> UnitOfWork:
-        return NewUow(self._session_factory)
+        return NewUow(self._session_factory, self._commit_listeners)
@@ -24,6 +24,10 @@ class CacheManager[T](ABC):
     def pop(self, key: str) -> Optional[T]:
         pass
 
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
 
 class InMemoryCacheManager[T](CacheManager):
     def __init__(self, expiration_time: Optional[float] = None):
@@ -52,3 +56,7 @@ class InMemoryCacheManager[T](CacheManager):
     def pop(self, key: str) -> Optional[T]:
         self._expiry.pop(key, None)
         return self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        self._cache = {}
+        self._expiry = {}
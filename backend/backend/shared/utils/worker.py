@@ -1,5 +1,5 @@
 import asyncio
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, Optional
 from uuid import uuid4
 
 from loguru import logger
@@ -12,8 +12,11 @@ class Worker:
             sleep_time=0,
             safe=False,
             task_name: str = None,
+            # Если задан, пауза между запусками вычисляется перед каждым сном вместо sleep_time
+            next_run_delay: Optional[Callable[[], float]] = None,
     ):
         self._callback = callback
+        self._next_run_delay = next_run_delay
         self._STOP_FLAG = False
         self._wake_event = asyncio.Event()
         self._safe = safe
@@ -36,12 +39,21 @@ class Worker:
                     raise err
             finally:
                 try:
-                    await asyncio.wait_for(self._wake_event.wait(), timeout=self._sleep_time)
+                    await asyncio.wait_for(self._wake_event.wait(), timeout=self._get_sleep_time())
                 except asyncio.TimeoutError:
                     pass
                 finally:
                     self._wake_event.clear()
 
+    def _get_sleep_time(self) -> float:
+        if self._next_run_delay is None:
+            return self._sleep_time
+        try:
+            return self._next_run_delay()
+        except Exception as err:
+            logger.exception(err)
+            return self._sleep_time
+
     def run(self):
         logger.info(f"Run {self._task_name}")
         task = asyncio.create_task(self._run())
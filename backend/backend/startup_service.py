@@ -14,11 +14,18 @@ from backend.auth.infra.fastapi_users.sql_repo import User
 from backend.bootstrap import get_container
 from backend.events import EVENTS
 from backend.shared.database import DatabaseManager
-from backend.shared.unit_of_work.change_log import SqlLogRepo
+from backend.shared.jobs.cron import CronExpression
+from backend.shared.jobs.cron_scheduler import CronScheduler, CronJob
+from backend.shared.unit_of_work.change_log import SqlLogRepo, log_partitions
+from backend.shared.unit_of_work.schema_upgrade import LOG_SCHEMA_PRE_CREATE, LOG_SCHEMA_UPGRADES
 from backend.shared.utils.dt import get_current_datetime
 from backend.shared.utils.worker import Worker
 from backend.subscription.application.subscription_manager import SubManager
+from backend.subscription.application.subscription_scheduler import SubScheduler
+from backend.subscription.infra.subscription_repo_sql import parse_subscription_deadlines
 from backend.webhook.adapters import subscription_handlers
+from backend.webhook.infra.delivery_task_repo_sql import delivery_archive_partitions
+from backend.webhook.infra.schema_upgrade import WEBHOOK_SCHEMA_UPGRADES
 
 container = get_container()
 
@@ -58,7 +65,9 @@ class DatabaseStartup(Startup):
         if self._db_recreate:
             await manager.drop_and_create_tables()
         else:
+            await manager.prepare_tables(LOG_SCHEMA_PRE_CREATE)
             await manager.create_tables_if_not_exist()
+            await manager.upgrade_tables(LOG_SCHEMA_UPGRADES + WEBHOOK_SCHEMA_UPGRADES)
 
 
 class FirstUserStartup(Startup):
@@ -121,7 +130,7 @@ class EventbusStartup(Startup):
         logger.info("Subscribe events to eventbus")
         bus = get_container().eventbus()
         for event_type in EVENTS:
-            bus.subscribe(event_type, subscription_handlers.handle_subscription_domain_event)
+            bus.subscribe_batch(event_type, subscription_handlers.handle_subscription_domain_events)
 
 
 class WorkersStartup(Startup):
@@ -131,59 +140,107 @@ class WorkersStartup(Startup):
             subman_check_period: int,
             log_retention_days: int,
             delivery_retention_days,
+            partitions_ahead_days: int,
+            subman_shards: int = 1,
+            subman_parallelism: int = 1,
+            subman_scheduler_capacity: int = 1000,
+            log_cleaner_cron: str = "0 3 * * *",
+            delivery_cleaner_cron: str = "30 3 * * *",
     ):
+        submanager = SubManager(
+            container.unit_of_work_factory(),
+            subman_bulk_limit,
+            container.eventbus(),
+            shards=subman_shards,
+            parallelism=subman_parallelism,
+        )
+        scheduler = SubScheduler(
+            submanager,
+            container.unit_of_work_factory(),
+            check_period=subman_check_period,
+            capacity=subman_scheduler_capacity,
+            on_earlier_deadline=lambda: self._subman_worker.wake(),
+        )
+        container.unit_of_work_factory().add_commit_listener(
+            lambda logs: scheduler.push_many(parse_subscription_deadlines(logs))
+        )
         self._subman_worker = Worker(
-            SubManager(container.unit_of_work_factory(), subman_bulk_limit).manage,
+            scheduler.run,
             sleep_time=subman_check_period,
             safe=False,
             task_name="SubManager worker",
+            next_run_delay=scheduler.next_run_delay,
         )
 
-        self._log_cleaner_worker = Worker(
-            self._clean_old_logs,
-            sleep_time=86_400,
-            safe=False,
-            task_name="LogCleaner worker",
+        self._cron_scheduler = CronScheduler(
+            container.session_factory(),
+            [
+                CronJob("clean_old_logs", CronExpression(log_cleaner_cron), self._clean_old_logs),
+                CronJob(
+                    "clean_old_delivery_tasks", CronExpression(delivery_cleaner_cron), self._clean_old_delivery_tasks
+                ),
+            ],
         )
-
-        self._delivery_cleaner_worker = Worker(
-            self._clean_old_delivery_tasks,
-            sleep_time=86_400,
-            safe=False,
-            task_name="DeliveryCleaner worker",
+        self._cron_worker = Worker(
+            self._cron_scheduler.run,
+            sleep_time=3600,
+            safe=True,
+            task_name="Cron worker",
+            next_run_delay=self._cron_scheduler.next_run_delay,
         )
 
         self._telegraph_worker = container.telegraph_worker()
         self._log_retention_days = log_retention_days
         self._delivery_retention_days = delivery_retention_days
+        self._partitions_ahead_days = partitions_ahead_days
+
+    async def _create_partitions(self):
+        session_factory = container.session_factory()
+        async with session_factory() as session:
+            for partitions in (log_partitions, delivery_archive_partitions):
+                await partitions.create_partitions(
+                    session, get_current_datetime().date(), days=self._partitions_ahead_days + 1
+                )
+            await session.commit()
 
-    async def _clean_old_logs(self):
+    async def _clean_old_logs(self) -> int:
+        await self._create_partitions()
         session_factory = container.session_factory()
         async with session_factory() as session:
             repo = SqlLogRepo(session)
             dt = get_current_datetime().replace(second=0, microsecond=0) - timedelta(days=self._log_retention_days)
-            await repo.delete_old_logs(dt)
+            deleted = await repo.delete_old_logs(dt)
+            await session.commit()
+        logger.info(f"Logs before {dt.strftime("%Y-%m-%d")} were deleted: {deleted}")
+        return deleted
+
+    async def _clean_old_delivery_tasks(self) -> int:
+        await self._create_partitions()
+        dt = get_current_datetime().replace(second=0, microsecond=0) - timedelta(days=self._delivery_retention_days)
+        session_factory = container.session_factory()
+        async with session_factory() as session:
+            dropped = await delivery_archive_partitions.drop_partitions_before(session, dt.date())
             await session.commit()
-        logger.info(f"Logs before {dt.strftime("%Y-%m-%d %H:%M")} were deleted")
+        logger.info(f"Delivery archive partitions were dropped: {list(dropped)}")
 
-    async def _clean_old_delivery_tasks(self):
         async with container.unit_of_work_factory().create_uow() as uow:
-            dt = get_current_datetime().replace(second=0, microsecond=0) - timedelta(days=self._delivery_retention_days)
-            await uow.delivery_task_repo().delete_many_before_date(dt)
+            deleted = await uow.delivery_task_repo().delete_many_before_date(dt)
             await uow.commit()
-        logger.info(f"Deliveries before {dt.strftime("%Y-%m-%d %H:%M")} were deleted")
+        deleted += sum(dropped.values())
+        logger.info(f"Deliveries before {dt.strftime("%Y-%m-%d %H:%M")} were deleted: {deleted}")
+        return deleted
 
     async def run(self):
+        # Очистка идет по расписанию, а партиции на ближайшие дни нужны сразу после старта
+        await self._create_partitions()
         self._subman_worker.run()
         self._telegraph_worker.run()
-        self._log_cleaner_worker.run()
-        self._delivery_cleaner_worker.run()
+        self._cron_worker.run()
 
     async def stop(self):
         self._subman_worker.stop()
         self._telegraph_worker.stop()
-        self._log_cleaner_worker.stop()
-        self._delivery_cleaner_worker.stop()
+        self._cron_worker.stop()
 
 
 class StartupShutdownManager:
@@ -204,12 +261,20 @@ class StartupShutdownManager:
             subman_check_period=config.SUBSCRIPTION_MANAGER_CHECK_PERIOD,
             log_retention_days=config.LOG_RETENTION_DAYS,
             delivery_retention_days=config.DELIVERY_RETENTION_DAYS,
+            partitions_ahead_days=config.PARTITIONS_AHEAD_DAYS,
+            subman_shards=config.SUBSCRIPTION_MANAGER_SHARDS,
+            subman_parallelism=config.SUBSCRIPTION_MANAGER_PARALLELISM,
+            subman_scheduler_capacity=config.SUBSCRIPTION_MANAGER_SCHEDULER_CAPACITY,
+            log_cleaner_cron=config.LOG_CLEANER_CRON,
+            delivery_cleaner_cron=config.DELIVERY_CLEANER_CRON,
     ):
         self._database_startup = DatabaseStartup(db_name, db_host, db_port, db_username, db_pass, db_recreate)
         self._first_user_startup = FirstUserStartup(user_email, user_password, user_apikey_title, user_apikey_public_id,
                                                     user_apikey_secret)
         self._workers_startup = WorkersStartup(subman_bulk_limit, subman_check_period, log_retention_days,
-                                               delivery_retention_days)
+                                               delivery_retention_days, partitions_ahead_days,
+                                               subman_shards, subman_parallelism, subman_scheduler_capacity,
+                                               log_cleaner_cron, delivery_cleaner_cron)
         self._eventbus_startup = EventbusStartup()
 
     async def on_startup(self):
@@ -28,7 +28,6 @@ async def create_one(
         await create_plan(plan, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return plan.id
 
 
@@ -83,7 +82,6 @@ async def update_one(
         await save_updated_plan(old_version, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -99,7 +97,6 @@ async def delete_one(
         await delete_plan(target_plan, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -116,5 +113,4 @@ async def delete_selected(
             await delete_plan(target, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
@@ -1,4 +1,4 @@
-from typing import Optional, Any, Self
+from typing import Optional, Any, Self, Literal
 from uuid import uuid4
 
 from pydantic import Field, AwareDatetime
@@ -51,6 +51,19 @@ class UsageSchema(MyBase):
                      renew_cycle=self.renew_cycle, used_units=self.used_units, last_renew=self.last_renew)
 
 
+class UsageIncrementSchema(MyBase):
+    subscription_id: SubId
+    code: str
+    value: float = Field(gt=0)
+
+
+class UsageIncrementResult(MyBase):
+    subscription_id: SubId
+    code: str
+    # not_processed: чанк инкремента не был сохранен из-за ошибки, его можно отправить повторно
+    status: Literal["ok", "subscription_not_found", "usage_not_found", "not_processed"]
+
+
 class DiscountSchema(MyBase):
     title: str
     code: str
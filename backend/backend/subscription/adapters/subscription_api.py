@@ -1,14 +1,17 @@
+from collections import defaultdict
 from typing import Optional
 
-from fastapi import Depends, APIRouter, Query
+from fastapi import Depends, APIRouter, Query, Body
+from loguru import logger
 from pydantic import AwareDatetime
 
+from backend import config
 from backend.auth.domain.auth_user import AuthUser
 from backend.bootstrap import Bootstrap, get_container, auth_closure
 from backend.shared.utils.permission_service import check_item_owner
 from backend.subscription.adapters.schemas import (
     SubscriptionCreate, SubscriptionUpdate, SubscriptionRetrieve,
-    UsageSchema, PlanInfoSchema, DiscountSchema)
+    UsageSchema, PlanInfoSchema, DiscountSchema, UsageIncrementSchema, UsageIncrementResult)
 from backend.subscription.application import subscription_usecases as services
 from backend.subscription.domain.enums import SubscriptionStatus
 from backend.subscription.domain.events import SubId
@@ -31,7 +34,6 @@ async def create_subscription(
         await services.create_subscription(subscription, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return subscription.id
 
 
@@ -110,7 +112,6 @@ async def delete_one_by_id(
         await container.eventbus().publish_from_unit_of_work(uow)
         check_item_owner(target, auth_user.id)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -143,7 +144,6 @@ async def delete_selected(
             await services.delete_subscription(target, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -164,7 +164,6 @@ async def update_subscription(
         await services.update_subscription_from_another(old_version, new_version, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -183,10 +182,67 @@ async def increase_usage(
         await services.save_updated_subscription(target, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
+@subscription_router.patch("/{sub_id}/consume-usage")
+async def consume_usage(
+        sub_id: SubId,
+        code: str,
+        value: float = Query(gt=0),
+        auth_user: AuthUser = Depends(auth_closure),
+        container: Bootstrap = Depends(get_container),
+) -> float:
+    async with container.unit_of_work_factory().create_uow() as uow:
+        # get_one_by_id берет строку FOR UPDATE, поэтому проверка и списание атомарны
+        target = await uow.subscription_repo().get_one_by_id(sub_id)
+        check_item_owner(target, auth_user.id)
+        usage = target.usages.get(code)
+        usage.consume(value)
+        await services.save_updated_subscription(target, uow)
+        await container.eventbus().publish_from_unit_of_work(uow)
+        await uow.commit()
+    return usage.remaining_units
+
+
+@subscription_router.post("/usage-batch")
+async def increase_usages_in_batch(
+        increments: list[UsageIncrementSchema] = Body(max_length=config.USAGE_BATCH_MAX_SIZE),
+        auth_user: AuthUser = Depends(auth_closure),
+        container: Bootstrap = Depends(get_container),
+) -> list[UsageIncrementResult]:
+    """
+    Chunks are committed one by one. If a chunk fails, its increments and all the following ones get
+    the not_processed status, the earlier chunks stay committed and keep their statuses.
+    """
+    # Группируем инкременты по подписке, сохраняя исходный порядок внутри группы
+    grouped = defaultdict(list)
+    for index, increment in enumerate(increments):
+        grouped[increment.subscription_id].append(index)
+    sub_ids = sorted(grouped.keys())
+
+    statuses: list[str] = ["not_processed"] * len(increments)
+    chunk_size = config.USAGE_BATCH_CHUNK_SIZE
+    for start in range(0, len(sub_ids), chunk_size):
+        indexes = [i for sub_id in sub_ids[start:start + chunk_size] for i in grouped[sub_id]]
+        chunk = [(increments[i].subscription_id, increments[i].code, increments[i].value) for i in indexes]
+        try:
+            async with container.unit_of_work_factory().create_uow() as uow:
+                chunk_statuses = await services.increase_usages(chunk, auth_user.id, uow)
+                await container.eventbus().publish_from_unit_of_work(uow)
+                await uow.commit()
+        except Exception as err:
+            not_processed = sum(len(grouped[sub_id]) for sub_id in sub_ids[start:])
+            logger.exception(f"Usage batch stopped, {not_processed} increments were not processed: {err}")
+            break
+        for i, status in zip(indexes, chunk_statuses):
+            statuses[i] = status
+    return [
+        UsageIncrementResult(subscription_id=increment.subscription_id, code=increment.code, status=status)
+        for increment, status in zip(increments, statuses)
+    ]
+
+
 @subscription_router.patch("/{sub_id}/add-usages")
 async def add_usages(
         sub_id: SubId,
@@ -202,7 +258,6 @@ async def add_usages(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -221,7 +276,6 @@ async def remove_usages(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -240,7 +294,6 @@ async def update_usages(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -258,7 +311,6 @@ async def update_plan(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -275,7 +327,6 @@ async def pause_subscription(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -292,7 +343,6 @@ async def resume_subscription(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -310,7 +360,6 @@ async def renew_subscription(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -327,7 +376,6 @@ async def expire_subscription(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -346,7 +394,6 @@ async def add_discounts(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -365,7 +412,6 @@ async def remove_discounts(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
 
 
@@ -384,5 +430,4 @@ async def update_discounts(
         await services.save_updated_subscription(target_sub, uow)
         await container.eventbus().publish_from_unit_of_work(uow)
         await uow.commit()
-    container.telegraph_worker().wake()
     return "Ok"
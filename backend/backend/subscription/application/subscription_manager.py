@@ -1,77 +1,129 @@
+from datetime import datetime
+from typing import Optional, Callable, Awaitable
+from uuid import UUID
+
 from loguru import logger
 
+from backend.shared.event_driven.base_event import Event, ItemUpdated
+from backend.shared.event_driven.bus import Bus
+from backend.shared.jobs.batch_job import BatchJob, BatchJobRunner, process_batch
+from backend.shared.jobs.checkpoint import Cursor
+
 from backend.shared.unit_of_work.uow import UnitOfWorkFactory, UnitOfWork
 from backend.shared.utils.dt import get_current_datetime
 from backend.subscription.application.subscription_usecases import save_updated_subscription
-from backend.subscription.domain.enums import SubscriptionStatus
 from backend.subscription.domain.subscription import Subscription
-from backend.subscription.domain.subscription_repo import SubscriptionSby
+from backend.subscription.domain.subscription_repo import Shard
+from backend.subscription.domain.subscription_services import SubscriptionEventParser
+from backend.subscription.domain.usage import Usage
 
 
 class SubManager:
-    def __init__(self, uow_factory: UnitOfWorkFactory, bulk_limit=100):
+    def __init__(
+            self,
+            uow_factory: UnitOfWorkFactory,
+            bulk_limit=100,
+            eventbus: Optional[Bus] = None,
+            shards: int = 1,
+            parallelism: int = 1,
+    ):
+        """
+        :param shards: Subscriptions are split into this many shards, every shard is processed by one replica at a time.
+            Must be the same on all replicas.
+        :param parallelism: How many shards this replica processes concurrently.
+        """
         self._uow_factory = uow_factory
         self._bulk_limit = bulk_limit
+        self._eventbus = eventbus
+        self._runner = BatchJobRunner(uow_factory, batch_size=bulk_limit, parts=shards, parallelism=parallelism)
 
-    @staticmethod
-    async def _processing_expired_sub(sub: Subscription, uow: UnitOfWork):
-        try:
-            sub.expire()
-            await save_updated_subscription(sub, uow)
-            # Если есть подписка на паузе, то возобновляем
-            sby = SubscriptionSby(
-                statuses={SubscriptionStatus.Paused},
-                subscriber_ids={sub.subscriber_id},
-                order_by=[("plan_info.level", -1)],
-                auth_ids={sub.auth_id},
-                limit=1,
-            )
-            other_subscriber_subs = await uow.subscription_repo().get_selected(sby)
-            for other_sub in other_subscriber_subs:
-                other_sub.resume()
-                await save_updated_subscription(other_sub, uow)
-        except Exception as err:
-            logger.exception(err)
+    async def _commit(self, uow: UnitOfWork) -> None:
+        # События публикуются до коммита: обработчики пишут доставки вебхуков в ту же транзакцию
+        if self._eventbus is not None:
+            await self._eventbus.publish_from_unit_of_work(uow)
+        await uow.commit()
 
     async def manage_expired_subscriptions(self):
-        while True:
-            async with self._uow_factory.create_uow() as uow:
-                sby = SubscriptionSby(
-                    statuses={SubscriptionStatus.Active},
-                    expiration_date_lt=get_current_datetime(),
-                    limit=self._bulk_limit,
-                )
-                expired_subscriptions = await uow.subscription_repo().get_selected(sby)
-                if len(expired_subscriptions) == 0:
-                    break
-
-                logger.info(f"{len(expired_subscriptions)} active subscriptions needed to change status into expired")
-                for sub in expired_subscriptions:
-                    await self._processing_expired_sub(sub, uow)
-
-                await uow.commit()
+        await self._runner.run(ExpireSubscriptionsJob(self._commit))
+
+    async def _renew_usages_batch(self, uow: UnitOfWork, part: int, parts: int) -> bool:
+        shard = Shard(part, parts)
+        renewed = await uow.subscription_repo().renew_usages(get_current_datetime(), self._bulk_limit, shard)
+        if not renewed:
+            return False
+
+        logger.info(f"{len(renewed)} subscriptions renewed usages")
+        for sub, old_usages in renewed:
+            for ev in self._usage_renewal_events(sub, old_usages):
+                uow.push_event(ev)
+        await self._commit(uow)
+        return True
 
     async def manage_usages(self):
-        while True:
-            async with self._uow_factory.create_uow() as uow:
-                targets = await uow.subscription_repo().get_selected(
-                    SubscriptionSby(
-                        usage_renew_date_lt=get_current_datetime(),
-                        limit=self._bulk_limit,
-                    )
-                )
-                if len(targets) == 0:
-                    break
-
-                logger.info(f"{len(targets)} subscriptions needed to renew usages")
-                for target in targets:
-                    for usage in target.usages:
-                        if usage.need_to_renew:
-                            usage.renew()
-                    await save_updated_subscription(target, uow)
-                await uow.commit()
+        # Обновленные строки сами выпадают из выборки, поэтому курсор и чекпоинт не нужны
+        await self._runner.run_parts(try_lock_shard, self._renew_usages_batch)
+
+    @staticmethod
+    def _usage_renewal_events(sub: Subscription, old_usages: list[Usage]) -> list[Event]:
+        # Usages обновлены запросом в базе, события собираем из пары до/после
+        old_by_code = {usage.code: usage for usage in old_usages}
+        changes = []
+        for usage in sub.usages.get_all():
+            old_usage = old_by_code.get(usage.code)
+            if old_usage is not None and old_usage != usage:
+                changes.append(ItemUpdated(new_item=usage, old_item=old_usage))
+        return SubscriptionEventParser(sub).parse(changes)
 
     async def manage(self):
         logger.info("Managing subscriptions")
         await self.manage_expired_subscriptions()
         await self.manage_usages()
+
+
+async def try_lock_shard(uow: UnitOfWork, part: int, parts: int) -> bool:
+    # Шард в каждой транзакции обрабатывает только одна реплика
+    return await uow.subscription_repo().try_lock_shard(Shard(part, parts))
+
+
+class ExpireSubscriptionsJob(BatchJob[Subscription]):
+    name = "expire_subscriptions"
+
+    def __init__(self, commit: Callable[[UnitOfWork], Awaitable[None]]):
+        self._commit = commit
+
+    async def try_acquire(self, uow: UnitOfWork, part: int, parts: int) -> bool:
+        return await try_lock_shard(uow, part, parts)
+
+    async def fetch(self, uow: UnitOfWork, after: Optional[Cursor], limit: int, part: int, parts: int):
+        if after is not None:
+            after = (datetime.fromisoformat(after[0]), UUID(after[1]))
+        expired = await uow.subscription_repo().get_expired(get_current_datetime(), limit, Shard(part, parts), after)
+        if expired:
+            logger.info(f"{len(expired)} active subscriptions needed to change status into expired")
+        return expired
+
+    def cursor_of(self, item: Subscription) -> Cursor:
+        return [item.expiration_date.isoformat(), str(item.id)]
+
+    async def process(self, uow: UnitOfWork, item: Subscription) -> None:
+        item.expire()
+        await save_updated_subscription(item, uow)
+
+    async def after_batch(self, uow: UnitOfWork, items: list[Subscription]) -> None:
+        # Истекшие подписки уже сохранены и освободили _active_status_guard, теперь можно возобновлять.
+        # Для каждого подписчика возобновляем подписку на паузе с самым высоким уровнем плана
+        subscribers = {(sub.auth_id, sub.subscriber_id) for sub in items}
+        repo = uow.subscription_repo()
+        candidates = await repo.get_resume_candidates(subscribers)
+        await process_batch(uow, candidates, self._resume, lambda: repo.get_resume_candidates(subscribers))
+
+    @staticmethod
+    async def _resume(uow: UnitOfWork, sub: Subscription) -> None:
+        sub.resume()
+        await save_updated_subscription(sub, uow)
+
+    async def commit(self, uow: UnitOfWork) -> None:
+        await self._commit(uow)
+
+    def lag_of(self, item: Subscription) -> Optional[float]:
+        return (get_current_datetime() - item.expiration_date).total_seconds()
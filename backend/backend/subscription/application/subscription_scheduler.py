@@ -0,0 +1,99 @@
+import heapq
+import math
+import time
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional
+
+from pydantic import AwareDatetime
+
+from backend.shared.unit_of_work.uow import UnitOfWorkFactory
+from backend.subscription.application.subscription_manager import SubManager
+
+
+class SubScheduler:
+    """
+    Runs SubManager when the nearest expiration or usage renewal is due instead of on a fixed period.
+
+    Only the nearest `capacity` deadlines are kept in memory. Deadlines of subscriptions committed by this
+    process are pushed from the commit listener, the ones from other replicas are picked up by the
+    periodic run every check_period.
+    """
+
+    def __init__(
+            self,
+            manager: SubManager,
+            uow_factory: UnitOfWorkFactory,
+            check_period: float,
+            capacity: int = 1000,
+            on_earlier_deadline: Optional[Callable[[], None]] = None,
+    ):
+        self._manager = manager
+        self._uow_factory = uow_factory
+        self._check_period = check_period
+        self._capacity = capacity
+        self._on_earlier_deadline = on_earlier_deadline
+        self._deadlines: list[float] = []
+        # Сроки позже горизонта не загружены в память, None - куча еще не заполнялась
+        self._horizon: Optional[float] = None
+        self._last_run_at: Optional[float] = None
+
+    def push_many(self, deadlines: Iterable[AwareDatetime]) -> None:
+        if self._horizon is None:
+            return
+        earliest = self._deadlines[0] if self._deadlines else math.inf
+        for deadline in deadlines:
+            ts = deadline.timestamp()
+            if ts <= self._horizon:
+                heapq.heappush(self._deadlines, ts)
+        if len(self._deadlines) > 2 * self._capacity:
+            self._trim()
+        if self._deadlines and self._deadlines[0] < earliest and self._on_earlier_deadline:
+            self._on_earlier_deadline()
+
+    def _trim(self) -> None:
+        self._deadlines = heapq.nsmallest(self._capacity, self._deadlines)
+        self._horizon = self._deadlines[-1]
+
+    def next_run_delay(self) -> float:
+        """Seconds until the next run is needed, capped by check_period"""
+        delay = self._check_period
+        if self._last_run_at is not None:
+            delay = max(0.0, self._check_period - (time.monotonic() - self._last_run_at))
+        if self._deadlines:
+            delay = min(delay, max(0.0, self._deadlines[0] - time.time()))
+        return delay
+
+    def _is_periodic_run_due(self) -> bool:
+        return self._last_run_at is None or time.monotonic() - self._last_run_at >= self._check_period
+
+    async def run(self):
+        started_at = time.time()
+        periodic = self._is_periodic_run_due()
+        if not periodic and not (self._deadlines and self._deadlines[0] <= started_at):
+            return
+
+        if periodic:
+            self._last_run_at = time.monotonic()
+        await self._manager.manage()
+        while self._deadlines and self._deadlines[0] <= started_at:
+            heapq.heappop(self._deadlines)
+
+        # Перечитываем сроки из базы, только когда куча опустела или при плановом запуске
+        if periodic or not self._deadlines:
+            await self._refill(started_at)
+
+    async def _refill(self, after: float) -> None:
+        after = datetime.fromtimestamp(after, timezone.utc)
+        async with self._uow_factory.create_uow() as uow:
+            expiration_dates = await uow.subscription_repo().get_expiration_dates(after, self._capacity)
+            renew_dates = await uow.subscription_repo().get_usage_renew_dates(after, self._capacity)
+
+        # Полный список сроков означает, что за последним из них могут быть еще не загруженные
+        horizon = math.inf
+        for dates in (expiration_dates, renew_dates):
+            if len(dates) >= self._capacity:
+                horizon = min(horizon, dates[-1].timestamp())
+
+        self._horizon = horizon
+        self._deadlines = [x.timestamp() for x in expiration_dates + renew_dates if x.timestamp() <= horizon]
+        heapq.heapify(self._deadlines)
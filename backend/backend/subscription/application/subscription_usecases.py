@@ -1,10 +1,17 @@
+from typing import Literal
+
+from backend.auth.domain.auth_user import AuthId
 from backend.shared.unit_of_work.uow import UnitOfWork
 from backend.shared.utils.dt import get_current_datetime
-from backend.subscription.domain.events import SubDeleted, SubCreated
+from backend.subscription.domain.events import SubDeleted, SubCreated, SubId
 from backend.subscription.domain.subscription import (
     Subscription, )
+from backend.subscription.domain.subscription_repo import SubscriptionSby
 from backend.subscription.domain.subscription_services import SubscriptionEventParser, SubscriptionUpdater
 
+UsageIncrement = tuple[SubId, str, float]
+UsageIncrementStatus = Literal["ok", "subscription_not_found", "usage_not_found"]
+
 
 async def create_subscription(new_sub: Subscription, uow: UnitOfWork) -> None:
     current_sub = await uow.subscription_repo().get_subscriber_active_one(
@@ -59,3 +66,34 @@ async def delete_subscription(target: Subscription, uow: UnitOfWork) -> None:
         auth_id=target.auth_id
     )
     uow.push_event(event)
+
+
+async def increase_usages(
+        increments: list[UsageIncrement],
+        auth_id: AuthId,
+        uow: UnitOfWork,
+) -> list[UsageIncrementStatus]:
+    sub_ids = {sub_id for sub_id, _code, _value in increments}
+    # Блокируем строки в порядке id, чтобы параллельные батчи не ловили deadlock
+    sby = SubscriptionSby(ids=sub_ids, auth_ids={auth_id}, order_by=[("id", 1)], limit=len(sub_ids))
+    targets = {sub.id: sub for sub in await uow.subscription_repo().get_selected(sby)}
+
+    statuses: list[UsageIncrementStatus] = []
+    changed: dict[SubId, Subscription] = {}
+    for sub_id, code, value in increments:
+        target = targets.get(sub_id)
+        if target is None:
+            statuses.append("subscription_not_found")
+            continue
+        try:
+            usage = target.usages.get(code)
+        except KeyError:
+            statuses.append("usage_not_found")
+            continue
+        usage.increase(value)
+        changed[sub_id] = target
+        statuses.append("ok")
+
+    for target in changed.values():
+        await save_updated_subscription(target, uow)
+    return statuses
@@ -10,3 +10,24 @@ class ActiveStatusConflict(Exception):
             "exception_code": "active_status_conflict",
             "subscriber_id": self.subscriber_id,
         }
+
+
+class UsageLimitExceeded(Exception):
+    def __init__(self, code: str, remaining_units: float, requested_units: float):
+        self.code = code
+        self.remaining_units = remaining_units
+        self.requested_units = requested_units
+
+    def __str__(self):
+        return (
+            f"Usage '{self.code}' has {self.remaining_units} units left, "
+            f"but {self.requested_units} units were requested"
+        )
+
+    def to_json(self):
+        return {
+            "exception_code": "usage_limit_exceeded",
+            "code": self.code,
+            "remaining_units": self.remaining_units,
+            "requested_units": self.requested_units,
+        }
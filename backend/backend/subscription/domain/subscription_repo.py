@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Iterable
+from typing import Optional, Iterable, NamedTuple
 
 from pydantic import AwareDatetime
 
@@ -9,6 +9,7 @@ from backend.shared.enums import Lock
 from backend.subscription.domain.subscription import Subscription
 from backend.subscription.domain.enums import SubscriptionStatus
 from backend.subscription.domain.events import SubId
+from backend.subscription.domain.usage import Usage
 
 
 class SubscriptionSby(BaseSby):
@@ -23,6 +24,15 @@ class SubscriptionSby(BaseSby):
     usage_renew_date_lt: Optional[AwareDatetime] = None
 
 
+class Shard(NamedTuple):
+    """A slice of subscriptions selected by the hash of (auth_id, subscriber_id)."""
+    index: int
+    total: int
+
+
+ALL_SHARDS = Shard(0, 1)
+
+
 class SubscriptionRepo(ABC):
     @abstractmethod
     async def create_indexes(self):
@@ -52,6 +62,50 @@ class SubscriptionRepo(ABC):
     async def get_subscriber_active_one(self, subscriber_id: str, auth_id: AuthId, lock: Lock = "write") -> Optional[Subscription]:
         pass
 
+    @abstractmethod
+    async def get_expired(
+            self,
+            now: AwareDatetime,
+            limit: int,
+            shard: Shard = ALL_SHARDS,
+            after: Optional[tuple[AwareDatetime, SubId]] = None,
+    ) -> list[Subscription]:
+        """
+        Active subscriptions with expiration date before now, ordered by (expiration date, id).
+        Rows locked by other transactions are skipped.
+        """
+        pass
+
+    @abstractmethod
+    async def get_resume_candidates(self, subscribers: Iterable[tuple[AuthId, str]]) -> list[Subscription]:
+        """The paused subscription with the highest plan level for every (auth_id, subscriber_id) pair"""
+        pass
+
+    @abstractmethod
+    async def get_expiration_dates(self, after: AwareDatetime, limit: int) -> list[AwareDatetime]:
+        """The nearest expiration dates of active subscriptions after the given moment, ascending."""
+        pass
+
+    @abstractmethod
+    async def get_usage_renew_dates(self, after: AwareDatetime, limit: int) -> list[AwareDatetime]:
+        """The nearest usage renew dates after the given moment, ascending."""
+        pass
+
+    @abstractmethod
+    async def try_lock_shard(self, shard: Shard) -> bool:
+        """Takes the shard until the end of the transaction, False if another transaction holds it."""
+        pass
+
+    @abstractmethod
+    async def renew_usages(
+            self,
+            now: AwareDatetime,
+            limit: int,
+            shard: Shard = ALL_SHARDS,
+    ) -> list[tuple[Subscription, list[Usage]]]:
+        """Renews due usages of up to limit subscriptions in place, returns them with their previous usages."""
+        pass
+
     @abstractmethod
     async def delete_many(self, items: Iterable[Subscription]) -> None:
         pass
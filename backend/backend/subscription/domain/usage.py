@@ -6,6 +6,7 @@ from pydantic import AwareDatetime
 from backend.shared.event_driven.eventable import Eventable
 from backend.shared.utils.dt import get_current_datetime
 from backend.subscription.domain.cycle import Period
+from backend.subscription.domain.exceptions import UsageLimitExceeded
 
 
 class UsageRate(Eventable):
@@ -72,9 +73,21 @@ class Usage(Eventable):
     def need_to_renew(self) -> bool:
         return get_current_datetime() > self.renew_cycle.get_next_billing_date(self.last_renew)
 
+    @property
+    def remaining_units(self) -> float:
+        return self.available_units - self.used_units
+
     def increase(self, delta: float) -> None:
         self.used_units += delta
 
+    def consume(self, delta: float) -> None:
+        if delta <= 0:
+            raise ValueError(f"Consumed units must be positive, got {delta}")
+        remaining_units = self.remaining_units
+        if delta > remaining_units:
+            raise UsageLimitExceeded(self.code, remaining_units, delta)
+        self.used_units += delta
+
     def renew(self):
         self.used_units = 0
         self.last_renew = get_current_datetime()
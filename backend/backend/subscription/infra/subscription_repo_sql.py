@@ -2,7 +2,8 @@ from typing import Iterable, Mapping, Type, Any
 from typing import Optional
 from uuid import uuid4
 
-from sqlalchemy import Column, String, Table, ForeignKey
+from pydantic import AwareDatetime
+from sqlalchemy import Column, String, Table, ForeignKey, select, func, tuple_, text, bindparam, column, cast, Text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.sqltypes import UUID, Integer, Float
@@ -17,7 +18,8 @@ from backend.subscription.domain.cycle import Period
 from backend.subscription.domain.enums import SubscriptionStatus
 from backend.subscription.domain.events import SubId
 from backend.subscription.domain.subscription import Subscription, BillingInfo, PlanInfo
-from backend.subscription.domain.subscription_repo import SubscriptionSby, SubscriptionRepo
+from backend.subscription.domain.subscription_repo import SubscriptionSby, SubscriptionRepo, Shard, ALL_SHARDS
+from backend.subscription.domain.usage import Usage
 from backend.subscription.infra.deserializers import deserialize_uuid, deserialize_datetime, deserialize_usage, \
     deserialize_discount
 from backend.subscription.infra.serializers import serialize_subscription
@@ -50,6 +52,85 @@ subscription_table = Table(
     Column("_active_status_guard", String, unique=True, nullable=False),
 )
 
+_cycle_days_case = "CASE e.value->>'renew_cycle' {} END".format(
+    " ".join(f"WHEN '{period.value}' THEN {period.get_cycle_in_days()}" for period in Period)
+)
+
+# Обновляет usages в самой базе: обнуляет used_units у просроченных и пересчитывает
+# _earliest_next_renew_in_usages тем же запросом. Логика совпадает с Usage.need_to_renew/renew.
+_renew_usages_stmt = (
+    text(f"""
+        WITH target AS (
+            SELECT id FROM subscription
+            WHERE _earliest_next_renew_in_usages < :now
+                AND abs(hashtext(CAST(auth_id AS text) || subscriber_id) % :shard_total) = :shard_index
+            ORDER BY _earliest_next_renew_in_usages
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        ),
+        renewed AS (
+            SELECT
+                s.id,
+                s.usages AS old_usages,
+                jsonb_agg(
+                    CASE WHEN u.due
+                        THEN u.value || jsonb_build_object('used_units', 0, 'last_renew', CAST(:now_iso AS text))
+                        ELSE u.value
+                    END
+                    ORDER BY u.ord
+                ) AS usages,
+                min(CASE WHEN u.due THEN :now ELSE u.last_renew END + make_interval(days => u.days)) AS earliest
+            FROM subscription s
+            JOIN target ON target.id = s.id
+            CROSS JOIN LATERAL (
+                SELECT
+                    e.value,
+                    e.ord,
+                    d.days,
+                    CAST(e.value->>'last_renew' AS timestamptz) AS last_renew,
+                    CAST(e.value->>'last_renew' AS timestamptz) + make_interval(days => d.days) < :now AS due
+                FROM jsonb_array_elements(s.usages) WITH ORDINALITY AS e(value, ord)
+                CROSS JOIN LATERAL (SELECT {_cycle_days_case} AS days) d
+            ) u
+            GROUP BY s.id
+        )
+        UPDATE subscription
+        SET usages = renewed.usages,
+            _earliest_next_renew_in_usages = renewed.earliest,
+            updated_at = :now
+        FROM renewed
+        WHERE subscription.id = renewed.id
+        RETURNING subscription.*, renewed.old_usages
+    """)
+    .bindparams(
+        bindparam("now", type_=AwareDateTime(timezone=True)),
+        bindparam("now_iso", type_=String),
+        bindparam("limit", type_=Integer),
+        bindparam("shard_total", type_=Integer),
+        bindparam("shard_index", type_=Integer),
+    )
+    .columns(*subscription_table.c, column("old_usages", JSONB))
+)
+
+
+def _shard_filter(shard: Shard):
+    # Все подписки одного подписчика попадают в один шард, поэтому возобновление не пересекает шарды
+    key = cast(subscription_table.c["auth_id"], Text).concat(subscription_table.c["subscriber_id"])
+    return func.abs(func.hashtext(key, type_=Integer) % shard.total) == shard.index
+
+
+def parse_subscription_deadlines(logs: Iterable[Log]) -> list[AwareDatetime]:
+    """Returns the expiration and usage renew dates of the inserted and updated subscriptions."""
+    result = []
+    for log in logs:
+        if log.collection_name != subscription_table.name or log.action not in ("insert", "update"):
+            continue
+        if log.model_state["status"] == SubscriptionStatus.Active:
+            result.append(deserialize_datetime(log.model_state["_expiration_date"]))
+        if log.model_state["_earliest_next_renew_in_usages"] is not None:
+            result.append(deserialize_datetime(log.model_state["_earliest_next_renew_in_usages"]))
+    return result
+
 
 class SubscriptionSqlMapper(SQLMapper):
     def get_entity_type(self) -> Type[Any]:
@@ -183,6 +264,108 @@ class SqlSubscriptionRepo(SubscriptionRepo):
         record = result.mappings().one_or_none()
         return self._base_repo.mapper.mapping_to_entity(record) if record else None
 
+    async def get_expired(
+            self,
+            now: AwareDatetime,
+            limit: int,
+            shard: Shard = ALL_SHARDS,
+            after: Optional[tuple[AwareDatetime, SubId]] = None,
+    ) -> list[Subscription]:
+        keyset = (subscription_table.c["_expiration_date"], subscription_table.c["id"])
+        stmt = (
+            subscription_table
+            .select()
+            .where(
+                subscription_table.c["status"] == SubscriptionStatus.Active,
+                subscription_table.c["_expiration_date"] < now,
+                _shard_filter(shard),
+            )
+            .order_by(*keyset)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(*keyset) > after)
+        result = await self._base_repo.session.execute(stmt)
+        return [self._base_repo.mapper.mapping_to_entity(x) for x in result.mappings()]
+
+    async def get_resume_candidates(self, subscribers: Iterable[tuple[AuthId, str]]) -> list[Subscription]:
+        subscribers = list(subscribers)
+        if not subscribers:
+            return []
+        table = subscription_table
+        ranked = (
+            select(
+                table.c["id"],
+                func.row_number()
+                .over(
+                    partition_by=[table.c["auth_id"], table.c["subscriber_id"]],
+                    order_by=[table.c["pi_level"].desc(), table.c["id"]],
+                )
+                .label("rn")
+            )
+            .where(
+                table.c["status"] == SubscriptionStatus.Paused,
+                tuple_(table.c["auth_id"], table.c["subscriber_id"]).in_(subscribers),
+            )
+            .subquery()
+        )
+        # Оконные функции несовместимы с FOR UPDATE, поэтому блокируем строки во внешнем запросе
+        stmt = (
+            table
+            .select()
+            .where(table.c["id"].in_(select(ranked.c["id"]).where(ranked.c["rn"] == 1)))
+            .with_for_update()
+        )
+        result = await self._base_repo.session.execute(stmt)
+        return [self._base_repo.mapper.mapping_to_entity(x) for x in result.mappings()]
+
+    async def get_expiration_dates(self, after: AwareDatetime, limit: int) -> list[AwareDatetime]:
+        column = subscription_table.c["_expiration_date"]
+        stmt = (
+            select(column)
+            .where(subscription_table.c["status"] == SubscriptionStatus.Active, column > after)
+            .order_by(column)
+            .limit(limit)
+        )
+        result = await self._base_repo.session.execute(stmt)
+        return list(result.scalars())
+
+    async def get_usage_renew_dates(self, after: AwareDatetime, limit: int) -> list[AwareDatetime]:
+        column = subscription_table.c["_earliest_next_renew_in_usages"]
+        stmt = select(column).where(column > after).order_by(column).limit(limit)
+        result = await self._base_repo.session.execute(stmt)
+        return list(result.scalars())
+
+    async def try_lock_shard(self, shard: Shard) -> bool:
+        # Блокировка уровня транзакции: если реплика упала, шард освобождается вместе с ее соединением
+        stmt = select(func.pg_try_advisory_xact_lock(func.hashtext(f"subscription_shard:{shard.total}"), shard.index))
+        result = await self._base_repo.session.execute(stmt)
+        return result.scalar_one()
+
+    async def renew_usages(
+            self,
+            now: AwareDatetime,
+            limit: int,
+            shard: Shard = ALL_SHARDS,
+    ) -> list[tuple[Subscription, list[Usage]]]:
+        result = await self._base_repo.session.execute(
+            _renew_usages_stmt,
+            {
+                "now": now,
+                "now_iso": now.isoformat(),
+                "limit": limit,
+                "shard_total": shard.total,
+                "shard_index": shard.index,
+            },
+        )
+        renewed = []
+        for record in result.mappings():
+            sub = self._base_repo.mapper.mapping_to_entity(record)
+            renewed.append((sub, [deserialize_usage(x) for x in record["old_usages"]]))
+        self._base_repo.add_applied_updates(sub for sub, _ in renewed)
+        return renewed
+
     async def delete_one(self, item: Subscription) -> None:
         await self._base_repo.delete_one(item)
 
@@ -191,3 +374,6 @@ class SqlSubscriptionRepo(SubscriptionRepo):
 
     def parse_logs(self) -> list[Log]:
         return self._base_repo.parse_logs()
+
+    def parse_applied_logs(self) -> list[Log]:
+        return self._base_repo.parse_applied_logs()
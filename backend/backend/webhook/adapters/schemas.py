@@ -1,3 +1,4 @@
+from typing import Optional, Literal
 from uuid import uuid4
 
 from pydantic import Field, AwareDatetime
@@ -8,6 +9,8 @@ from backend.shared.utils.dt import get_current_datetime
 from backend.webhook.domain.webhook import WebhookId, Webhook
 
 DELAYS = (0, 9, 29, 180, 600, 1_800, 3_600, 7_200, 14_400, 28_800, 57_600, 86_400)
+MAX_BATCH_SIZE = 1000
+MAX_AGGREGATION_WINDOW = 3600
 
 
 class WebhookCreate(MyBase):
@@ -15,6 +18,9 @@ class WebhookCreate(MyBase):
     event_code: str
     target_url: str
     delays: tuple[int, ...] = DELAYS
+    batch_size: int = Field(1, ge=1, le=MAX_BATCH_SIZE)
+    aggregation_window: int = Field(0, ge=0, le=MAX_AGGREGATION_WINDOW)
+    compression: Optional[Literal["gzip", "zstd"]] = None
 
     def to_webhook(self, auth_id: AuthId):
         dt = get_current_datetime()
@@ -23,6 +29,9 @@ class WebhookCreate(MyBase):
             event_code=self.event_code,
             target_url=self.target_url,
             delays=self.delays,
+            batch_size=self.batch_size,
+            aggregation_window=self.aggregation_window,
+            compression=self.compression,
             auth_id=auth_id,
             created_at=dt,
             updated_at=dt,
@@ -34,6 +43,10 @@ class WebhookUpdate(MyBase):
     event_code: str
     target_url: str
     delays: tuple[int, ...]
+    enabled: bool = True
+    batch_size: int = Field(1, ge=1, le=MAX_BATCH_SIZE)
+    aggregation_window: int = Field(0, ge=0, le=MAX_AGGREGATION_WINDOW)
+    compression: Optional[Literal["gzip", "zstd"]] = None
 
     def to_webhook(self, auth_id: AuthId, created_at: AwareDatetime):
         return Webhook(
@@ -42,10 +55,35 @@ class WebhookUpdate(MyBase):
             delays=self.delays,
             event_code=self.event_code,
             target_url=self.target_url,
+            enabled=self.enabled,
+            batch_size=self.batch_size,
+            aggregation_window=self.aggregation_window,
+            compression=self.compression,
             created_at=created_at,
             updated_at=get_current_datetime(),
         )
 
     @classmethod
     def from_webhook(cls, hook: Webhook):
-        return cls(id=hook.id, event_code=hook.event_code, target_url=hook.target_url, delays=hook.delays)
+        return cls(
+            id=hook.id,
+            event_code=hook.event_code,
+            target_url=hook.target_url,
+            delays=hook.delays,
+            enabled=hook.enabled,
+            batch_size=hook.batch_size,
+            aggregation_window=hook.aggregation_window,
+            compression=hook.compression,
+        )
+
+
+class DeliveryStats(MyBase):
+    # Запросы клиента, выполняемые этим процессом
+    in_flight: int
+    # Лимиты процесса, общие для всех клиентов
+    max_concurrency: int
+    max_concurrency_per_host: int
+    in_flight_by_host: dict[str, int]
+    # Доставки клиента, ожидающие отправки: в базе и в очереди процесса
+    backlog: int = 0
+    queued: int = 0
@@ -1,11 +1,19 @@
+from datetime import timedelta
+from typing import Optional
+from uuid import UUID, uuid4
+
 import aiohttp
 
+from backend import config
 from backend.bootstrap import get_container
 from backend.shared.event_driven.base_event import Event
 from backend.shared.event_driven.bus import Context
+from backend.shared.utils.dt import get_current_datetime
+from backend.subscription.domain.events import SubUsageUpdated
+from backend.webhook.application.compression import compress
 from backend.webhook.application.telegraph import DeliveryTask
 from backend.webhook.domain.delivery_task import Message
-from backend.webhook.domain.webhook_repo import WebhookSby
+from backend.webhook.domain.webhook import Webhook
 
 container = get_container()
 
@@ -29,6 +37,14 @@ EVENT_PARTKEY_MAPPING = {
 }
 
 
+def get_aggregation_key(event: Event) -> Optional[str]:
+    # Агрегируются только события списания usage, по одному ключу на usage: у слитого сообщения
+    # суммарный delta и итоговые значения. Остальные изменения доставляются как есть
+    if isinstance(event, SubUsageUpdated):
+        return f"{event.subscription_id}:usages.{event.code}"
+    return None
+
+
 async def request(method: str, url: str, **kwargs):
     async with aiohttp.ClientSession() as session:
         async with session.request(method, url, **kwargs) as response:
@@ -36,22 +52,130 @@ async def request(method: str, url: str, **kwargs):
 
 
 async def handle_subscription_domain_event(event: Event, context: Context):
-    event_code = event.get_event_code()
-    sby = WebhookSby(auth_ids={event.auth_id}, event_codes={event_code})
-    webhooks = await context.uow.webhook_repo().get_selected(sby)
+    await handle_subscription_domain_events([event], context)
+
 
-    if webhooks:
-        partkey_attr = EVENT_PARTKEY_MAPPING[event.get_event_code()]
+async def handle_subscription_domain_events(events: list[Event], context: Context):
+    keys = {(event.auth_id, event.get_event_code()) for event in events}
+    webhooks = await container.webhook_cache().get_many(keys, context.uow)
+
+    deliveries = []
+    aggregations: list[tuple[str, Webhook, DeliveryTask]] = []
+    # Порядок создания доставок, в нем же они вставляются
+    order: dict[UUID, int] = {}
+    for event in events:
+        event_code = event.get_event_code()
+        hooks = webhooks[(event.auth_id, event_code)]
+        if not hooks:
+            continue
+
+        partkey_attr = EVENT_PARTKEY_MAPPING[event_code]
         partkey = str(getattr(event, partkey_attr))
         message = Message.from_event(event)
-        deliveries = [
-            DeliveryTask(
+        body = message.encode()
+        aggregation_key = get_aggregation_key(event)
+        # Каждая кодировка сжимается один раз на сообщение
+        compressed: dict[str, bytes] = {}
+        for hook in hooks:
+            encoding = hook.compression
+            if encoding and encoding not in compressed and len(body) >= config.WEBHOOK_COMPRESSION_THRESHOLD:
+                compressed[encoding] = compress(body, encoding)
+            delivery = DeliveryTask(
                 url=hook.target_url,
                 data=message,
+                body=body,
                 partkey=partkey,
                 retries=0,
                 delays=hook.delays,
                 auth_id=hook.auth_id,
-            ) for hook in webhooks
-        ]
-        await context.uow.delivery_task_repo().add_many(deliveries)
+                batch_size=hook.batch_size,
+                content_encoding=encoding,
+                compressed_body=compressed.get(encoding),
+            )
+            order[delivery.id] = len(order)
+            if hook.aggregation_window and aggregation_key:
+                aggregations.append((f"{hook.id}:{aggregation_key}", hook, delivery))
+            else:
+                deliveries.append(delivery)
+
+    updated, created = [], []
+    if aggregations:
+        updated, created = await aggregate_deliveries(aggregations, context)
+    if deliveries:
+        updated, created = await release_aggregations(deliveries, updated, created, order, context)
+
+    if updated:
+        await context.uow.delivery_task_repo().update_many(updated)
+    if deliveries or created:
+        await context.uow.delivery_task_repo().add_many(sorted(deliveries + created, key=lambda x: order[x.id]))
+
+
+async def aggregate_deliveries(
+        aggregations: list[tuple[str, Webhook, DeliveryTask]],
+        context: Context,
+) -> tuple[list[DeliveryTask], list[DeliveryTask]]:
+    """
+    Merges usage deliveries into the pending delivery with the same key. The first delivery of a key
+    is held back for the webhook's aggregation window with a message of its own, later ones update
+    that message in place.
+    Returns (updated, created) deliveries.
+    """
+    keys = {key for key, _, _ in aggregations}
+    pending = await context.uow.delivery_task_repo().get_aggregating(keys)
+    updated = {}
+    created = {}
+    now = get_current_datetime()
+    for key, hook, delivery in aggregations:
+        if key in created:
+            created[key] = created[key].aggregated(delivery.data)
+        elif key in pending:
+            pending[key] = pending[key].aggregated(delivery.data)
+            updated[key] = pending[key]
+        else:
+            # Сообщение события общее для всех вебхуков, агрегируемой доставке нужна своя копия
+            created[key] = delivery.model_copy(update={
+                "data": delivery.data.model_copy(update={"id": uuid4()}),
+                "aggregation_key": key,
+                "postponed_until": now + timedelta(seconds=hook.aggregation_window),
+            })
+    return [with_compressed_body(x) for x in updated.values()], [with_compressed_body(x) for x in created.values()]
+
+
+def with_compressed_body(delivery: DeliveryTask) -> DeliveryTask:
+    # Слитое сообщение сжимается сразу, иначе его пришлось бы сжимать при каждой попытке отправки
+    if delivery.body is not None or delivery.content_encoding is None:
+        return delivery
+    body = delivery.encoded_body
+    if len(body) < config.WEBHOOK_COMPRESSION_THRESHOLD:
+        return delivery
+    return delivery.model_copy(update={"compressed_body": compress(body, delivery.content_encoding)})
+
+
+async def release_aggregations(
+        deliveries: list[DeliveryTask],
+        updated: list[DeliveryTask],
+        created: list[DeliveryTask],
+        order: dict[UUID, int],
+        context: Context,
+) -> tuple[list[DeliveryTask], list[DeliveryTask]]:
+    """
+    A delivery must not overtake an earlier aggregation of the same target and partkey that is held back.
+    Such aggregations are released: they stop absorbing events and go out at their normal time, before the
+    delivery. Returns (updated, created) deliveries including the released ones.
+    """
+    last_plain = {}
+    for delivery in deliveries:
+        last_plain[(delivery.auth_id, delivery.url, delivery.partkey)] = order[delivery.id]
+
+    def overtaken(delivery: DeliveryTask) -> bool:
+        position = last_plain.get((delivery.auth_id, delivery.url, delivery.partkey))
+        # Сохраненные ранее доставки старше всех доставок этого вызова
+        return position is not None and order.get(delivery.id, -1) < position
+
+    pending = {x.id: x for x in updated}
+    for delivery in await context.uow.delivery_task_repo().get_aggregating_for_targets(last_plain):
+        pending.setdefault(delivery.id, delivery)
+    return (
+        [x.released() if overtaken(x) else x for x in pending.values()],
+        [x.released() if overtaken(x) else x for x in created],
+    )
@@ -1,12 +1,15 @@
-from typing import Optional
+from typing import Optional, Literal
+from uuid import UUID
 
 from fastapi import APIRouter, Depends, Query
+from pydantic import AwareDatetime
 
 from backend.auth.domain.auth_user import AuthUser
 from backend.bootstrap import Bootstrap, get_container, auth_closure
 from backend.shared.utils.permission_service import check_item_owner
-from backend.webhook.adapters.schemas import WebhookCreate, WebhookUpdate
+from backend.webhook.adapters.schemas import WebhookCreate, WebhookUpdate, DeliveryStats
 from backend.webhook.application import usecases
+from backend.webhook.domain.delivery_task import ArchivedDelivery
 from backend.webhook.domain.webhook import Webhook, WebhookId
 from backend.webhook.domain.webhook_repo import WebhookSby
 
@@ -30,6 +33,42 @@ async def create_one(
     return webhook.id
 
 
+@webhook_router.get("/delivery-stats")
+async def get_delivery_stats(
+        auth_user: AuthUser = Depends(auth_closure),
+        container: Bootstrap = Depends(get_container),
+) -> DeliveryStats:
+    governor = container.delivery_governor()
+    async with container.unit_of_work_factory().create_uow() as uow:
+        backlog = await uow.delivery_task_repo().get_backlog_by_tenant([auth_user.id])
+    # Клиент видит только свои запросы, даже если его хосты общие с другими клиентами
+    in_flight_by_host = governor.tenant_in_flight_by_host(auth_user.id)
+    return DeliveryStats(
+        in_flight=sum(in_flight_by_host.values()),
+        max_concurrency=governor.max_concurrency,
+        max_concurrency_per_host=governor.max_concurrency_per_host,
+        in_flight_by_host=in_flight_by_host,
+        backlog=backlog.get(auth_user.id, 0),
+        queued=container.delivery_queue().backlog_by_tenant().get(auth_user.id, 0),
+    )
+
+
+@webhook_router.get("/deliveries")
+async def get_delivery_history(
+        limit: int = Query(100, ge=1, le=1000),
+        before_archived_at: Optional[AwareDatetime] = Query(None),
+        before_id: Optional[UUID] = Query(None),
+        status: Optional[Literal["success_sent", "failed_sent"]] = Query(None),
+        event_code: Optional[str] = Query(None),
+        auth_user: AuthUser = Depends(auth_closure),
+        container: Bootstrap = Depends(get_container),
+) -> list[ArchivedDelivery]:
+    # Следующая страница запрашивается по (archived_at, id) последнего элемента предыдущей
+    before = (before_archived_at, before_id) if before_archived_at and before_id else None
+    async with container.unit_of_work_factory().create_uow() as uow:
+        return await uow.delivery_task_repo().get_archived(auth_user.id, limit, before, status, event_code)
+
+
 @webhook_router.get("/{webhook_id}")
 async def get_one_by_id(
         webhook_id: WebhookId,
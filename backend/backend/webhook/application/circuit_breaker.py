@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from datetime import timedelta, datetime
+from typing import Literal, Optional, Hashable
+
+from backend.shared.utils.dt import get_current_datetime
+
+CircuitState = Literal["closed", "open", "half_open"]
+
+
+class Circuit:
+    def __init__(self):
+        self.state: CircuitState = "closed"
+        self.outcomes: deque[tuple[float, bool]] = deque()
+        self.opened_at: Optional[float] = None
+        self.unhealthy_since: Optional[float] = None
+        self.probe_in_flight = False
+
+
+class CircuitBreaker:
+    """
+    Health state of webhook targets, one circuit per target: (auth_id, url) in the Telegraph, so failures
+    of one tenant never open the circuit of another tenant sharing the url.
+
+    A closed circuit opens when the failure rate inside the window reaches the threshold. An open circuit
+    rejects requests for open_time seconds, then lets a single probe through (half-open). A successful probe
+    closes the circuit, a failed one opens it again.
+    """
+
+    def __init__(
+            self,
+            window: float = 60,
+            failure_rate: float = 0.5,
+            min_requests: int = 5,
+            open_time: float = 30,
+    ):
+        self._window = window
+        self._failure_rate = failure_rate
+        self._min_requests = min_requests
+        self._open_time = open_time
+        self._circuits: dict[Hashable, Circuit] = {}
+
+    def get_state(self, target: Hashable) -> CircuitState:
+        circuit = self._circuits.get(target)
+        return circuit.state if circuit else "closed"
+
+    def allow_request(self, target: Hashable) -> bool:
+        circuit = self._circuits.get(target)
+        if circuit is None or circuit.state == "closed":
+            return True
+        if circuit.state == "open":
+            if time.monotonic() - circuit.opened_at < self._open_time:
+                return False
+            circuit.state = "half_open"
+        if circuit.probe_in_flight:
+            return False
+        circuit.probe_in_flight = True
+        return True
+
+    def record_success(self, target: Hashable) -> None:
+        circuit = self._circuits.setdefault(target, Circuit())
+        if circuit.state != "closed":
+            # Цель снова здорова, забываем историю
+            self._circuits[target] = Circuit()
+            return
+        self._add_outcome(circuit, True)
+
+    def record_failure(self, target: Hashable) -> None:
+        circuit = self._circuits.setdefault(target, Circuit())
+        if circuit.state != "closed":
+            self._open(circuit)
+            return
+        self._add_outcome(circuit, False)
+        failures = len([x for x in circuit.outcomes if not x[1]])
+        if len(circuit.outcomes) >= self._min_requests and failures / len(circuit.outcomes) >= self._failure_rate:
+            self._open(circuit)
+
+    def retry_at(self, target: Hashable) -> datetime:
+        """Moment when a rejected request to the target may be tried again"""
+        circuit = self._circuits.get(target)
+        if circuit is None or circuit.opened_at is None:
+            return get_current_datetime()
+        if circuit.state == "half_open":
+            # Пробный запрос уже в пути, его результат станет известен не раньше, чем через open_time
+            seconds_left = self._open_time
+        else:
+            seconds_left = max(circuit.opened_at + self._open_time - time.monotonic(), 0)
+        return get_current_datetime() + timedelta(seconds=seconds_left)
+
+    def unhealthy_for(self, target: Hashable) -> float:
+        """Seconds since the circuit of the target opened without closing in between"""
+        circuit = self._circuits.get(target)
+        if circuit is None or circuit.unhealthy_since is None:
+            return 0
+        return time.monotonic() - circuit.unhealthy_since
+
+    def forget(self, target: Hashable) -> None:
+        self._circuits.pop(target, None)
+
+    def _add_outcome(self, circuit: Circuit, success: bool) -> None:
+        now = time.monotonic()
+        circuit.outcomes.append((now, success))
+        while circuit.outcomes and circuit.outcomes[0][0] < now - self._window:
+            circuit.outcomes.popleft()
+
+    @staticmethod
+    def _open(circuit: Circuit) -> None:
+        now = time.monotonic()
+        circuit.state = "open"
+        circuit.opened_at = now
+        circuit.probe_in_flight = False
+        circuit.outcomes.clear()
+        if circuit.unhealthy_since is None:
+            circuit.unhealthy_since = now
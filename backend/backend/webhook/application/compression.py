@@ -0,0 +1,14 @@
+import gzip
+from typing import Literal
+
+import zstandard
+
+ContentEncoding = Literal["gzip", "zstd"]
+
+
+def compress(body: bytes, encoding: ContentEncoding) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    raise ValueError(encoding)
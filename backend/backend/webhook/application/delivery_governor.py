@@ -0,0 +1,67 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlsplit
+from uuid import UUID
+
+
+def get_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+class DeliveryGovernor:
+    """Caps outbound webhook requests globally and per target host"""
+
+    def __init__(self, max_concurrency: int, max_concurrency_per_host: int):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._hosts: dict[str, asyncio.Semaphore] = {}
+        self._waiting: dict[str, int] = defaultdict(int)
+        self._in_flight: dict[str, int] = defaultdict(int)
+        self._tenant_in_flight: dict[UUID, dict[str, int]] = {}
+
+    @asynccontextmanager
+    async def acquire(self, url: str, tenant: Optional[UUID] = None):
+        host = get_host(url)
+        host_semaphore = self._hosts.setdefault(host, asyncio.Semaphore(self.max_concurrency_per_host))
+        self._waiting[host] += 1
+        try:
+            # Сначала лимит хоста, потом глобальный: медленный хост не занимает глобальные слоты в ожидании
+            async with host_semaphore, self._global:
+                self._in_flight[host] += 1
+                self._track_tenant(tenant, host, 1)
+                try:
+                    yield
+                finally:
+                    self._in_flight[host] -= 1
+                    if not self._in_flight[host]:
+                        self._in_flight.pop(host)
+                    self._track_tenant(tenant, host, -1)
+        finally:
+            self._waiting[host] -= 1
+            if not self._waiting[host]:
+                self._waiting.pop(host)
+                self._hosts.pop(host, None)
+
+    def _track_tenant(self, tenant: Optional[UUID], host: str, delta: int) -> None:
+        if tenant is None:
+            return
+        hosts = self._tenant_in_flight.setdefault(tenant, {})
+        hosts[host] = hosts.get(host, 0) + delta
+        if not hosts[host]:
+            hosts.pop(host)
+        if not hosts:
+            self._tenant_in_flight.pop(tenant)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def in_flight_by_host(self) -> dict[str, int]:
+        return dict(self._in_flight)
+
+    def tenant_in_flight_by_host(self, tenant: UUID) -> dict[str, int]:
+        """Requests of one tenant only, even when other tenants send to the same hosts"""
+        return dict(self._tenant_in_flight.get(tenant, {}))
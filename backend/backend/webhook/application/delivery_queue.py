@@ -0,0 +1,53 @@
+from typing import Callable, Hashable, Iterable, Optional
+from uuid import UUID
+
+Tenant = Hashable
+
+
+class DeliveryQueue:
+    """
+    In-memory handoff of freshly committed delivery tasks to the Telegraph.
+
+    Only ids are queued: the Telegraph claims the rows by primary key, so a task that was already taken
+    by another process is skipped instead of being sent twice.
+
+    Ids are kept per tenant and popped round-robin, so a burst from one tenant
+    does not delay the deliveries of the others.
+    """
+
+    def __init__(self, on_push: Optional[Callable[[], None]] = None):
+        self._tenants: dict[Tenant, dict[UUID, None]] = {}
+        self._size = 0
+        self._on_push = on_push
+
+    def push_many(self, items: Iterable[tuple[Tenant, UUID]]) -> None:
+        size = self._size
+        for tenant, delivery_id in items:
+            ids = self._tenants.setdefault(tenant, {})
+            if delivery_id not in ids:
+                ids[delivery_id] = None
+                self._size += 1
+        if self._size > size and self._on_push:
+            self._on_push()
+
+    def pop_many(self, limit: int) -> list[UUID]:
+        result = []
+        while self._tenants and len(result) < limit:
+            # Берем по одной доставке у каждого тенанта, очередь тенантов вращается между вызовами
+            for tenant in list(self._tenants):
+                if len(result) >= limit:
+                    break
+                ids = self._tenants.pop(tenant)
+                delivery_id = next(iter(ids))
+                ids.pop(delivery_id)
+                result.append(delivery_id)
+                if ids:
+                    self._tenants[tenant] = ids
+        self._size -= len(result)
+        return result
+
+    def backlog_by_tenant(self) -> dict[Tenant, int]:
+        return {tenant: len(ids) for tenant, ids in self._tenants.items()}
+
+    def __len__(self):
+        return self._size
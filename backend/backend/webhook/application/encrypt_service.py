@@ -1,31 +1,61 @@
+import asyncio
 import base64
 import os
+from concurrent.futures import Executor
+from functools import lru_cache, partial
+from typing import Literal, Optional, Iterable
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives.padding import PKCS7
 
+EncryptionMode = Literal["cbc", "gcm"]
+
+SALT_SIZE = 16
+IV_SIZE = 16
+NONCE_SIZE = 12
+# Base64 не содержит ":", поэтому префикс однозначно отличает GCM от старого формата CBC
+GCM_PREFIX = "gcm:"
+
 
 class GDPRCompliantEncryptor:
-    def __init__(self, password: str, salt: bytes = None):
+    def __init__(
+            self,
+            password: str,
+            salt: bytes = None,
+            mode: EncryptionMode = "gcm",
+            key_cache_size: int = 1024,
+            executor: Optional[Executor] = None,
+            chunk_size: int = 64,
+    ):
         """
         Initializes the encryptor with a password and an optional salt.
 
         :param password: Password for key derivation.
         :param salt: Optional salt for key derivation. If not provided, a new salt will be generated.
+        :param mode: Cipher used by encrypt. decrypt accepts data produced in both modes.
+        :param key_cache_size: How many derived keys (one per salt) are kept in memory.
+        :param executor: Executor for encrypt_many/decrypt_many, the default thread pool if not provided.
+        :param chunk_size: How many items one executor job handles.
         """
         self.password = password.encode()
-        self.salt = salt or os.urandom(16)
-        self.key = self._derive_key()
-
-    def _derive_key(self) -> bytes:
+        self.salt = salt or os.urandom(SALT_SIZE)
+        self.mode = mode
+        self._executor = executor
+        self._chunk_size = chunk_size
+        # Кэш принадлежит экземпляру: ключи зависят от пароля
+        self._get_key = lru_cache(maxsize=key_cache_size)(self._derive_key)
+        self.key = self._get_key(self.salt)
+
+    def _derive_key(self, salt: bytes) -> bytes:
         """Derives a cryptographic key from the password and salt using PBKDF2."""
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
-            salt=self.salt,
+            salt=salt,
             iterations=100000,
             backend=default_backend()
         )
@@ -36,9 +66,14 @@ class GDPRCompliantEncryptor:
         Encrypts plaintext data.
 
         :param plaintext: The plaintext data to encrypt.
-        :return: Base64-encoded string containing the salt, IV, and ciphertext.
+        :return: Base64-encoded string containing the salt, IV (nonce), and ciphertext.
         """
-        iv = os.urandom(16)
+        if self.mode == "gcm":
+            return self._encrypt_gcm(plaintext)
+        return self._encrypt_cbc(plaintext)
+
+    def _encrypt_cbc(self, plaintext: str) -> str:
+        iv = os.urandom(IV_SIZE)
         cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=default_backend())
         encryptor = cipher.encryptor()
 
@@ -53,25 +88,33 @@ class GDPRCompliantEncryptor:
         encrypted_data = base64.b64encode(self.salt + iv + ciphertext).decode()
         return encrypted_data
 
+    def _encrypt_gcm(self, plaintext: str) -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        # Тег аутентификации добавляется в конец ciphertext
+        ciphertext = AESGCM(self.key).encrypt(nonce, plaintext.encode(), None)
+        return GCM_PREFIX + base64.b64encode(self.salt + nonce + ciphertext).decode()
+
     def decrypt(self, encrypted_data: str) -> str:
         """
         Decrypts Base64-encoded encrypted data.
 
         :param encrypted_data: The encrypted data to decrypt.
         :return: The decrypted plaintext data.
+        :raises cryptography.exceptions.InvalidTag: If GCM data was tampered with.
         """
+        if encrypted_data.startswith(GCM_PREFIX):
+            return self._decrypt_gcm(encrypted_data.removeprefix(GCM_PREFIX))
+        return self._decrypt_cbc(encrypted_data)
+
+    def _decrypt_cbc(self, encrypted_data: str) -> str:
         encrypted_data_bytes = base64.b64decode(encrypted_data)
 
         # Extract salt, IV, and ciphertext
-        salt = encrypted_data_bytes[:16]
-        iv = encrypted_data_bytes[16:32]
-        ciphertext = encrypted_data_bytes[32:]
-
-        # Derive key using extracted salt
-        self.salt = salt
-        self.key = self._derive_key()
+        salt = encrypted_data_bytes[:SALT_SIZE]
+        iv = encrypted_data_bytes[SALT_SIZE:SALT_SIZE + IV_SIZE]
+        ciphertext = encrypted_data_bytes[SALT_SIZE + IV_SIZE:]
 
-        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=default_backend())
+        cipher = Cipher(algorithms.AES(self._get_key(salt)), modes.CBC(iv), backend=default_backend())
         decryptor = cipher.decryptor()
 
         # Decrypt and unpad data
@@ -80,3 +123,31 @@ class GDPRCompliantEncryptor:
         plaintext = unpadder.update(padded_data) + unpadder.finalize()
 
         return plaintext.decode()
+
+    def _decrypt_gcm(self, encrypted_data: str) -> str:
+        encrypted_data_bytes = base64.b64decode(encrypted_data)
+        salt = encrypted_data_bytes[:SALT_SIZE]
+        nonce = encrypted_data_bytes[SALT_SIZE:SALT_SIZE + NONCE_SIZE]
+        ciphertext = encrypted_data_bytes[SALT_SIZE + NONCE_SIZE:]
+        return AESGCM(self._get_key(salt)).decrypt(nonce, ciphertext, None).decode()
+
+    async def encrypt_many(self, items: Iterable[str]) -> list[str]:
+        """Encrypts items in the executor without blocking the event loop, the order is preserved."""
+        return await self._run_chunked(self.encrypt, list(items))
+
+    async def decrypt_many(self, items: Iterable[str]) -> list[str]:
+        """Decrypts items in the executor without blocking the event loop, the order is preserved."""
+        return await self._run_chunked(self.decrypt, list(items))
+
+    async def _run_chunked(self, func, items: list[str]) -> list[str]:
+        loop = asyncio.get_running_loop()
+        chunks = [items[i:i + self._chunk_size] for i in range(0, len(items), self._chunk_size)]
+        # OpenSSL отпускает GIL, поэтому чанки действительно выполняются параллельно
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, partial(_apply, func, chunk)) for chunk in chunks
+        ])
+        return [item for chunk in results for item in chunk]
+
+
+def _apply(func, items: list[str]) -> list[str]:
+    return [func(item) for item in items]
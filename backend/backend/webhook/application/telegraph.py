@@ -1,22 +1,70 @@
 import asyncio
+import heapq
+import time
 from collections import defaultdict
+from typing import Optional
+from uuid import UUID, uuid4
 
 import httpx
 from loguru import logger
 
 from backend.shared.unit_of_work.uow import UnitOfWorkFactory, UnitOfWork
+from backend.shared.utils.dt import get_current_datetime
+from backend.webhook.application import usecases
+from backend.webhook.application.circuit_breaker import CircuitBreaker
+from backend.webhook.application.compression import compress
+from backend.webhook.application.delivery_governor import DeliveryGovernor
+from backend.webhook.application.delivery_queue import DeliveryQueue
 from backend.webhook.domain.delivery_task import SentErrorInfo, DeliveryTask
+from backend.webhook.domain.webhook_repo import WebhookSby
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 class RequestClient:
-    def __init__(self):
-        self.client = httpx.AsyncClient()
+    def __init__(
+            self,
+            governor: Optional[DeliveryGovernor] = None,
+            connect_timeout: float = 5,
+            read_timeout: float = 10,
+            keepalive_connections: int = 20,
+            keepalive_expiry: float = 30,
+            http2: bool = False,
+            compression_threshold: int = 1024,
+    ):
+        self.compression_threshold = compression_threshold
+        self.governor = governor or DeliveryGovernor(max_concurrency=100, max_concurrency_per_host=10)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.governor.max_concurrency,
+                max_keepalive_connections=keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2,
+        )
+
+    def _prepare_content(
+            self,
+            content: bytes,
+            encoding: Optional[str],
+            compressed: Optional[bytes] = None,
+    ) -> tuple[bytes, dict[str, str]]:
+        if encoding is None or (compressed is None and len(content) < self.compression_threshold):
+            return content, JSON_HEADERS
+        if compressed is None:
+            compressed = compress(content, encoding)
+        return compressed, {**JSON_HEADERS, "Content-Encoding": encoding}
 
     async def safe_request(self, delivery: DeliveryTask) -> DeliveryTask:
-        payload = delivery.data.model_dump(mode="json")
         error = None
+        content, headers = self._prepare_content(
+            delivery.encoded_body, delivery.content_encoding, delivery.compressed_body
+        )
         try:
-            response = await self.client.request("POST", delivery.url, json=payload)
+            async with self.governor.acquire(delivery.url, delivery.auth_id):
+                response = await self.client.request("POST", delivery.url, content=content, headers=headers)
             if response.status_code >= 400:
                 error = SentErrorInfo(
                     status_code=response.status_code,
@@ -37,6 +85,59 @@ class RequestClient:
 
         return delivery.failed_sent(error) if error else delivery.success_sent()
 
+    async def safe_request_batch(self, deliveries: list[DeliveryTask]) -> list[DeliveryTask]:
+        """
+        Sends deliveries to one url as a JSON array of {"delivery_id", "message"} items.
+        The receiver may answer {"failed": [delivery_id, ...]} to reject part of the batch.
+        """
+        url = deliveries[0].url
+        # Тело собирается из готовых байтов сообщений без повторной сериализации
+        content = b"[" + b",".join(
+            b'{"delivery_id":"%s","message":%s}' % (str(delivery.id).encode(), delivery.encoded_body)
+            for delivery in deliveries
+        ) + b"]"
+        content, headers = self._prepare_content(content, deliveries[0].content_encoding)
+        error = None
+        failed_ids = set()
+        try:
+            async with self.governor.acquire(url, deliveries[0].auth_id):
+                response = await self.client.request("POST", url, content=content, headers=headers)
+            if response.status_code >= 400:
+                error = SentErrorInfo(
+                    status_code=response.status_code,
+                    detail="request_error",
+                )
+            else:
+                failed_ids = parse_failed_ids(response)
+        except Exception as err:
+            error = SentErrorInfo(
+                status_code=500,
+                detail=str(err),
+            )
+
+        if error:
+            logger.error(
+                f"SendError(url={url}, batch_size={len(deliveries)}, status={error.status_code},"
+                f" detail={error.detail})"
+            )
+            return [delivery.failed_sent(error) for delivery in deliveries]
+
+        rejected = SentErrorInfo(status_code=response.status_code, detail="rejected_in_batch")
+        return [
+            delivery.failed_sent(rejected) if str(delivery.id) in failed_ids else delivery.success_sent()
+            for delivery in deliveries
+        ]
+
+
+def parse_failed_ids(response: httpx.Response) -> set[str]:
+    try:
+        body = response.json()
+    except ValueError:
+        return set()
+    if isinstance(body, dict) and isinstance(body.get("failed"), list):
+        return {str(x) for x in body["failed"]}
+    return set()
+
 
 async def safe_commit(uow: UnitOfWork, msg: DeliveryTask):
     try:
@@ -53,36 +154,286 @@ def group_deliveries(deliveries: list[DeliveryTask]) -> dict[str, list[DeliveryT
     return result
 
 
+def group_deliveries_by_target(deliveries: list[DeliveryTask]) -> dict[tuple[UUID, str], list[DeliveryTask]]:
+    """Groups by (auth_id, url): one POST never carries deliveries of different tenants"""
+    result = defaultdict(list)
+    for tlg in deliveries:
+        result[(tlg.auth_id, tlg.url)].append(tlg)
+    return result
+
+
+def split_batches(deliveries: list[DeliveryTask]) -> list[list[DeliveryTask]]:
+    """
+    Splits deliveries of one target into batches, keeping their order.
+    A batch holds consecutive deliveries with the same batch_size and content_encoding (the webhook settings)
+    and is not larger than that batch_size.
+    """
+    batches = []
+    for delivery in deliveries:
+        if batches:
+            last = batches[-1]
+            same_settings = (
+                last[0].batch_size == delivery.batch_size
+                and last[0].content_encoding == delivery.content_encoding
+            )
+            if same_settings and len(last) < delivery.batch_size:
+                last.append(delivery)
+                continue
+        batches.append([delivery])
+    return batches
+
+
 class Telegraph:
-    def __init__(self, uow_factory: UnitOfWorkFactory):
+    def __init__(
+            self,
+            uow_factory: UnitOfWorkFactory,
+            queue: Optional[DeliveryQueue] = None,
+            poll_interval: float = 0,
+            batch_limit: int = 500,
+            lease_time: float = 60,
+            tenant_quota: Optional[int] = None,
+            client: Optional[RequestClient] = None,
+            breaker: Optional[CircuitBreaker] = None,
+            auto_disable_after: Optional[float] = None,
+            min_poll_gap: float = 1,
+    ):
+        """
+        poll_interval: the longest pause between database polls. Normally the Telegraph wakes up
+        at the earliest next_retry_at or lease expiry it knows about, so this is only a safety net.
+        min_poll_gap: the shortest pause after a poll that left due deliveries unclaimed
+        (e.g. behind a partkey leased by another process).
+        """
         self._uow_factory = uow_factory
-        self._client = RequestClient()
+        self._client = client or RequestClient()
+        self._breaker = breaker
+        self._auto_disable_after = auto_disable_after
+        self._queue = queue
+        self._poll_interval = poll_interval
+        self._batch_limit = batch_limit
+        self._lease_time = lease_time
+        # Владелец аренды: результаты пишутся только для строк, которые не перехватил другой воркер
+        self._lease_owner = uuid4()
+        self._tenant_quota = tenant_quota
+        self._last_poll_at: Optional[float] = None
+        self._min_poll_gap = min_poll_gap
+        # Min-heap моментов (unix time), когда в базе появятся доставки, готовые к отправке
+        self._deadlines: list[float] = []
 
     async def _partkey_worker(self, deliveries: list[DeliveryTask]) -> list[DeliveryTask]:
         updated_deliveries = []
+        blocked_targets = set()
         for delivery in deliveries:
+            if self._breaker is None:
+                updated_deliveries.append(await self._client.safe_request(delivery))
+                continue
+
+            # После отказа цепи откладываем и остальные доставки partkey на эту цель, чтобы сохранить порядок
+            target = (delivery.auth_id, delivery.url)
+            if target in blocked_targets or not self._breaker.allow_request(target):
+                blocked_targets.add(target)
+                updated_deliveries.append(delivery.postponed(self._breaker.retry_at(target)))
+                continue
+
             updated = await self._client.safe_request(delivery)
+            if updated.status == "success_sent":
+                self._breaker.record_success(target)
+            else:
+                self._breaker.record_failure(target)
             updated_deliveries.append(updated)
         return updated_deliveries
 
+    async def _target_worker(self, deliveries: list[DeliveryTask]) -> list[DeliveryTask]:
+        # Пачки на один url уходят последовательно, поэтому порядок внутри каждого partkey сохраняется
+        target = (deliveries[0].auth_id, deliveries[0].url)
+        updated_deliveries = []
+        # partkey с неудачной доставкой -> ее повтор. Остальные доставки partkey ждут его, чтобы не обогнать ее
+        blocked_partkeys = {}
+        sent = 0
+        for batch in split_batches(deliveries):
+            if self._breaker is not None and not self._breaker.allow_request(target):
+                retry_at = self._breaker.retry_at(target)
+                updated_deliveries.extend(x.postponed(retry_at) for x in deliveries[sent:])
+                break
+            sent += len(batch)
+
+            to_send = []
+            for delivery in batch:
+                if delivery.partkey in blocked_partkeys:
+                    updated_deliveries.append(delivery.postponed(blocked_partkeys[delivery.partkey]))
+                else:
+                    to_send.append(delivery)
+            if not to_send:
+                continue
+
+            updated = await self._client.safe_request_batch(to_send)
+            if self._breaker is not None:
+                if any(x.status == "success_sent" for x in updated):
+                    self._breaker.record_success(target)
+                else:
+                    self._breaker.record_failure(target)
+            for delivery in updated:
+                # Исчерпавшая попытки доставка больше не повторится и порядок не держит
+                if delivery.status != "success_sent" and delivery.next_retry_at is not None:
+                    blocked_partkeys.setdefault(delivery.partkey, delivery.next_retry_at)
+            updated_deliveries.extend(updated)
+        return updated_deliveries
+
+    def _is_poll_due(self) -> bool:
+        if self._last_poll_at is None:
+            return True
+        if self._deadlines and self._deadlines[0] <= time.time():
+            return True
+        return time.monotonic() - self._last_poll_at >= self._poll_interval
+
+    def _push_deadline(self, deadline: float) -> None:
+        heapq.heappush(self._deadlines, deadline)
+
+    def next_run_delay(self) -> float:
+        """Seconds until the next notify is needed, capped by poll_interval"""
+        if self._queue:
+            return 0
+        delay = self._poll_interval
+        if self._last_poll_at is not None:
+            delay = max(0.0, self._poll_interval - (time.monotonic() - self._last_poll_at))
+        if self._deadlines:
+            delay = min(delay, max(0.0, self._deadlines[0] - time.time()))
+        return delay
+
     async def notify(self):
+        # Свежие доставки приходят из очереди, опрос базы нужен только для повторов и восстановления после сбоев
+        while self._queue:
+            ids = self._queue.pop_many(self._batch_limit)
+            deliveries = await self._claim(ids)
+            await self._send(deliveries)
+            if len(deliveries) < len(ids):
+                # Часть новых доставок еще не готова к отправке (например, ждет окна агрегации)
+                await self._refresh_deadlines(batch_is_full=False)
+
+        if self._is_poll_due():
+            self._last_poll_at = time.monotonic()
+            deliveries = await self._claim()
+            await self._send(deliveries)
+            await self._refresh_deadlines(batch_is_full=len(deliveries) >= self._batch_limit)
+
+    async def _refresh_deadlines(self, batch_is_full: bool) -> None:
+        # База - источник истины: после опроса в куче остается только ближайший срок из нее
+        async with self._uow_factory.create_uow() as uow:
+            next_due_at = await uow.delivery_task_repo().get_next_due_at()
+        self._deadlines = []
+        if next_due_at is None:
+            return
+
+        deadline = next_due_at.timestamp()
+        if not batch_is_full:
+            # Оставшиеся готовые доставки заблокированы чужой арендой, не крутим опрос вхолостую
+            deadline = max(deadline, time.time() + self._min_poll_gap)
+        self._push_deadline(deadline)
+
+    async def _claim(self, ids: Optional[list[UUID]] = None) -> list[DeliveryTask]:
         async with self._uow_factory.create_uow() as uow:
-            deliveries = await uow.delivery_task_repo().get_deliveries_for_send()
-            logger.info(f"Check delivery tasks: {len(deliveries)} need to send")
-
-            updated_deliveries = []
-            tasks = []
-            for partkey, grouped_deliveries in group_deliveries(deliveries).items():
-                task = asyncio.create_task(self._partkey_worker(grouped_deliveries))
-                task.add_done_callback(lambda x: updated_deliveries.extend(x.result()))
-                tasks.append(task)
+            deliveries = await uow.delivery_task_repo().claim_deliveries(
+                self._batch_limit, self._lease_time, self._lease_owner, ids, self._tenant_quota
+            )
+            await uow.commit()
+        logger.info(f"Check delivery tasks: {len(deliveries)} need to send")
+        return deliveries
+
+    async def _send(self, deliveries: list[DeliveryTask]):
+        if not deliveries:
+            return
+
+        # HTTP-запросы выполняются вне транзакции, строки защищены арендой
+        updated_deliveries = []
+        tasks = []
+        single = [x for x in deliveries if x.batch_size == 1]
+        batched = [x for x in deliveries if x.batch_size > 1]
+        for partkey, grouped_deliveries in group_deliveries(single).items():
+            task = asyncio.create_task(self._partkey_worker(grouped_deliveries))
+            task.add_done_callback(lambda x: updated_deliveries.extend(x.result()))
+            tasks.append(task)
+        for target, grouped_deliveries in group_deliveries_by_target(batched).items():
+            task = asyncio.create_task(self._target_worker(grouped_deliveries))
+            task.add_done_callback(lambda x: updated_deliveries.extend(x.result()))
+            tasks.append(task)
+        heartbeat = asyncio.create_task(self._renew_leases([x.id for x in deliveries]))
+        try:
             await asyncio.gather(*tasks)
-            await uow.delivery_task_repo().update_many(updated_deliveries)
+        finally:
+            heartbeat.cancel()
+
+        async with self._uow_factory.create_uow() as uow:
+            owned = await uow.delivery_task_repo().get_leased_by([x.id for x in updated_deliveries], self._lease_owner)
+            lost = len(updated_deliveries) - len(owned)
+            updated_deliveries = [x for x in updated_deliveries if x.id in owned]
+            # Завершенные доставки уходят в архив, в живой таблице остается только работа в процессе
+            await uow.delivery_task_repo().update_many([x for x in updated_deliveries if not x.is_completed])
+            await uow.delivery_task_repo().archive_many([x for x in updated_deliveries if x.is_completed])
             await uow.commit()
+        if lost:
+            logger.warning(f"{lost} DeliveryTasks were not saved, their leases were taken over by another worker")
+
+        for delivery in updated_deliveries:
+            if not delivery.is_completed and delivery.next_retry_at is not None:
+                self._push_deadline(delivery.next_retry_at.timestamp())
+
+        successes = len([x for x in updated_deliveries if x.status == "success_sent"])
+        postponed = len([x for x in updated_deliveries if x.postponed_until is not None])
+        fails = len(updated_deliveries) - successes - postponed
+        logger.info(
+            f"{len(updated_deliveries)} DeliveryTasks were processed. "
+            f"{successes} success, {fails} failed, {postponed} postponed"
+        )
+
+        await self._disable_dead_targets(deliveries, updated_deliveries)
 
-            if updated_deliveries:
-                successes = len([x for x in updated_deliveries if x.status == "success_sent"])
-                fails = len(updated_deliveries) - successes
-                logger.info(
-                    f"{len(updated_deliveries)} DeliveryTasks were processed. {successes} success, {fails} failed"
+    async def _renew_leases(self, ids: list[UUID]) -> None:
+        # Продлеваем аренду, пока идет отправка: медленный хост не должен отдать строки другому воркеру
+        while True:
+            await asyncio.sleep(self._lease_time / 3)
+            async with self._uow_factory.create_uow() as uow:
+                await uow.delivery_task_repo().renew_leases(ids, self._lease_owner, self._lease_time)
+                await uow.commit()
+
+    async def _disable_dead_targets(self, deliveries: list[DeliveryTask], updated: list[DeliveryTask]) -> None:
+        """
+        Disables webhooks of the tenants whose target stayed unhealthy for auto_disable_after seconds.
+        Other tenants sharing the url keep their own circuits and webhooks.
+        """
+        if self._breaker is None or not self._auto_disable_after:
+            return
+
+        targets = {(x.auth_id, x.url) for x in deliveries}
+        dead = {x: self._breaker.unhealthy_for(x) for x in targets}
+        dead = {x: seconds for x, seconds in dead.items() if seconds >= self._auto_disable_after}
+        if not dead:
+            return
+
+        last_errors = {}
+        for delivery in updated:
+            if delivery.error_info is not None:
+                last_errors[(delivery.auth_id, delivery.url)] = delivery.error_info
+
+        async with self._uow_factory.create_uow() as uow:
+            sby = WebhookSby(auth_url_pairs=set(dead), enabled=True, limit=1000)
+            hooks = await uow.webhook_repo().get_selected(sby)
+            usecase = usecases.UpdateWebhook(uow)
+            for hook in hooks:
+                target = (hook.auth_id, hook.target_url)
+                reason = f"Target was unavailable for {int(dead[target])} seconds"
+                if target in last_errors:
+                    error = last_errors[target]
+                    reason += f", last error: status={error.status_code}, detail={error.detail}"
+                await usecase.execute(
+                    hook.model_copy(
+                        update={"enabled": False, "disabled_reason": reason, "updated_at": get_current_datetime()}
+                    )
                 )
+            await uow.commit()
+
+        for target in dead:
+            self._breaker.forget(target)
+        logger.warning(f"{len(hooks)} webhooks were disabled, their targets are unavailable: {list(dead)}")
+
+    @property
+    def governor(self) -> DeliveryGovernor:
+        return self._client.governor
@@ -0,0 +1,86 @@
+from typing import Iterable, Optional
+
+from backend.auth.domain.auth_user import AuthId
+from backend.shared.unit_of_work.uow import UnitOfWork
+from backend.shared.utils.cache_manager import CacheManager
+from backend.webhook.domain.webhook import Webhook, WebhookId
+from backend.webhook.domain.webhook_repo import WebhookSby
+
+
+class WebhookCache:
+    """
+    In-process cache of webhook targets keyed by (auth_id, event_code).
+
+    Entries are dropped after every committed change of webhooks, see invalidate_webhooks. The expiration time
+    of the cache manager bounds staleness for changes made by other processes.
+    """
+
+    def __init__(self, cache_manager: CacheManager[list[Webhook]]):
+        self._cache_manager = cache_manager
+        # Ключи, под которыми закэширован вебхук: удаление и смена event_code не знают старого ключа
+        self._keys_by_webhook: dict[WebhookId, set[str]] = {}
+
+    @staticmethod
+    def _get_key(auth_id: AuthId, event_code: str) -> str:
+        return f"{auth_id}:{event_code}"
+
+    def _set(self, key: str, webhooks: list[Webhook]) -> None:
+        self._cache_manager.set(key, webhooks)
+        for webhook in webhooks:
+            self._keys_by_webhook.setdefault(webhook.id, set()).add(key)
+
+    async def get_webhooks(self, auth_id: AuthId, event_code: str, uow: UnitOfWork) -> list[Webhook]:
+        key = self._get_key(auth_id, event_code)
+        cached = self._cache_manager.get(key)
+        if cached is not None:
+            return list(cached)
+
+        sby = WebhookSby(auth_ids={auth_id}, event_codes={event_code}, enabled=True)
+        webhooks = await uow.webhook_repo().get_selected(sby, lock="none")
+        self._set(key, webhooks)
+        return list(webhooks)
+
+    async def get_many(
+            self,
+            keys: set[tuple[AuthId, str]],
+            uow: UnitOfWork,
+    ) -> dict[tuple[AuthId, str], list[Webhook]]:
+        result = {}
+        missing = set()
+        for auth_id, event_code in keys:
+            cached = self._cache_manager.get(self._get_key(auth_id, event_code))
+            if cached is not None:
+                result[(auth_id, event_code)] = list(cached)
+            else:
+                missing.add((auth_id, event_code))
+
+        if missing:
+            # Все промахи загружаются одним запросом
+            sby = WebhookSby(auth_event_pairs=missing, enabled=True, limit=100 * len(missing))
+            loaded = {key: [] for key in missing}
+            for hook in await uow.webhook_repo().get_selected(sby, lock="none"):
+                loaded[(hook.auth_id, hook.event_code)].append(hook)
+            for (auth_id, event_code), webhooks in loaded.items():
+                self._set(self._get_key(auth_id, event_code), webhooks)
+                result[(auth_id, event_code)] = list(webhooks)
+
+        return result
+
+    def invalidate(self, auth_id: AuthId, event_code: str) -> None:
+        self._cache_manager.pop(self._get_key(auth_id, event_code))
+
+    def invalidate_webhooks(self, changes: Iterable[tuple[WebhookId, Optional[tuple[AuthId, str]]]]) -> None:
+        """
+        Drops the entries affected by committed changes.
+
+        changes: (webhook_id, (auth_id, event_code)) pairs, the key is the new one or None for deleted webhooks.
+        """
+        for webhook_id, new_key in changes:
+            for key in self._keys_by_webhook.pop(webhook_id, set()):
+                self._cache_manager.pop(key)
+            if new_key is not None:
+                self.invalidate(*new_key)
+
+    def clear(self) -> None:
+        self._cache_manager.clear()
+        self._keys_by_webhook = {}
@@ -3,6 +3,7 @@ from datetime import timedelta
 from typing import Optional, Self, Literal, Iterable
 from uuid import UUID, uuid4
 
+import orjson
 from pydantic import Field, AwareDatetime
 
 from backend.auth.domain.auth_user import AuthId
@@ -18,6 +19,7 @@ class SentErrorInfo(MyBase):
 
 
 class Message(MyBase):
+    id: UUID = Field(default_factory=uuid4, exclude=True)
     type: str
     event_code: str
     occurred_at: AwareDatetime
@@ -34,18 +36,48 @@ class Message(MyBase):
             payload=payload,
         )
 
+    def encode(self) -> bytes:
+        return orjson.dumps(self.model_dump(mode="json"))
+
+    def merged_with(self, other: "Message") -> Self:
+        """
+        Folds a later message of the same entity into this one, the id is kept: changes keep the final values,
+        delta is summed.
+        """
+        payload = {**self.payload, **other.payload}
+        if "changes" in self.payload or "changes" in other.payload:
+            payload["changes"] = {**self.payload.get("changes", {}), **other.payload.get("changes", {})}
+        if "delta" in self.payload and "delta" in other.payload:
+            payload["delta"] = self.payload["delta"] + other.payload["delta"]
+        return Message(
+            id=self.id, type=self.type, event_code=self.event_code, occurred_at=other.occurred_at, payload=payload
+        )
+
+    @classmethod
+    def decode(cls, message_id: UUID, body: bytes) -> Self:
+        return cls(id=message_id, **orjson.loads(body))
+
 
 class DeliveryTask(MyBase):
     id: UUID = Field(default_factory=uuid4)
     url: str
     data: Message
+    # Закодированный data, общий для всех доставок одного сообщения
+    body: Optional[bytes] = Field(None, exclude=True, repr=False)
     delays: tuple[int, ...]
     partkey: str
     auth_id: AuthId
+    batch_size: int = 1
+    # Доставки с одинаковым ключом сливаются, пока не наступил их срок отправки
+    aggregation_key: Optional[str] = None
+    content_encoding: Optional[Literal["gzip", "zstd"]] = None
+    # Сжатый body, вычисляется один раз на сообщение и кодировку
+    compressed_body: Optional[bytes] = Field(None, exclude=True, repr=False)
     status: Literal["unprocessed", "success_sent", "failed_sent",] = "unprocessed"
     retries: int = 0
     error_info: Optional[SentErrorInfo] = None
     last_retry_at: Optional[AwareDatetime] = None
+    postponed_until: Optional[AwareDatetime] = None
     created_at: AwareDatetime = Field(default_factory=get_current_datetime)
 
     @property
@@ -55,20 +87,47 @@ class DeliveryTask(MyBase):
         if len(self.delays) <= self.retries:
             return None
         if self.status == "unprocessed":
-            return get_current_datetime() + timedelta(seconds=self.delays[0])
+            scheduled = get_current_datetime() + timedelta(seconds=self.delays[0])
+        else:
+            scheduled = self.last_retry_at + timedelta(seconds=self.delays[self.retries])
 
-        return self.last_retry_at + timedelta(seconds=self.delays[self.retries])
+        if self.postponed_until and self.postponed_until > scheduled:
+            return self.postponed_until
+        return scheduled
 
     @property
     def max_retries(self):
         return len(self.delays)
 
+    @property
+    def is_completed(self) -> bool:
+        return self.status == "success_sent" or self.retries >= self.max_retries
+
+    def to_archived(self) -> "ArchivedDelivery":
+        return ArchivedDelivery(
+            id=self.id,
+            url=self.url,
+            event_code=self.data.event_code,
+            status=self.status,
+            retries=self.retries,
+            error_info=self.error_info,
+            partkey=self.partkey,
+            created_at=self.created_at,
+            last_retry_at=self.last_retry_at,
+            archived_at=get_current_datetime(),
+        )
+
+    @property
+    def encoded_body(self) -> bytes:
+        return self.body if self.body is not None else self.data.encode()
+
     def failed_sent(self, error_info: SentErrorInfo) -> Self:
         return self.model_copy(update={
             "status": "failed_sent",
             "retries": self.retries + 1,
             "error_info": error_info,
             "last_retry_at": get_current_datetime(),
+            "postponed_until": None,
         })
 
     def success_sent(self) -> Self:
@@ -77,8 +136,38 @@ class DeliveryTask(MyBase):
             "retries": self.retries + 1,
             "error_info": None,
             "last_retry_at": get_current_datetime(),
+            "postponed_until": None,
         })
 
+    def postponed(self, until: AwareDatetime) -> Self:
+        """Moves the next attempt without spending a retry"""
+        return self.model_copy(update={"postponed_until": until})
+
+    def released(self) -> Self:
+        """Stops the aggregation, the delivery is sent at its normal time"""
+        return self.model_copy(update={"aggregation_key": None, "postponed_until": None})
+
+    def aggregated(self, message: Message) -> Self:
+        # body сбрасывается: измененное сообщение еще не сохранено
+        return self.model_copy(update={
+            "data": self.data.merged_with(message),
+            "body": None,
+            "compressed_body": None,
+        })
+
+
+class ArchivedDelivery(MyBase):
+    id: UUID
+    url: str
+    event_code: str
+    status: Literal["success_sent", "failed_sent"]
+    retries: int
+    error_info: Optional[SentErrorInfo] = None
+    partkey: str
+    created_at: AwareDatetime
+    last_retry_at: Optional[AwareDatetime] = None
+    archived_at: AwareDatetime
+
 
 class DeliveryTaskRepo(ABC):
     @abstractmethod
@@ -102,7 +191,8 @@ class DeliveryTaskRepo(ABC):
         pass
 
     @abstractmethod
-    async def delete_many_before_date(self, core_date: AwareDatetime) -> None:
+    async def delete_many_before_date(self, core_date: AwareDatetime) -> int:
+        """Returns the number of deleted rows."""
         pass
 
     @abstractmethod
@@ -112,3 +202,75 @@ class DeliveryTaskRepo(ABC):
     @abstractmethod
     async def get_deliveries_for_send(self, limit=500, lock: Lock = "write") -> list[DeliveryTask]:
         pass
+
+    @abstractmethod
+    async def get_aggregating(self, keys: Iterable[str]) -> dict[str, DeliveryTask]:
+        """
+        Not yet due and not leased deliveries with the given aggregation keys.
+        The rows are locked, rows locked by other transactions are skipped.
+        """
+        pass
+
+    @abstractmethod
+    async def get_aggregating_for_targets(self, targets: Iterable[tuple[AuthId, str, str]]) -> list[DeliveryTask]:
+        """
+        Not yet due and not leased aggregating deliveries of the given (auth_id, url, partkey).
+        The rows are locked.
+        """
+        pass
+
+    @abstractmethod
+    async def get_next_due_at(self) -> Optional[AwareDatetime]:
+        """Earliest moment when one of the pending deliveries becomes claimable"""
+        pass
+
+    @abstractmethod
+    async def archive_many(self, items: Iterable[DeliveryTask]) -> None:
+        """Moves completed deliveries out of the live table"""
+        pass
+
+    @abstractmethod
+    async def get_archived(
+            self,
+            auth_id: AuthId,
+            limit: int = 100,
+            before: Optional[tuple[AwareDatetime, UUID]] = None,
+            status: Optional[str] = None,
+            event_code: Optional[str] = None,
+    ) -> list[ArchivedDelivery]:
+        """Newest first, `before` is the (archived_at, id) of the last item of the previous page"""
+        pass
+
+    @abstractmethod
+    async def claim_deliveries(
+            self,
+            limit: int,
+            lease_time: float,
+            owner: UUID,
+            ids: Optional[Iterable[UUID]] = None,
+            tenant_quota: Optional[int] = None,
+    ) -> list[DeliveryTask]:
+        """
+        Leases due deliveries to owner for lease_time seconds. Rows locked by other transactions and partkeys
+        leased by other workers are skipped. Saving a delivery releases its lease.
+        At most tenant_quota deliveries of one tenant are taken per call.
+        """
+        pass
+
+    @abstractmethod
+    async def renew_leases(self, ids: Iterable[UUID], owner: UUID, lease_time: float) -> int:
+        """Extends the leases still held by owner to lease_time seconds from now. Returns the number of renewed"""
+        pass
+
+    @abstractmethod
+    async def get_leased_by(self, ids: Iterable[UUID], owner: UUID) -> set[UUID]:
+        """
+        Ids of the deliveries whose lease was not taken over by another worker. The rows are locked
+        until the end of the transaction, so the lease cannot move before the results are saved.
+        """
+        pass
+
+    @abstractmethod
+    async def get_backlog_by_tenant(self, auth_ids: Optional[Iterable[AuthId]] = None) -> dict[AuthId, int]:
+        """Number of deliveries waiting to be sent, per tenant"""
+        pass
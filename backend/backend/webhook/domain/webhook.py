@@ -1,4 +1,4 @@
-from typing import Union, Self
+from typing import Union, Self, Optional, Literal
 from uuid import UUID
 
 from pydantic import Field, AwareDatetime, model_validator
@@ -15,6 +15,14 @@ class Webhook(MyBase):
     target_url: str
     delays: Union[tuple[int, ...]]
     auth_id: AuthId = Field(exclude=True)
+    enabled: bool = True
+    # Почему вебхук отключен автоматически: сколько цель была недоступна и последняя ошибка доставки
+    disabled_reason: Optional[str] = None
+    batch_size: int = 1
+    # Секунды, в течение которых обновления одного usage сливаются в одно событие. 0 - без агрегации
+    aggregation_window: int = 0
+    # Сжатие тела запроса, применяется начиная с WEBHOOK_COMPRESSION_THRESHOLD байт
+    compression: Optional[Literal["gzip", "zstd"]] = None
     created_at: AwareDatetime
     updated_at: AwareDatetime
 
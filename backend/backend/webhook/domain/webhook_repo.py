@@ -3,6 +3,7 @@ from typing import Optional, Iterable
 
 from pydantic import BaseModel, Field
 
+from backend.auth.domain.auth_user import AuthId
 from backend.shared.enums import Lock
 from backend.webhook.domain.webhook import WebhookId, Webhook
 
@@ -11,6 +12,10 @@ class WebhookSby(BaseModel):
     ids: Optional[set[WebhookId]] = None
     auth_ids: Optional[set[WebhookId]] = None
     event_codes: Optional[set[str]] = None
+    auth_event_pairs: Optional[set[tuple[AuthId, str]]] = None
+    target_urls: Optional[set[str]] = None
+    auth_url_pairs: Optional[set[tuple[AuthId, str]]] = None
+    enabled: Optional[bool] = None
     skip: int = 0
     limit: int = 100
     order_by: list[tuple[str, int]] = Field(default_factory=lambda: [("created_at", 1)])
@@ -1,23 +1,49 @@
-from typing import Iterable, Mapping, Type, Any
+from datetime import timedelta
+from typing import Iterable, Mapping, Type, Any, Optional
+from uuid import UUID as PyUUID
 
 from pydantic import AwareDatetime
-from sqlalchemy import Column, String, Table, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (
+    Column, String, Table, ForeignKey, LargeBinary, Identity, Index, select, func, tuple_, true, bindparam
+)
+from sqlalchemy.dialects.postgresql import JSONB, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.sqltypes import UUID, Integer, BigInteger
 
+from backend.auth.domain.auth_user import AuthId
 from backend.shared.database import metadata
+from backend.shared.partitions import DailyPartitions
 from backend.shared.enums import Lock
 from backend.shared.unit_of_work.base_repo_sql import SQLMapper, AwareDateTime, SqlBaseRepo
+from backend.shared.unit_of_work.change_log import Log
 from backend.shared.utils.dt import get_current_datetime
-from backend.webhook.domain.delivery_task import DeliveryTask, DeliveryTaskRepo
+from backend.webhook.domain.delivery_task import DeliveryTask, DeliveryTaskRepo, Message, ArchivedDelivery
+
+# Сообщение хранится один раз и разделяется всеми доставками, созданными из него
+webhook_message_table = Table(
+    "webhook_message",
+    metadata,
+    Column("id", UUID, primary_key=True),
+    Column("body", LargeBinary, nullable=False),
+    Column("auth_id", ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
+    Column("created_at", AwareDateTime(timezone=True), nullable=False, index=True),
+)
+
+# Сжатые варианты сообщения, по одному на кодировку
+webhook_message_compressed_table = Table(
+    "webhook_message_compressed",
+    metadata,
+    Column("message_id", ForeignKey("webhook_message.id", ondelete="CASCADE"), primary_key=True),
+    Column("encoding", String, primary_key=True),
+    Column("body", LargeBinary, nullable=False),
+)
 
 delivery_task_table = Table(
     "delivery_task",
     metadata,
     Column("id", UUID, primary_key=True),
     Column("url", String, nullable=False),
-    Column("data", JSONB, nullable=False),
+    Column("message_id", ForeignKey("webhook_message.id", ondelete="CASCADE"), nullable=False, index=True),
     Column("status", String, nullable=False),
     Column("retries", Integer, nullable=False),
     Column("max_retries", Integer, nullable=False),
@@ -25,31 +51,243 @@ delivery_task_table = Table(
     Column("delays", JSONB, nullable=False),
     Column("last_retry_at", AwareDateTime(timezone=True), nullable=True),
     Column("next_retry_at", AwareDateTime(timezone=True), nullable=True, index=True),
+    Column("postponed_until", AwareDateTime(timezone=True), nullable=True),
+    Column("lease_expires_at", AwareDateTime(timezone=True), nullable=True, index=True),
+    Column("lease_owner", UUID, nullable=True),
     Column("created_at", AwareDateTime(timezone=True), nullable=False, index=True),
     Column("partkey", String, nullable=False),
+    Column("batch_size", Integer, nullable=False, default=1),
+    Column("aggregation_key", String, nullable=True),
+    Column("content_encoding", String, nullable=True),
+    Column("auth_id", ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
+    Column("_order_col", BigInteger, Identity(), nullable=False),
+)
+
+# Только ожидающие отправки строки, в порядке выборки: размер индекса не зависит от накопленных доставок
+Index(
+    "ix_delivery_task_pending",
+    delivery_task_table.c["_order_col"],
+    delivery_task_table.c["next_retry_at"],
+    postgresql_where=(
+        delivery_task_table.c["next_retry_at"].isnot(None)
+        & (delivery_task_table.c["retries"] < delivery_task_table.c["max_retries"])
+    ),
+)
+
+# Позволяет выбрать тенантов с ожидающими доставками и их очереди без чтения самих строк
+Index(
+    "ix_delivery_task_pending_tenant",
+    delivery_task_table.c["auth_id"],
+    delivery_task_table.c["_order_col"],
+    delivery_task_table.c["next_retry_at"],
+    postgresql_where=(
+        delivery_task_table.c["next_retry_at"].isnot(None)
+        & (delivery_task_table.c["retries"] < delivery_task_table.c["max_retries"])
+    ),
+)
+
+# Агрегируются только еще не отправленные доставки
+Index(
+    "ix_delivery_task_aggregation_key",
+    delivery_task_table.c["aggregation_key"],
+    postgresql_where=(
+        delivery_task_table.c["aggregation_key"].isnot(None)
+        & (delivery_task_table.c["status"] == "unprocessed")
+    ),
+)
+
+# Аренда живет только между claim и записью результата, поэтому индекс почти всегда пуст
+Index(
+    "ix_delivery_task_leased_partkey",
+    delivery_task_table.c["partkey"],
+    delivery_task_table.c["lease_expires_at"],
+    postgresql_where=delivery_task_table.c["lease_expires_at"].isnot(None),
+)
+
+
+# Завершенные доставки, только добавление. Хранение ограничивается удалением дневных партиций
+delivery_archive_table = Table(
+    "delivery_archive",
+    metadata,
+    Column("id", UUID, primary_key=True),
+    Column("archived_at", AwareDateTime(timezone=True), primary_key=True),
+    Column("message_id", UUID, nullable=False),
+    Column("url", String, nullable=False),
+    Column("event_code", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("retries", Integer, nullable=False),
+    Column("error_info", JSONB, nullable=True),
+    Column("partkey", String, nullable=False),
     Column("auth_id", ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
-    Column("_order_col", BigInteger, primary_key=False, autoincrement=True),
+    Column("created_at", AwareDateTime(timezone=True), nullable=False),
+    Column("last_retry_at", AwareDateTime(timezone=True), nullable=True),
+    postgresql_partition_by="RANGE (archived_at)",
+)
+
+Index(
+    "ix_delivery_archive_history",
+    delivery_archive_table.c["auth_id"],
+    delivery_archive_table.c["archived_at"],
+    delivery_archive_table.c["id"],
 )
 
+delivery_archive_partitions = DailyPartitions(delivery_archive_table)
+
+
+def due_conditions(table: Table, now: AwareDatetime) -> list:
+    # Первые два условия совпадают с предикатом ix_delivery_task_pending
+    return [
+        table.c["next_retry_at"].isnot(None),
+        table.c["retries"] < table.c["max_retries"],
+        table.c["next_retry_at"] <= now,
+    ]
+
+
+def due_deliveries_query(now: AwareDatetime, limit: int):
+    return (
+        delivery_task_table
+        .select()
+        .where(*due_conditions(delivery_task_table, now))
+        .order_by(delivery_task_table.c["_order_col"])
+        .limit(limit)
+    )
+
+
+def next_retry_query():
+    """The earliest next_retry_at of pending deliveries without a lease, read from the next_retry_at index"""
+    table = delivery_task_table
+    return (
+        select(table.c["next_retry_at"])
+        .where(
+            table.c["next_retry_at"].isnot(None),
+            table.c["retries"] < table.c["max_retries"],
+            table.c["lease_expires_at"].is_(None),
+        )
+        .order_by(table.c["next_retry_at"])
+        .limit(1)
+    )
+
+
+def next_lease_expiry_query():
+    """The earliest lease expiry, leased deliveries become claimable again only after it"""
+    table = delivery_task_table
+    return (
+        select(table.c["lease_expires_at"])
+        .where(table.c["lease_expires_at"].isnot(None))
+        .order_by(table.c["lease_expires_at"])
+        .limit(1)
+    )
+
+
+def parse_inserted_deliveries(logs: Iterable[Log]) -> list[tuple[PyUUID, PyUUID]]:
+    """Returns (auth_id, delivery_id) pairs of the inserted delivery tasks."""
+    return [
+        (log.model_state["auth_id"], log.model_id) for log in logs
+        if log.collection_name == delivery_task_table.name and log.action == "insert"
+    ]
+
+
+def claim_candidates_query(
+        now: AwareDatetime,
+        limit: int,
+        ids: Optional[Iterable[PyUUID]] = None,
+        tenant_quota: Optional[int] = None,
+):
+    """
+    Selects due deliveries for a claim, interleaved across tenants.
+
+    Candidates are ordered by their position inside the tenant's queue: the first due delivery of every
+    tenant goes before the second one of any tenant, so a burst from one tenant cannot fill the whole batch
+    while others wait. Unused slots still go to the busy tenants. tenant_quota additionally caps the share
+    of one tenant per call.
+    """
+    tenant_quota = tenant_quota or limit
+    ids = list(ids) if ids is not None else None
+    candidate = delivery_task_table.alias("candidate")
+    leased = delivery_task_table.alias("leased")
+    pending = delivery_task_table.alias("pending")
+    tenant_pending = delivery_task_table.alias("tenant_pending")
+
+    def pending_conditions(table: Table) -> list:
+        conditions = due_conditions(table, now)
+        if ids is not None:
+            conditions.append(table.c["id"].in_(ids))
+        return conditions
+
+    # Partkey с живой арендой принадлежит другому воркеру
+    partkey_is_leased = (
+        select(leased.c["id"])
+        .where(
+            leased.c["partkey"] == pending.c["partkey"],
+            leased.c["lease_expires_at"].isnot(None),
+            leased.c["lease_expires_at"] > now,
+        )
+        .exists()
+    )
+
+    tenants = (
+        select(tenant_pending.c["auth_id"])
+        .where(*pending_conditions(tenant_pending))
+        .distinct()
+        .subquery("tenants")
+    )
+    tenant_head = (
+        select(
+            pending.c["id"],
+            pending.c["_order_col"],
+            func.row_number().over(order_by=pending.c["_order_col"]).label("position"),
+        )
+        .where(
+            pending.c["auth_id"] == tenants.c["auth_id"],
+            *pending_conditions(pending),
+            ~partkey_is_leased,
+        )
+        .order_by(pending.c["_order_col"])
+        .limit(tenant_quota)
+        .lateral("tenant_head")
+    )
+    # Round-robin: сначала первые доставки всех тенантов, потом вторые и т.д.
+    fair = (
+        select(tenant_head.c["id"])
+        .select_from(tenants.join(tenant_head, true()))
+        .order_by(tenant_head.c["position"], tenant_head.c["_order_col"])
+        .limit(limit)
+        .subquery("fair")
+    )
+
+    return (
+        select(candidate.c["id"])
+        .join(fair, fair.c["id"] == candidate.c["id"])
+        # Конкурентные claim-транзакции не делят один partkey до коммита аренды
+        .where(func.pg_try_advisory_xact_lock(func.hashtext(candidate.c["partkey"])))
+        .with_for_update(of=candidate, skip_locked=True)
+    )
+
 
 class SqlDeliveryTaskMapper(SQLMapper):
     def get_entity_type(self) -> Type[Any]:
         return DeliveryTask
 
     def entity_to_mapping(self, entity: DeliveryTask) -> dict:
-        result = entity.model_dump(mode="json")
+        result = entity.model_dump(mode="json", exclude={"data"})
         result["id"] = entity.id
+        result["message_id"] = entity.data.id
         result["auth_id"] = entity.auth_id
         result["last_retry_at"] = entity.last_retry_at
+        result["postponed_until"] = entity.postponed_until
         result["next_retry_at"] = entity.next_retry_at
         result["created_at"] = entity.created_at
         result["max_retries"] = entity.max_retries
+        # Любая запись результата освобождает аренду
+        result["lease_expires_at"] = None
+        result["lease_owner"] = None
         return result
 
     def mapping_to_entity(self, data: Mapping) -> DeliveryTask:
         return DeliveryTask(
             url=data["url"],
-            data=data["data"],
+            data=Message.decode(data["message_id"], data["body"]),
+            body=data["body"],
             status=data["status"],
             id=data["id"],
             retries=data["retries"],
@@ -57,7 +295,12 @@ class SqlDeliveryTaskMapper(SQLMapper):
             error_info=data["error_info"],
             created_at=data["created_at"],
             last_retry_at=data["last_retry_at"],
+            postponed_until=data["postponed_until"],
             partkey=data["partkey"],
+            batch_size=data["batch_size"],
+            aggregation_key=data["aggregation_key"],
+            content_encoding=data["content_encoding"],
+            compressed_body=data.get("compressed_body"),
             auth_id=data["auth_id"],
         )
 
@@ -65,25 +308,167 @@ class SqlDeliveryTaskMapper(SQLMapper):
         raise NotImplemented
 
 
+def archived_to_mapping(item: DeliveryTask) -> dict:
+    archived = item.to_archived()
+    result = archived.model_dump(mode="json")
+    result["id"] = archived.id
+    result["message_id"] = item.data.id
+    result["auth_id"] = item.auth_id
+    result["created_at"] = archived.created_at
+    result["last_retry_at"] = archived.last_retry_at
+    result["archived_at"] = archived.archived_at
+    return result
+
+
+def mapping_to_archived(data: Mapping) -> ArchivedDelivery:
+    return ArchivedDelivery(
+        id=data["id"],
+        url=data["url"],
+        event_code=data["event_code"],
+        status=data["status"],
+        retries=data["retries"],
+        error_info=data["error_info"],
+        partkey=data["partkey"],
+        created_at=data["created_at"],
+        last_retry_at=data["last_retry_at"],
+        archived_at=data["archived_at"],
+    )
+
+
 class SqlDeliveryTaskRepo(DeliveryTaskRepo):
     def __init__(self, session: AsyncSession, transaction_id: UUID):
         self._base_repo = SqlBaseRepo(
             session, SqlDeliveryTaskMapper(delivery_task_table), delivery_task_table, transaction_id
         )
+        self._transaction_id = transaction_id
+        # Логи вставок, уже выполненных в обход SqlBaseRepo
+        self._inserted_logs: list[Log] = []
+
+    def _add_applied_inserts(self, table: Table, ids: Iterable[PyUUID]) -> None:
+        # Для отката вставки достаточно id, тело сообщения в лог не копируется
+        for model_id in ids:
+            self._inserted_logs.append(
+                Log(
+                    collection_name=table.name,
+                    action="insert",
+                    model_state={"id": model_id},
+                    created_at=get_current_datetime(),
+                    transaction_id=self._transaction_id,
+                    model_id=model_id,
+                )
+            )
+
+    async def _add_messages(self, items: Iterable[DeliveryTask]) -> None:
+        # Сообщения пишутся сразу в текущей транзакции, до вставки доставок при коммите.
+        # В лог попадают только действительно вставленные: откат не должен удалить чужое общее сообщение,
+        # сжатые варианты удаляются вместе с сообщением каскадом
+        messages = {}
+        for item in items:
+            if item.data.id not in messages:
+                messages[item.data.id] = {
+                    "id": item.data.id,
+                    "body": item.encoded_body,
+                    "auth_id": item.auth_id,
+                    "created_at": item.created_at,
+                }
+        if messages:
+            stmt = (
+                insert(webhook_message_table)
+                .on_conflict_do_nothing(index_elements=["id"])
+                .returning(webhook_message_table.c["id"])
+            )
+            inserted = await self._base_repo.session.scalars(stmt, list(messages.values()))
+            self._add_applied_inserts(webhook_message_table, inserted)
+
+        compressed = {}
+        for item in items:
+            if item.compressed_body is not None:
+                compressed[(item.data.id, item.content_encoding)] = {
+                    "message_id": item.data.id,
+                    "encoding": item.content_encoding,
+                    "body": item.compressed_body,
+                }
+        if compressed:
+            stmt = (
+                insert(webhook_message_compressed_table)
+                .on_conflict_do_nothing(index_elements=["message_id", "encoding"])
+            )
+            await self._base_repo.session.execute(stmt, list(compressed.values()))
+
+    async def _update_messages(self, items: Iterable[DeliveryTask]) -> None:
+        # Сообщение агрегируемой доставки принадлежит только ей и перезаписывается на месте с тем же id.
+        # Тело в лог не попадает, откат вернет строку доставки, но не прежнее тело сообщения
+        items = list(items)
+        messages = {item.data.id: item.encoded_body for item in items}
+        if not messages:
+            return
+        table = webhook_message_table
+        stmt = table.update().where(table.c["id"] == bindparam("_id")).values(body=bindparam("_body"))
+        await self._base_repo.session.execute(stmt, [{"_id": key, "_body": body} for key, body in messages.items()])
+        # Прежние сжатые варианты устарели, вместо них пишутся пересобранные вместе с телом
+        compressed = webhook_message_compressed_table
+        await self._base_repo.session.execute(
+            compressed.delete().where(compressed.c["message_id"].in_(list(messages)))
+        )
+        rebuilt = [
+            {"message_id": item.data.id, "encoding": item.content_encoding, "body": item.compressed_body}
+            for item in items if item.compressed_body is not None
+        ]
+        if rebuilt:
+            await self._base_repo.session.execute(compressed.insert(), rebuilt)
+
+    async def _to_entities(self, records: Iterable[Mapping]) -> list[DeliveryTask]:
+        records = list(records)
+        message_ids = {x["message_id"] for x in records}
+        if not message_ids:
+            return []
+        stmt = (
+            select(webhook_message_table.c["id"], webhook_message_table.c["body"])
+            .where(webhook_message_table.c["id"].in_(message_ids))
+        )
+        bodies = {row.id: row.body for row in await self._base_repo.session.execute(stmt)}
+
+        compressed = {}
+        compressed_ids = {x["message_id"] for x in records if x["content_encoding"]}
+        if compressed_ids:
+            table = webhook_message_compressed_table
+            stmt = select(table).where(table.c["message_id"].in_(compressed_ids))
+            compressed = {
+                (row.message_id, row.encoding): row.body for row in await self._base_repo.session.execute(stmt)
+            }
+
+        return [
+            self._base_repo.mapper.mapping_to_entity({
+                **x,
+                "body": bodies[x["message_id"]],
+                "compressed_body": compressed.get((x["message_id"], x["content_encoding"])),
+            })
+            for x in records
+        ]
 
     async def get_all(self, lock: Lock = "write") -> list[DeliveryTask]:
-        return await self._base_repo.get_all(lock)
+        stmt = delivery_task_table.select().order_by(delivery_task_table.c["created_at"])
+        if lock == "write":
+            stmt = stmt.with_for_update()
+        result = await self._base_repo.session.execute(stmt)
+        return await self._to_entities(result.mappings())
 
     async def add_one(self, item: DeliveryTask) -> None:
+        await self._add_messages([item])
         await self._base_repo.add_one(item)
 
     async def add_many(self, items: Iterable[DeliveryTask]) -> None:
+        items = list(items)
+        await self._add_messages(items)
         await self._base_repo.add_many(items)
 
     async def update_one(self, item: DeliveryTask) -> None:
-        await self._base_repo.update_one(item)
+        await self.update_many([item])
 
     async def update_many(self, items: Iterable[DeliveryTask]) -> None:
+        items = list(items)
+        # Без body доставка несет измененное сообщение (после агрегации), его нужно сохранить
+        await self._update_messages([x for x in items if x.body is None])
         await self._base_repo.update_many(items)
 
     async def delete_one(self, item: DeliveryTask) -> None:
@@ -95,27 +480,176 @@ class SqlDeliveryTaskRepo(DeliveryTaskRepo):
     def parse_logs(self):
         return self._base_repo.parse_logs()
 
+    def parse_applied_logs(self):
+        result = self._base_repo.parse_applied_logs() + self._inserted_logs
+        self._inserted_logs = []
+        return result
+
+    async def archive_many(self, items: Iterable[DeliveryTask]) -> None:
+        items = list(items)
+        if not items:
+            return
+        # Архив пишется сразу в текущей транзакции, удаление из живой таблицы выполнится при коммите
+        await self._base_repo.session.execute(
+            delivery_archive_table.insert(), [archived_to_mapping(item) for item in items]
+        )
+        self._add_applied_inserts(delivery_archive_table, (item.id for item in items))
+        await self._base_repo.delete_many(items)
+
+    async def get_archived(
+            self,
+            auth_id: AuthId,
+            limit: int = 100,
+            before: Optional[tuple[AwareDatetime, PyUUID]] = None,
+            status: Optional[str] = None,
+            event_code: Optional[str] = None,
+    ) -> list[ArchivedDelivery]:
+        table = delivery_archive_table
+        stmt = (
+            table
+            .select()
+            .where(table.c["auth_id"] == auth_id)
+            .order_by(table.c["archived_at"].desc(), table.c["id"].desc())
+            .limit(limit)
+        )
+        if before is not None:
+            stmt = stmt.where(tuple_(table.c["archived_at"], table.c["id"]) < tuple(before))
+        if status is not None:
+            stmt = stmt.where(table.c["status"] == status)
+        if event_code is not None:
+            stmt = stmt.where(table.c["event_code"] == event_code)
+        result = await self._base_repo.session.execute(stmt)
+        return [mapping_to_archived(x) for x in result.mappings()]
+
     async def get_deliveries_for_send(self, limit=500, lock: Lock = "write") -> list[DeliveryTask]:
+        stmt = due_deliveries_query(get_current_datetime(), limit)
+        if lock == "write":
+            stmt = stmt.with_for_update()
+        result = await self._base_repo.session.execute(stmt)
+        return await self._to_entities(result.mappings())
+
+    async def claim_deliveries(
+            self,
+            limit: int,
+            lease_time: float,
+            owner: PyUUID,
+            ids: Optional[Iterable[PyUUID]] = None,
+            tenant_quota: Optional[int] = None,
+    ) -> list[DeliveryTask]:
+        now = get_current_datetime()
+        candidates = claim_candidates_query(now, limit, ids, tenant_quota)
         stmt = (
             delivery_task_table
-            .select()
+            .update()
+            .where(delivery_task_table.c["id"].in_(candidates))
+            .values(lease_expires_at=now + timedelta(seconds=lease_time), lease_owner=owner)
+            .returning(*delivery_task_table.c)
+        )
+        result = await self._base_repo.session.execute(stmt)
+        records = sorted(result.mappings(), key=lambda x: x["_order_col"])
+        return await self._to_entities(records)
+
+    async def renew_leases(self, ids: Iterable[PyUUID], owner: PyUUID, lease_time: float) -> int:
+        table = delivery_task_table
+        stmt = (
+            table
+            .update()
+            .where(table.c["id"].in_(list(ids)), table.c["lease_owner"] == owner)
+            .values(lease_expires_at=get_current_datetime() + timedelta(seconds=lease_time))
+        )
+        return (await self._base_repo.session.execute(stmt)).rowcount
+
+    async def get_leased_by(self, ids: Iterable[PyUUID], owner: PyUUID) -> set[PyUUID]:
+        table = delivery_task_table
+        stmt = (
+            select(table.c["id"])
+            .where(table.c["id"].in_(list(ids)), table.c["lease_owner"] == owner)
             .with_for_update()
+        )
+        return set(await self._base_repo.session.scalars(stmt))
+
+    async def get_aggregating(self, keys: Iterable[str]) -> dict[str, DeliveryTask]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        table = delivery_task_table
+        stmt = (
+            table
+            .select()
             .where(
-                delivery_task_table.c["next_retry_at"] <= get_current_datetime(),
-                delivery_task_table.c["next_retry_at"].isnot(None),
-                delivery_task_table.c["retries"] < delivery_task_table.c["max_retries"],
+                table.c["aggregation_key"].in_(keys),
+                table.c["status"] == "unprocessed",
+                table.c["lease_expires_at"].is_(None),
+                table.c["next_retry_at"] > get_current_datetime(),
             )
-            .limit(limit)
-            .order_by(delivery_task_table.c["_order_col"])
+            .order_by(table.c["_order_col"])
+            .with_for_update(skip_locked=True)
         )
         result = await self._base_repo.session.execute(stmt)
-        records = result.mappings()
-        return [self._base_repo.mapper.mapping_to_entity(x) for x in records]
+        deliveries = await self._to_entities(result.mappings())
+        aggregating = {}
+        for delivery in deliveries:
+            aggregating.setdefault(delivery.aggregation_key, delivery)
+        return aggregating
 
-    async def delete_many_before_date(self, dt: AwareDatetime) -> None:
+    async def get_aggregating_for_targets(self, targets: Iterable[tuple[PyUUID, str, str]]) -> list[DeliveryTask]:
+        targets = list(targets)
+        if not targets:
+            return []
+        table = delivery_task_table
+        # Без skip_locked: пропущенная агрегация ушла бы позже новой доставки той же partkey
+        stmt = (
+            table
+            .select()
+            .where(
+                tuple_(table.c["auth_id"], table.c["url"], table.c["partkey"]).in_(targets),
+                table.c["aggregation_key"].isnot(None),
+                table.c["status"] == "unprocessed",
+                table.c["lease_expires_at"].is_(None),
+                table.c["next_retry_at"] > get_current_datetime(),
+            )
+            .order_by(table.c["_order_col"])
+            .with_for_update()
+        )
+        result = await self._base_repo.session.execute(stmt)
+        return await self._to_entities(result.mappings())
+
+    async def get_next_due_at(self) -> Optional[AwareDatetime]:
+        # Два чтения по индексам вместо min(greatest(...)) по всем ожидающим строкам:
+        # арендованная строка была готова к отправке при claim, ее срок - окончание аренды
+        session = self._base_repo.session
+        dates = [await session.scalar(next_retry_query()), await session.scalar(next_lease_expiry_query())]
+        dates = [x for x in dates if x is not None]
+        return min(dates) if dates else None
+
+    async def get_backlog_by_tenant(self, auth_ids: Optional[Iterable[PyUUID]] = None) -> dict[PyUUID, int]:
+        table = delivery_task_table
+        stmt = (
+            select(table.c["auth_id"], func.count())
+            .where(table.c["next_retry_at"].isnot(None), table.c["retries"] < table.c["max_retries"])
+            .group_by(table.c["auth_id"])
+        )
+        if auth_ids is not None:
+            stmt = stmt.where(table.c["auth_id"].in_(list(auth_ids)))
+        result = await self._base_repo.session.execute(stmt)
+        return {auth_id: count for auth_id, count in result}
+
+    async def delete_many_before_date(self, dt: AwareDatetime) -> int:
         stmt = (
             delivery_task_table
             .delete()
             .where(delivery_task_table.c["created_at"] < dt)
         )
-        await self._base_repo.session.execute(stmt)
+        deleted = (await self._base_repo.session.execute(stmt)).rowcount
+
+        # Дневные партиции архива удаляются целиком, построчно чистится только default партиция
+        deleted += await delivery_archive_partitions.delete_default_rows_before(self._base_repo.session, dt)
+
+        # Сообщения удаляются после доставок: оставшиеся ссылки на них снимет каскад внешнего ключа
+        stmt = (
+            webhook_message_table
+            .delete()
+            .where(webhook_message_table.c["created_at"] < dt)
+        )
+        deleted += (await self._base_repo.session.execute(stmt)).rowcount
+        return deleted
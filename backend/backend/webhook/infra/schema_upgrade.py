@@ -0,0 +1,71 @@
+# Приводит таблицы webhook и delivery_task, созданные прежними версиями, к текущей схеме.
+# create_all не меняет существующие таблицы, поэтому каждый шаг идемпотентен и выполняется при каждом старте
+WEBHOOK_SCHEMA_UPGRADES = [
+    "ALTER TABLE webhook ADD COLUMN IF NOT EXISTS enabled BOOLEAN NOT NULL DEFAULT true",
+    "ALTER TABLE webhook ADD COLUMN IF NOT EXISTS disabled_reason VARCHAR",
+    "ALTER TABLE webhook ADD COLUMN IF NOT EXISTS batch_size INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE webhook ADD COLUMN IF NOT EXISTS aggregation_window INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE webhook ADD COLUMN IF NOT EXISTS compression VARCHAR",
+
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS postponed_until TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS lease_owner UUID",
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS batch_size INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS aggregation_key VARCHAR",
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS content_encoding VARCHAR",
+    "ALTER TABLE delivery_task ADD COLUMN IF NOT EXISTS message_id UUID",
+
+    # Тело из колонки data переносится в webhook_message, id сообщения - id доставки
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'delivery_task' AND column_name = 'data'
+        ) THEN
+            INSERT INTO webhook_message (id, body, auth_id, created_at)
+            SELECT id, convert_to(data::text, 'UTF8'), auth_id, created_at
+            FROM delivery_task
+            WHERE message_id IS NULL;
+
+            UPDATE delivery_task SET message_id = id WHERE message_id IS NULL;
+            ALTER TABLE delivery_task DROP COLUMN data;
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE delivery_task ALTER COLUMN message_id SET NOT NULL",
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conname = 'delivery_task_message_id_fkey'
+        ) THEN
+            ALTER TABLE delivery_task ADD CONSTRAINT delivery_task_message_id_fkey
+                FOREIGN KEY (message_id) REFERENCES webhook_message (id) ON DELETE CASCADE;
+        END IF;
+    END $$
+    """,
+
+    # Раньше _order_col не заполнялся: нумеруем старые строки по времени создания и включаем identity
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'delivery_task' AND column_name = '_order_col' AND is_identity = 'NO'
+        ) THEN
+            UPDATE delivery_task AS t SET _order_col = o.position
+            FROM (SELECT id, row_number() OVER (ORDER BY created_at) AS position FROM delivery_task) AS o
+            WHERE t.id = o.id AND t._order_col IS NULL;
+
+            ALTER TABLE delivery_task ALTER COLUMN _order_col SET NOT NULL;
+            ALTER TABLE delivery_task ALTER COLUMN _order_col ADD GENERATED BY DEFAULT AS IDENTITY;
+            PERFORM setval(
+                pg_get_serial_sequence('delivery_task', '_order_col'),
+                (SELECT COALESCE(max(_order_col), 0) + 1 FROM delivery_task),
+                false
+            );
+        END IF;
+    END $$
+    """,
+]
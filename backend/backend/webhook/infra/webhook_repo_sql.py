@@ -1,12 +1,14 @@
-from typing import Iterable, Mapping, Type, Any
+from typing import Iterable, Mapping, Type, Any, Optional
 
-from sqlalchemy import Table, Column, UUID, String, Integer, ForeignKey
+from sqlalchemy import Table, Column, UUID, String, Integer, ForeignKey, Boolean, tuple_
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.shared.database import metadata
 from backend.shared.enums import Lock
+from backend.auth.domain.auth_user import AuthId
 from backend.shared.unit_of_work.base_repo_sql import SqlBaseRepo, SQLMapper, AwareDateTime
+from backend.shared.unit_of_work.change_log import Log
 from backend.shared.utils.dt import get_current_datetime
 from backend.webhook.domain.webhook import WebhookId, Webhook
 from backend.webhook.domain.webhook_repo import WebhookSby, WebhookRepo
@@ -20,11 +22,27 @@ webhook_table = Table(
     Column("auth_id", ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
     Column("max_retries", Integer, nullable=False),
     Column("delays", JSONB, nullable=False),
+    Column("enabled", Boolean, nullable=False, default=True),
+    Column("disabled_reason", String, nullable=True),
+    Column("batch_size", Integer, nullable=False, default=1),
+    Column("aggregation_window", Integer, nullable=False, default=0),
+    Column("compression", String, nullable=True),
     Column('created_at', AwareDateTime(timezone=True), default=get_current_datetime),
     Column('updated_at', AwareDateTime(timezone=True), default=get_current_datetime),
 )
 
 
+def parse_changed_webhooks(logs: Iterable[Log]) -> list[tuple[WebhookId, Optional[tuple[AuthId, str]]]]:
+    """Returns (webhook_id, (auth_id, event_code)) of the changed webhooks, the key is None for deleted ones."""
+    return [
+        (
+            log.model_id,
+            (log.model_state["auth_id"], log.model_state["event_code"]) if log.model_state else None,
+        )
+        for log in logs if log.collection_name == webhook_table.name
+    ]
+
+
 class WebhookSqlMapper(SQLMapper):
     def get_entity_type(self) -> Type[Any]:
         return Webhook
@@ -42,6 +60,11 @@ class WebhookSqlMapper(SQLMapper):
             delays=delays,
             event_code=data["event_code"],
             target_url=data["target_url"],
+            enabled=data["enabled"],
+            disabled_reason=data["disabled_reason"],
+            batch_size=data["batch_size"],
+            aggregation_window=data["aggregation_window"],
+            compression=data["compression"],
             auth_id=str(data["auth_id"]),
             created_at=data["created_at"],
             updated_at=data["updated_at"],
@@ -58,6 +81,16 @@ class WebhookSqlMapper(SQLMapper):
             result.append(webhook_table.c["auth_id"].in_(sby.auth_ids))
         if sby.event_codes:
             result.append(webhook_table.c["event_code"].in_(sby.event_codes))
+        if sby.auth_event_pairs:
+            columns = tuple_(webhook_table.c["auth_id"], webhook_table.c["event_code"])
+            result.append(columns.in_(list(sby.auth_event_pairs)))
+        if sby.target_urls:
+            result.append(webhook_table.c["target_url"].in_(sby.target_urls))
+        if sby.auth_url_pairs:
+            columns = tuple_(webhook_table.c["auth_id"], webhook_table.c["target_url"])
+            result.append(columns.in_(list(sby.auth_url_pairs)))
+        if sby.enabled is not None:
+            result.append(webhook_table.c["enabled"] == sby.enabled)
         return result
 
 
@@ -76,10 +109,10 @@ class SqlWebhookRepo(WebhookRepo):
         await self._base_repo.update_one(item)
 
     async def get_one_by_id(self, item_id: WebhookId, lock: Lock = "write") -> Webhook:
-        return await self._base_repo.get_one_by_id(item_id)
+        return await self._base_repo.get_one_by_id(item_id, lock)
 
     async def get_selected(self, sby: WebhookSby, lock: Lock = "write") -> list[Webhook]:
-        return await self._base_repo.get_selected(sby)
+        return await self._base_repo.get_selected(sby, lock)
 
     async def delete_one(self, item: Webhook) -> None:
         await self._base_repo.delete_one(item)
@@ -16,6 +16,7 @@ from backend.startup_service import StartupShutdownManager
 from backend.subscription.domain.plan_repo import PlanSby
 from backend.subscription.domain.subscription_repo import SubscriptionSby
 from backend.webhook.domain.webhook_repo import WebhookSby
+from backend.webhook.infra.delivery_task_repo_sql import delivery_archive_table
 
 container = get_container()
 
@@ -45,6 +46,8 @@ async def preparations():
     db_name = config.DB_NAME + "_test"
     manager = StartupShutdownManager(db_name=db_name)
     await manager.on_startup()
+    # Тесты Telegraph запускают доставку сами, фоновый воркер будится каждым коммитом и забирал бы их доставки
+    container.telegraph_worker().stop()
 
     yield
 
@@ -125,3 +128,10 @@ async def clear():
         await uow.delivery_task_repo().delete_many_before_date(before_date)
 
         await uow.commit()
+
+    # Очистка по сроку не трогает дневные партиции архива
+    async with container.session_factory()() as session:
+        await session.execute(delivery_archive_table.delete())
+        await session.commit()
+
+    container.webhook_cache().clear()
@@ -0,0 +1,90 @@
+from typing import Optional
+from uuid import uuid4
+
+import pytest
+
+from backend.bootstrap import get_container
+from backend.shared.jobs.batch_job import BatchJob, BatchJobRunner
+from backend.shared.jobs.checkpoint import Cursor
+from backend.shared.unit_of_work.uow import UnitOfWork
+
+container = get_container()
+
+
+class NumbersJob(BatchJob[int]):
+    def __init__(self, numbers: list[int], bad: set[int] = None, crash_after: Optional[int] = None):
+        self.name = f"numbers_{uuid4()}"
+        self.numbers = numbers
+        self.bad = bad or set()
+        self.crash_after = crash_after
+        self.done = []
+        self.fetches = 0
+
+    async def fetch(self, uow: UnitOfWork, after: Optional[Cursor], limit: int, part: int, parts: int) -> list[int]:
+        self.fetches += 1
+        start = after[0] if after else -1
+        return [x for x in self.numbers if x > start and x % parts == part][:limit]
+
+    def cursor_of(self, item: int) -> Cursor:
+        return [item]
+
+    async def process(self, uow: UnitOfWork, item: int) -> None:
+        if item in self.bad:
+            raise ValueError(item)
+
+    async def after_batch(self, uow: UnitOfWork, items: list[int]) -> None:
+        if self.crash_after is not None and items and items[-1] >= self.crash_after:
+            raise RuntimeError("Crash")
+        # Только обработанные элементы: неудачная попытка всего батча сюда не попадает
+        self.done.extend(items)
+
+
+async def get_cursor(job_name: str) -> Optional[Cursor]:
+    async with container.unit_of_work_factory().create_uow() as uow:
+        return await uow.job_checkpoint_repo().get_cursor(job_name)
+
+
+@pytest.mark.asyncio
+async def test_failed_item_does_not_stop_the_pass():
+    job = NumbersJob(list(range(10)), bad={3})
+    stats = await BatchJobRunner(container.unit_of_work_factory(), batch_size=4).run(job)
+
+    assert job.done == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert stats.processed == 9
+    assert stats.failed == 1
+    assert stats.batches == 3
+    # Проход завершен, курсор сброшен
+    assert await get_cursor(job.name) is None
+
+
+@pytest.mark.asyncio
+async def test_only_failed_batch_is_fetched_again():
+    job = NumbersJob(list(range(8)), bad={5})
+    await BatchJobRunner(container.unit_of_work_factory(), batch_size=4).run(job)
+
+    assert job.done == [0, 1, 2, 3, 4, 6, 7]
+    # Два батча, повтор второго по одному элементу и пустая выборка в конце
+    assert job.fetches == 4
+
+
+@pytest.mark.asyncio
+async def test_job_resumes_from_checkpoint_after_crash():
+    job = NumbersJob(list(range(10)), crash_after=7)
+    runner = BatchJobRunner(container.unit_of_work_factory(), batch_size=4)
+    with pytest.raises(RuntimeError):
+        await runner.run(job)
+    assert await get_cursor(job.name) == [3]
+
+    job.crash_after = None
+    job.done = []
+    await runner.run(job)
+    assert job.done == [4, 5, 6, 7, 8, 9]
+
+
+@pytest.mark.asyncio
+async def test_parts_have_own_checkpoints():
+    job = NumbersJob(list(range(20)))
+    stats = await BatchJobRunner(container.unit_of_work_factory(), batch_size=3, parts=3, parallelism=2).run(job)
+
+    assert sorted(job.done) == list(range(20))
+    assert stats.processed == 20
@@ -0,0 +1,77 @@
+from datetime import datetime, timezone, timedelta
+from uuid import uuid4
+
+import pytest
+
+from backend.bootstrap import get_container
+from backend.shared.jobs.cron import CronExpression
+from backend.shared.jobs.cron_scheduler import CronScheduler, CronJob
+from backend.shared.jobs.job_run_repo_sql import SqlJobRunRepo
+
+container = get_container()
+
+# Понедельник
+MONDAY = datetime(2026, 10, 19, 14, 37, 12, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("0 3 * * *", datetime(2026, 10, 20, 3, 0, tzinfo=timezone.utc)),
+    ("*/15 * * * *", datetime(2026, 10, 19, 14, 45, tzinfo=timezone.utc)),
+    ("30 2-5 * * 1-5", datetime(2026, 10, 20, 2, 30, tzinfo=timezone.utc)),
+    ("0 0 1 * *", datetime(2026, 11, 1, 0, 0, tzinfo=timezone.utc)),
+    ("0 0 * * 7", datetime(2026, 10, 25, 0, 0, tzinfo=timezone.utc)),
+    # Оба поля дня заданы: достаточно совпадения любого из них
+    ("0 0 13 * 5", datetime(2026, 10, 23, 0, 0, tzinfo=timezone.utc)),
+    ("0 12 29 2 *", datetime(2028, 2, 29, 12, 0, tzinfo=timezone.utc)),
+])
+def test_cron_next_after(expression, expected):
+    assert CronExpression(expression).next_after(MONDAY) == expected
+
+
+@pytest.mark.parametrize("expression", ["* * *", "61 * * * *", "*/0 * * * *", "5-1 * * * *", "0 0 31 2 *"])
+def test_invalid_cron_expression(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression).next_after(MONDAY)
+
+
+async def get_runs(job_name: str) -> list[dict]:
+    async with container.session_factory()() as session:
+        return await SqlJobRunRepo(session).get_last_runs(job_name)
+
+
+@pytest.mark.asyncio
+async def test_slot_runs_once_across_schedulers():
+    calls = []
+
+    async def callback():
+        calls.append(True)
+        return 42
+
+    job_name = f"job_{uuid4()}"
+    # Слот в прошлом и большой misfire_grace: оба планировщика видят один и тот же пропущенный слот
+    job = CronJob(job_name, CronExpression("0 0 * * *"), callback, misfire_grace=timedelta(days=2))
+    schedulers = [CronScheduler(container.session_factory(), [job]) for _ in range(2)]
+    for scheduler in schedulers:
+        await scheduler.run()
+
+    assert len(calls) == 1
+    runs = await get_runs(job_name)
+    assert len(runs) == 1
+    assert runs[0]["rows_affected"] == 42
+    assert runs[0]["finished_at"] is not None
+    assert runs[0]["error"] is None
+    assert 0 < schedulers[0].next_run_delay() <= 86_400
+
+
+@pytest.mark.asyncio
+async def test_failed_run_is_recorded():
+    async def callback():
+        raise RuntimeError("Boom")
+
+    job_name = f"job_{uuid4()}"
+    scheduler = CronScheduler(container.session_factory(), [CronJob(job_name, CronExpression("* * * * *"), callback)])
+    await scheduler.run()
+
+    runs = await get_runs(job_name)
+    assert len(runs) == 1
+    assert "Boom" in runs[0]["error"]
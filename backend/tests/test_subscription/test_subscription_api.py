@@ -1,10 +1,13 @@
 from datetime import timedelta
+from uuid import uuid4, UUID
 
 import pytest
 
+from backend import config
 from backend.bootstrap import get_container
 from backend.shared.utils.dt import get_current_datetime
 from backend.subscription.adapters.schemas import SubscriptionCreate, SubscriptionUpdate, UsageSchema, DiscountSchema
+from backend.subscription.application import subscription_usecases
 from backend.subscription.domain.cycle import Period
 from backend.subscription.domain.discount import Discount
 from backend.subscription.domain.enums import SubscriptionStatus
@@ -428,6 +431,94 @@ class TestSpecificUsageAPI:
         expected = {f"usages.{remove_code}": "action:removed", "updated_at": get_current_datetime()}
         check_changes(sub_updated.changes, expected)
 
+    @pytest.mark.asyncio
+    async def test_usage_batch_endpoint(self, client, sub_with_usages, event_handler):
+        missing_sub_id = uuid4()
+        payload = [
+            {"subscription_id": str(sub_with_usages.id), "code": "first", "value": 10},
+            {"subscription_id": str(missing_sub_id), "code": "first", "value": 1},
+            {"subscription_id": str(sub_with_usages.id), "code": "unknown", "value": 1},
+            {"subscription_id": str(sub_with_usages.id), "code": "first", "value": 5},
+        ]
+        response = await client.post("/subscription/usage-batch", json=payload)
+        response.raise_for_status()
+
+        statuses = [x["status"] for x in response.json()]
+        assert statuses == ["ok", "subscription_not_found", "usage_not_found", "ok"]
+
+        assert len(event_handler.events) == 1
+        sub_updated = event_handler.get(SubUpdated)
+        expected = {"usages.first": "action:updated", "updated_at": get_current_datetime()}
+        check_changes(sub_updated.changes, expected)
+
+        async with container.unit_of_work_factory().create_uow() as uow:
+            real = await uow.subscription_repo().get_one_by_id(sub_with_usages.id)
+            assert real.usages.get("first").used_units == 15
+
+    @pytest.mark.asyncio
+    async def test_usage_batch_endpoint_rejects_non_positive_value(self, client, sub_with_usages, event_handler):
+        for value in (0, -5):
+            payload = [{"subscription_id": str(sub_with_usages.id), "code": "first", "value": value}]
+            response = await client.post("/subscription/usage-batch", json=payload)
+            assert response.status_code == 422
+        assert len(event_handler.events) == 0
+
+    @pytest.mark.asyncio
+    async def test_usage_batch_endpoint_reports_not_processed_chunks(
+            self, client, sub_with_usages, event_handler, monkeypatch
+    ):
+        # Наибольший UUID: подписки обрабатываются по возрастанию id, ее чанк идет последним
+        failing_sub_id = UUID(int=2 ** 128 - 1)
+        increase_usages = subscription_usecases.increase_usages
+
+        async def fail_on_chunk(increments, auth_id, uow):
+            if any(sub_id == failing_sub_id for sub_id, _code, _value in increments):
+                raise RuntimeError("Database is unavailable")
+            return await increase_usages(increments, auth_id, uow)
+
+        monkeypatch.setattr(config, "USAGE_BATCH_CHUNK_SIZE", 1)
+        monkeypatch.setattr(subscription_usecases, "increase_usages", fail_on_chunk)
+        payload = [
+            {"subscription_id": str(sub_with_usages.id), "code": "first", "value": 10},
+            {"subscription_id": str(failing_sub_id), "code": "first", "value": 1},
+        ]
+        response = await client.post("/subscription/usage-batch", json=payload)
+        response.raise_for_status()
+
+        statuses = [x["status"] for x in response.json()]
+        assert statuses == ["ok", "not_processed"]
+        async with container.unit_of_work_factory().create_uow() as uow:
+            real = await uow.subscription_repo().get_one_by_id(sub_with_usages.id)
+            assert real.usages.get("first").used_units == 10
+
+    @pytest.mark.asyncio
+    async def test_consume_usage_endpoint(self, client, sub_with_usages, event_handler):
+        params = {"code": "first", "value": 100}
+        response = await client.patch(f"/subscription/{sub_with_usages.id}/consume-usage", params=params)
+        response.raise_for_status()
+        assert response.json() == 11
+
+        assert len(event_handler.events) == 1
+        sub_updated = event_handler.get(SubUpdated)
+        expected = {"usages.first": "action:updated", "updated_at": get_current_datetime()}
+        check_changes(sub_updated.changes, expected)
+
+    @pytest.mark.asyncio
+    async def test_consume_usage_endpoint_rejects_over_limit(self, client, sub_with_usages, event_handler):
+        params = {"code": "first", "value": 112}
+        response = await client.patch(f"/subscription/{sub_with_usages.id}/consume-usage", params=params)
+        assert response.status_code == 409
+        assert response.json()["remaining_units"] == 111
+        assert len(event_handler.events) == 0
+
+    @pytest.mark.asyncio
+    async def test_consume_usage_endpoint_rejects_non_positive_value(self, client, sub_with_usages, event_handler):
+        for value in (0, -5):
+            params = {"code": "first", "value": value}
+            response = await client.patch(f"/subscription/{sub_with_usages.id}/consume-usage", params=params)
+            assert response.status_code == 422
+        assert len(event_handler.events) == 0
+
 
 class TestSpecificDiscountAPI:
     @pytest.mark.asyncio
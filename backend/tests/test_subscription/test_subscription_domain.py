@@ -0,0 +1,28 @@
+import pytest
+
+from backend.subscription.domain.cycle import Period
+from backend.subscription.domain.exceptions import UsageLimitExceeded
+from backend.subscription.domain.usage import Usage
+
+
+def test_consume_usage_within_limit():
+    usage = Usage("First", "first", "GB", 100, Period.Monthly, used_units=30)
+    usage.consume(70)
+    assert usage.used_units == 100
+    assert usage.remaining_units == 0
+
+
+def test_consume_usage_over_limit():
+    usage = Usage("First", "first", "GB", 100, Period.Monthly, used_units=30)
+    with pytest.raises(UsageLimitExceeded) as exc_info:
+        usage.consume(71)
+    assert exc_info.value.remaining_units == 70
+    assert usage.used_units == 30
+
+
+@pytest.mark.parametrize("delta", [0, -10])
+def test_consume_usage_rejects_non_positive_delta(delta):
+    usage = Usage("First", "first", "GB", 100, Period.Monthly, used_units=30)
+    with pytest.raises(ValueError):
+        usage.consume(delta)
+    assert usage.used_units == 30
@@ -1,3 +1,4 @@
+import asyncio
 import random
 from datetime import timedelta
 
@@ -5,13 +6,15 @@ import pytest
 import pytest_asyncio
 
 from backend.bootstrap import get_container
+from backend.shared.event_driven.bus import Bus
 from backend.shared.utils.dt import get_current_datetime
 from backend.subscription.application.subscription_manager import SubManager
 from backend.subscription.domain.cycle import Period
 from backend.subscription.domain.plan import Plan
 from backend.subscription.domain.subscription import Subscription
 from backend.subscription.domain.enums import SubscriptionStatus
-from backend.subscription.domain.subscription_repo import SubscriptionSby
+from backend.subscription.domain.events import SubExpired, SubResumed, SubUsageUpdated, SubUpdated
+from backend.subscription.domain.subscription_repo import SubscriptionSby, Shard
 from backend.subscription.domain.usage import Usage
 from tests.conftest import current_user
 
@@ -69,6 +72,40 @@ async def test_manage_subscriptions_change_statuses(expired_subs_with_active_sta
         assert len(real) == len(expired_subs_with_active_status)
 
 
+@pytest.mark.asyncio
+async def test_sharded_managers_process_all_subscriptions(expired_subs_with_active_status, paused_subs):
+    managers = [
+        SubManager(container.unit_of_work_factory(), bulk_limit=2, shards=4, parallelism=2)
+        for _ in range(3)
+    ]
+    await asyncio.gather(*[manager.manage_expired_subscriptions() for manager in managers])
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        expired = await uow.subscription_repo().get_selected(SubscriptionSby(statuses={SubscriptionStatus.Expired}))
+        assert {x.id for x in expired} == {x.id for x in expired_subs_with_active_status}
+        active = await uow.subscription_repo().get_selected(SubscriptionSby(statuses={SubscriptionStatus.Active}))
+        assert {x.id for x in active} == {x.id for x in paused_subs}
+
+
+@pytest.mark.asyncio
+async def test_locked_shard_is_skipped(expired_subs_with_active_status):
+    manager = SubManager(container.unit_of_work_factory(), shards=1)
+
+    async with container.unit_of_work_factory().create_uow() as other_replica:
+        assert await other_replica.subscription_repo().try_lock_shard(Shard(0, 1))
+        await manager.manage_expired_subscriptions()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        real = await uow.subscription_repo().get_selected(SubscriptionSby(statuses={SubscriptionStatus.Expired}))
+        assert len(real) == 0
+
+    # Блокировка снята вместе с транзакцией - шард снова доступен
+    await manager.manage_expired_subscriptions()
+    async with container.unit_of_work_factory().create_uow() as uow:
+        real = await uow.subscription_repo().get_selected(SubscriptionSby(statuses={SubscriptionStatus.Expired}))
+        assert len(real) == len(expired_subs_with_active_status)
+
+
 @pytest.mark.asyncio
 async def test_manage_subscriptions_resume_paused_subs(expired_subs_with_active_status, paused_subs):
     manager = SubManager(container.unit_of_work_factory())
@@ -89,6 +126,25 @@ async def test_manage_subscriptions_resume_paused_subs(expired_subs_with_active_
         assert len(active_real) == len(expired_subs_with_active_status)
 
 
+@pytest.mark.asyncio
+async def test_manage_subscriptions_in_small_batches_emits_events(expired_subs_with_active_status, paused_subs):
+    published = []
+
+    async def handler(event, _context):
+        published.append(event)
+
+    bus = Bus()
+    bus.subscribe(SubExpired, handler)
+    bus.subscribe(SubResumed, handler)
+    manager = SubManager(container.unit_of_work_factory(), bulk_limit=2, eventbus=bus)
+    await manager.manage_expired_subscriptions()
+
+    expired_ids = {sub.id for sub in expired_subs_with_active_status}
+    resumed_ids = {sub.id for sub in paused_subs}
+    assert {x.id for x in published if isinstance(x, SubExpired)} == expired_ids
+    assert {x.id for x in published if isinstance(x, SubResumed)} == resumed_ids
+
+
 @pytest.mark.asyncio
 async def test_subscription_manager_renew_usages(plan):
     sub = Subscription.from_plan(plan, "AnySubscriberId")
@@ -128,6 +184,50 @@ async def test_subscription_manager_renew_usages(plan):
         assert real.usages.get("just_expired").used_units == 200
 
 
+@pytest.mark.asyncio
+async def test_renew_usages_emits_events_and_recomputes_earliest_renew(plan):
+    now = get_current_datetime()
+    sub = Subscription.from_plan(plan, "AnySubscriberId")
+    sub.usages.add(
+        Usage(title="AnyTitle", code="daily", unit="GB", available_units=10, renew_cycle=Period.Daily,
+              used_units=7, last_renew=now - timedelta(days=1, seconds=5))
+    )
+    sub.usages.add(
+        Usage(title="AnyTitle", code="weekly", unit="GB", available_units=10, renew_cycle=Period.Weekly,
+              used_units=3, last_renew=now - timedelta(days=2))
+    )
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.subscription_repo().add_one(sub)
+        await uow.commit()
+
+    published = []
+
+    async def handler(event, _context):
+        published.append(event)
+
+    bus = Bus()
+    bus.subscribe(SubUsageUpdated, handler)
+    bus.subscribe(SubUpdated, handler)
+    manager = SubManager(container.unit_of_work_factory(), eventbus=bus)
+    await manager.manage_usages()
+
+    usage_events = [x for x in published if isinstance(x, SubUsageUpdated)]
+    assert len(usage_events) == 1
+    assert usage_events[0].code == "daily"
+    assert usage_events[0].delta == -7
+    assert "used_units" in usage_events[0].changes
+    assert [x.changes for x in published if isinstance(x, SubUpdated)] == [{"usages.daily": "action:updated"}]
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        real = await uow.subscription_repo().get_one_by_id(sub.id)
+        assert real.usages.get("weekly").used_units == 3
+        # Следующее обновление теперь у weekly: через 5 дней, а не через сутки у daily
+        renewed = await uow.subscription_repo().get_selected(
+            SubscriptionSby(ids={sub.id}, usage_renew_date_lt=now + timedelta(days=4))
+        )
+        assert renewed == []
+
+
 class TestSubscriptionManagerResumeSubscriptionWithHighestPlanLevel:
     @pytest_asyncio.fixture(autouse=True)
     async def setup(self, current_user):
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+import pytest
+import pytest_asyncio
+
+from backend.bootstrap import get_container
+from backend.shared.utils.dt import get_current_datetime
+from backend.subscription.application.subscription_manager import SubManager
+from backend.subscription.application.subscription_scheduler import SubScheduler
+from backend.subscription.domain.enums import SubscriptionStatus
+from backend.subscription.domain.plan import Plan
+from backend.subscription.domain.subscription import Subscription
+from tests.conftest import current_user
+
+container = get_container()
+
+
+@pytest_asyncio.fixture()
+async def plan(current_user):
+    plan = Plan("Business", 100, "USD", current_user.id)
+    yield plan
+
+
+def create_scheduler(**kwargs) -> SubScheduler:
+    manager = SubManager(container.unit_of_work_factory())
+    return SubScheduler(manager, container.unit_of_work_factory(), check_period=3600, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_wakes_at_nearest_expiration(plan):
+    sub = Subscription.from_plan(plan, "AnySubscriberId")
+    sub.billing_info.last_billing = get_current_datetime() - timedelta(days=30, seconds=-60)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.subscription_repo().add_one(sub)
+        await uow.commit()
+
+    scheduler = create_scheduler()
+    await scheduler.run()
+    assert 0 <= scheduler.next_run_delay() <= 60
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_manager_when_deadline_is_due(plan):
+    scheduler = create_scheduler()
+    await scheduler.run()
+
+    sub = Subscription.from_plan(plan, "AnySubscriberId")
+    sub.billing_info.last_billing = get_current_datetime() - timedelta(days=31)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.subscription_repo().add_one(sub)
+        await uow.commit()
+
+    scheduler.push_many([sub.expiration_date])
+    assert scheduler.next_run_delay() == 0
+
+    await scheduler.run()
+    async with container.unit_of_work_factory().create_uow() as uow:
+        real = await uow.subscription_repo().get_one_by_id(sub.id)
+        assert real.status == SubscriptionStatus.Expired
+
+
+@pytest.mark.asyncio
+async def test_pushed_earlier_deadline_calls_wake_callback():
+    woken = []
+    scheduler = create_scheduler(on_earlier_deadline=lambda: woken.append(True))
+    await scheduler.run()
+
+    scheduler.push_many([get_current_datetime() + timedelta(days=3650)])
+    scheduler.push_many([get_current_datetime() + timedelta(seconds=30)])
+    assert len(woken) >= 1
+    assert scheduler.next_run_delay() <= 30
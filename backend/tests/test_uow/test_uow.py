@@ -1,7 +1,18 @@
+from datetime import timedelta
+from uuid import uuid4
+
 import pytest
+from sqlalchemy import select
 
 from backend.bootstrap import get_container
+from backend.shared.unit_of_work.change_log import Log, SqlLogRepo, log_partitions
+from backend.shared.utils.dt import get_current_datetime
+from backend.startup_service import WorkersStartup
 from backend.subscription.domain.plan import Plan
+from backend.subscription.domain.cycle import Period
+from backend.subscription.domain.events import PlanCreated
+from backend.webhook.domain.delivery_task import DeliveryTask, Message
+from backend.webhook.infra.delivery_task_repo_sql import webhook_message_table, delivery_archive_table
 from tests.conftest import current_user
 
 container = get_container()
@@ -40,3 +51,135 @@ async def test_uow_with_rollback_does_not_change_state(current_user):
         await uow.rollback()
         with pytest.raises(LookupError):
             await uow.plan_repo().get_one_by_id(plan.id)
+
+
+@pytest.mark.asyncio
+async def test_failed_savepoint_keeps_the_rest_of_transaction(current_user):
+    async with container.unit_of_work_factory().create_uow() as uow:
+        kept = Plan("Business", 111, "USD", current_user.id)
+        await uow.plan_repo().add_one(kept)
+
+        broken = Plan("Business", 222, "USD", current_user.id)
+        with pytest.raises(Exception):
+            async with uow.savepoint():
+                await uow.plan_repo().add_one(broken)
+                await uow.plan_repo().add_one(broken)
+                uow.push_event(
+                    PlanCreated(id=broken.id, title="Business", price=222, currency="USD",
+                                billing_cycle=Period.Monthly, auth_id=current_user.id)
+                )
+
+        saved = Plan("Business", 333, "USD", current_user.id)
+        async with uow.savepoint():
+            await uow.plan_repo().add_one(saved)
+
+        assert uow.parse_events() == []
+        await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.plan_repo().get_one_by_id(kept.id)
+        await uow.plan_repo().get_one_by_id(saved.id)
+        with pytest.raises(LookupError):
+            await uow.plan_repo().get_one_by_id(broken.id)
+
+
+@pytest.mark.asyncio
+async def test_old_log_partitions_are_dropped():
+    today = get_current_datetime().date()
+    old_day = today - timedelta(days=30)
+    async with container.session_factory()() as session:
+        await log_partitions.create_partitions(session, old_day, days=1)
+        await log_partitions.create_partitions(session, today, days=1)
+        old_log = Log(
+            transaction_id=uuid4(), action="insert", model_id=uuid4(), model_state={}, collection_name="plan",
+            created_at=get_current_datetime() - timedelta(days=30),
+        )
+        await SqlLogRepo(session).add_many_logs([old_log])
+        await session.commit()
+
+        deleted = await SqlLogRepo(session).delete_old_logs(get_current_datetime() - timedelta(days=7))
+        await session.commit()
+
+        days = await log_partitions.get_partition_days(session)
+    # Строки удаленных партиций тоже входят в счет
+    assert deleted >= 1
+    assert old_day not in days.values()
+    assert today in days.values()
+
+
+@pytest.mark.asyncio
+async def test_rollback_removes_delivery_messages(current_user):
+    msg = Message(type="event", event_code="plan_created", occurred_at=get_current_datetime(), payload={})
+    delivery = DeliveryTask(url="http://my-site.com", data=msg, delays=(0,), partkey="Hello", auth_id=current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().add_one(delivery)
+        await uow.commit()
+        await uow.rollback()
+
+    async with container.session_factory()() as session:
+        stmt = select(webhook_message_table.c["id"]).where(webhook_message_table.c["id"] == msg.id)
+        assert (await session.scalars(stmt)).all() == []
+
+
+@pytest.mark.asyncio
+async def test_rollback_of_archiving_restores_delivery(current_user):
+    msg = Message(type="event", event_code="plan_created", occurred_at=get_current_datetime(), payload={})
+    delivery = DeliveryTask(url="http://my-site.com", data=msg, delays=(0,), partkey="Hello", auth_id=current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().add_one(delivery)
+        await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().archive_many([delivery.success_sent()])
+        await uow.commit()
+        await uow.rollback()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        assert [x.id for x in await uow.delivery_task_repo().get_all()] == [delivery.id]
+        assert await uow.delivery_task_repo().get_archived(current_user.id) == []
+
+
+@pytest.mark.asyncio
+async def test_delivery_cleanup_keeps_dated_archive_partitions(current_user):
+    msg = Message(type="event", event_code="plan_created", occurred_at=get_current_datetime(), payload={})
+    delivery = DeliveryTask(url="http://my-site.com", data=msg, delays=(0,), partkey="Hello", auth_id=current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().add_one(delivery)
+        await uow.commit()
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().archive_many([delivery.success_sent()])
+        await uow.commit()
+
+    # Партиции за сегодня удаляются только целиком, по сроку хранения
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().delete_many_before_date(get_current_datetime())
+        await uow.commit()
+
+    async with container.session_factory()() as session:
+        stmt = select(delivery_archive_table.c["id"]).where(delivery_archive_table.c["id"] == delivery.id)
+        assert (await session.scalars(stmt)).all() == [delivery.id]
+
+
+@pytest.mark.asyncio
+async def test_delivery_cleanup_job_deletes_old_messages(current_user):
+    old_msg = Message(type="event", event_code="plan_created", occurred_at=get_current_datetime(), payload={})
+    old = DeliveryTask(url="http://my-site.com", data=old_msg, delays=(0,), partkey="Hello", auth_id=current_user.id,
+                       created_at=get_current_datetime() - timedelta(days=30))
+    new_msg = Message(type="event", event_code="plan_created", occurred_at=get_current_datetime(), payload={})
+    new = DeliveryTask(url="http://my-site.com", data=new_msg, delays=(0,), partkey="Hello", auth_id=current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().add_many([old, new])
+        await uow.commit()
+
+    startup = WorkersStartup(
+        subman_bulk_limit=100, subman_check_period=3600, log_retention_days=7, delivery_retention_days=7,
+        partitions_ahead_days=1,
+    )
+    # Доставка и ее сообщение
+    assert await startup._clean_old_delivery_tasks() == 2
+
+    async with container.session_factory()() as session:
+        stmt = select(webhook_message_table.c["id"]).where(webhook_message_table.c["auth_id"] == current_user.id)
+        assert (await session.scalars(stmt)).all() == [new_msg.id]
+    async with container.unit_of_work_factory().create_uow() as uow:
+        assert [x.id for x in await uow.delivery_task_repo().get_all()] == [new.id]
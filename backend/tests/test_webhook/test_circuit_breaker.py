@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from backend.shared.utils.dt import get_current_datetime
+from backend.webhook.application.circuit_breaker import CircuitBreaker
+
+URL = "http://my-site.com/hook"
+
+
+def test_circuit_opens_on_failure_rate():
+    breaker = CircuitBreaker(min_requests=4, failure_rate=0.5, open_time=60)
+    breaker.record_success(URL)
+    breaker.record_success(URL)
+    breaker.record_failure(URL)
+    assert breaker.get_state(URL) == "closed"
+
+    breaker.record_failure(URL)
+    assert breaker.get_state(URL) == "open"
+    assert not breaker.allow_request(URL)
+    assert breaker.unhealthy_for(URL) >= 0
+
+
+def test_circuit_needs_min_requests():
+    breaker = CircuitBreaker(min_requests=5)
+    for _ in range(4):
+        breaker.record_failure(URL)
+    assert breaker.get_state(URL) == "closed"
+    assert breaker.allow_request(URL)
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker(min_requests=1, open_time=0)
+    breaker.record_failure(URL)
+    assert breaker.get_state(URL) == "open"
+
+    assert breaker.allow_request(URL)
+    assert breaker.get_state(URL) == "half_open"
+    assert not breaker.allow_request(URL)
+
+
+def test_successful_probe_closes_circuit():
+    breaker = CircuitBreaker(min_requests=1, open_time=0)
+    breaker.record_failure(URL)
+    assert breaker.allow_request(URL)
+
+    breaker.record_success(URL)
+    assert breaker.get_state(URL) == "closed"
+    assert breaker.unhealthy_for(URL) == 0
+
+
+def test_failed_probe_opens_circuit_again():
+    breaker = CircuitBreaker(min_requests=1, open_time=0)
+    breaker.record_failure(URL)
+    assert breaker.allow_request(URL)
+
+    breaker.record_failure(URL)
+    assert breaker.get_state(URL) == "open"
+
+
+def test_half_open_retry_at_is_not_in_the_past():
+    breaker = CircuitBreaker(min_requests=1, open_time=60)
+    breaker.record_failure(URL)
+    # Время открытия прошло
+    breaker._circuits[URL].opened_at -= 60
+    assert breaker.allow_request(URL)
+    assert breaker.get_state(URL) == "half_open"
+
+    assert not breaker.allow_request(URL)
+    assert breaker.retry_at(URL) >= get_current_datetime() + timedelta(seconds=59)
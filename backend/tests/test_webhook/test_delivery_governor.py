@@ -0,0 +1,48 @@
+import asyncio
+import uuid
+
+import pytest
+
+from backend.webhook.application.delivery_governor import DeliveryGovernor
+
+
+async def run_requests(governor: DeliveryGovernor, urls: list[str]) -> dict[str, int]:
+    max_seen = {}
+
+    async def request(url: str):
+        async with governor.acquire(url):
+            for host, count in governor.in_flight_by_host().items():
+                max_seen[host] = max(max_seen.get(host, 0), count)
+            max_seen["total"] = max(max_seen.get("total", 0), governor.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[request(url) for url in urls])
+    return max_seen
+
+
+@pytest.mark.asyncio
+async def test_per_host_limit():
+    governor = DeliveryGovernor(max_concurrency=100, max_concurrency_per_host=3)
+    max_seen = await run_requests(governor, ["http://first.com/hook"] * 20 + ["http://second.com/hook"] * 20)
+    assert max_seen["first.com"] == 3
+    assert max_seen["second.com"] == 3
+    assert governor.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_global_limit():
+    governor = DeliveryGovernor(max_concurrency=5, max_concurrency_per_host=5)
+    urls = [f"http://site-{i}.com/hook" for i in range(30)]
+    max_seen = await run_requests(governor, urls)
+    assert max_seen["total"] == 5
+    assert governor.in_flight_by_host() == {}
+
+
+@pytest.mark.asyncio
+async def test_in_flight_by_tenant():
+    governor = DeliveryGovernor(max_concurrency=10, max_concurrency_per_host=10)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    async with governor.acquire("http://shared.com/hook", first), governor.acquire("http://shared.com/hook", second):
+        assert governor.in_flight_by_host() == {"shared.com": 2}
+        assert governor.tenant_in_flight_by_host(first) == {"shared.com": 1}
+    assert governor.tenant_in_flight_by_host(first) == {}
@@ -0,0 +1,39 @@
+from uuid import uuid4
+
+from backend.webhook.application.delivery_queue import DeliveryQueue
+
+
+def test_pop_interleaves_tenants():
+    queue = DeliveryQueue()
+    noisy = [uuid4() for _ in range(100)]
+    quiet = [uuid4() for _ in range(2)]
+    queue.push_many(("noisy", x) for x in noisy)
+    queue.push_many(("quiet", x) for x in quiet)
+
+    batch = queue.pop_many(4)
+    assert batch == [noisy[0], quiet[0], noisy[1], quiet[1]]
+    assert len(queue) == 98
+    assert queue.backlog_by_tenant() == {"noisy": 98}
+
+
+def test_pop_rotates_tenants_between_calls():
+    queue = DeliveryQueue()
+    first, second, third = [[uuid4() for _ in range(2)] for _ in range(3)]
+    queue.push_many(("first", x) for x in first)
+    queue.push_many(("second", x) for x in second)
+    queue.push_many(("third", x) for x in third)
+
+    assert queue.pop_many(2) == [first[0], second[0]]
+    assert queue.pop_many(2) == [third[0], first[1]]
+    assert queue.pop_many(10) == [second[1], third[1]]
+    assert len(queue) == 0
+
+
+def test_push_ignores_duplicates():
+    pushes = []
+    queue = DeliveryQueue(on_push=lambda: pushes.append(1))
+    delivery_id = uuid4()
+    queue.push_many([("tenant", delivery_id)])
+    queue.push_many([("tenant", delivery_id)])
+    assert len(queue) == 1
+    assert len(pushes) == 1
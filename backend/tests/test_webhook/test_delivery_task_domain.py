@@ -21,3 +21,43 @@ def test_next_retry_delay(current_user):
         delivery = delivery.failed_sent(SentErrorInfo(status_code=500, detail="AnyErr"))
     assert delivery.retries == 3
     assert delivery.max_retries == 3
+
+
+def test_postponed_delivery_keeps_retries(current_user):
+    delivery = DeliveryTask(
+        url="http://my-site.com",
+        data=Message(type="event", event_code="any", occurred_at=get_current_datetime(), payload={}),
+        delays=DELAYS,
+        partkey="Hello",
+        auth_id=current_user.id,
+    )
+    until = get_current_datetime() + timedelta(seconds=60)
+    delivery = delivery.postponed(until)
+    assert delivery.retries == 0
+    assert delivery.next_retry_at == until
+
+    delivery = delivery.failed_sent(SentErrorInfo(status_code=500, detail="AnyErr"))
+    assert delivery.postponed_until is None
+
+
+def test_message_encode_decode():
+    msg = Message(type="event", event_code="any", occurred_at=get_current_datetime(), payload={"value": 1})
+    body = msg.encode()
+    assert b'"id"' not in body
+    assert Message.decode(msg.id, body) == msg
+
+
+def test_merged_message_keeps_final_changes_and_total_delta():
+    dt = get_current_datetime()
+    first = Message(
+        type="event", event_code="sub_usage_updated", occurred_at=dt,
+        payload={"code": "api_calls", "delta": 2, "changes": {"used_units": 2}},
+    )
+    second = Message(
+        type="event", event_code="sub_usage_updated", occurred_at=dt + timedelta(seconds=1),
+        payload={"code": "api_calls", "delta": 5, "changes": {"used_units": 7}},
+    )
+    merged = first.merged_with(second)
+    assert merged.payload == {"code": "api_calls", "delta": 7, "changes": {"used_units": 7}}
+    assert merged.occurred_at == second.occurred_at
+    assert merged.id == first.id
@@ -0,0 +1,64 @@
+import re
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from backend.bootstrap import get_container
+from backend.shared.utils.dt import get_current_datetime
+from backend.webhook.infra.delivery_task_repo_sql import (
+    due_deliveries_query, claim_candidates_query, next_retry_query, next_lease_expiry_query
+)
+
+container = get_container()
+
+# "Index Scan using ix on t", "Index Only Scan Backward using ix on t", "Bitmap Index Scan on ix"
+INDEX_NODE = re.compile(r"Index (?:Only )?Scan (?:Backward )?using (\w+)|Bitmap Index Scan on (\w+)")
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def compile_explain(element, compiler, **kwargs):
+    return "EXPLAIN " + compiler.process(element.statement, **kwargs)
+
+
+async def get_plan(statement) -> str:
+    async with container.session_factory()() as session:
+        # На маленькой тестовой таблице планировщик иначе всегда выберет seq scan
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        result = await session.execute(Explain(statement))
+        plan = "\n".join(row[0] for row in result)
+        await session.rollback()
+    return plan
+
+
+def get_plan_indexes(plan: str) -> set[str]:
+    return {using or bitmap for using, bitmap in INDEX_NODE.findall(plan)}
+
+
+@pytest.mark.asyncio
+async def test_due_deliveries_query_uses_pending_index():
+    plan = await get_plan(due_deliveries_query(get_current_datetime(), 500))
+    assert "ix_delivery_task_pending" in get_plan_indexes(plan)
+
+
+@pytest.mark.asyncio
+async def test_claim_query_uses_pending_tenant_index():
+    # Тенанты и их очереди читаются по auth_id, общий индекс ожидающих доставок здесь не нужен
+    plan = await get_plan(claim_candidates_query(get_current_datetime(), 500))
+    assert "ix_delivery_task_pending_tenant" in get_plan_indexes(plan)
+
+
+@pytest.mark.asyncio
+async def test_next_due_queries_read_one_index_entry():
+    for query in (next_retry_query(), next_lease_expiry_query()):
+        plan = await get_plan(query)
+        assert "Index" in plan
+        assert "Sort" not in plan and "Aggregate" not in plan
@@ -0,0 +1,48 @@
+import base64
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from backend.webhook.application.encrypt_service import GDPRCompliantEncryptor, GCM_PREFIX
+
+
+@pytest.mark.parametrize("mode", ["cbc", "gcm"])
+def test_encrypt_decrypt_roundtrip(mode):
+    encryptor = GDPRCompliantEncryptor("password", mode=mode)
+    encrypted = encryptor.encrypt("secret value")
+    assert encrypted.startswith(GCM_PREFIX) == (mode == "gcm")
+    assert encryptor.decrypt(encrypted) == "secret value"
+
+
+def test_decrypt_accepts_both_modes():
+    cbc = GDPRCompliantEncryptor("password", mode="cbc").encrypt("old")
+    gcm = GDPRCompliantEncryptor("password", mode="gcm").encrypt("new")
+    encryptor = GDPRCompliantEncryptor("password")
+    assert encryptor.decrypt(cbc) == "old"
+    assert encryptor.decrypt(gcm) == "new"
+
+
+def test_decrypt_does_not_change_encryptor_state():
+    encryptor = GDPRCompliantEncryptor("password")
+    salt, key = encryptor.salt, encryptor.key
+    foreign = GDPRCompliantEncryptor("password").encrypt("foreign")
+    assert encryptor.decrypt(foreign) == "foreign"
+    assert (encryptor.salt, encryptor.key) == (salt, key)
+
+
+def test_gcm_detects_tampering():
+    encryptor = GDPRCompliantEncryptor("password")
+    data = bytearray(base64.b64decode(encryptor.encrypt("secret value").removeprefix(GCM_PREFIX)))
+    data[-1] ^= 1
+    tampered = GCM_PREFIX + base64.b64encode(bytes(data)).decode()
+    with pytest.raises(InvalidTag):
+        encryptor.decrypt(tampered)
+
+
+@pytest.mark.asyncio
+async def test_encrypt_many_and_decrypt_many_keep_order():
+    encryptor = GDPRCompliantEncryptor("password", chunk_size=3)
+    values = [f"secret {i}" for i in range(10)]
+    encrypted = await encryptor.encrypt_many(values)
+    assert len(encrypted) == 10
+    assert await encryptor.decrypt_many(encrypted) == values
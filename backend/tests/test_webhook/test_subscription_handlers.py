@@ -0,0 +1,216 @@
+from uuid import uuid4
+
+import gzip
+
+import pytest
+import zstandard
+
+from backend import config
+from backend.bootstrap import get_container
+from backend.shared.event_driven.bus import Context
+from backend.shared.utils.dt import get_current_datetime
+from backend.subscription.domain.cycle import Period
+from backend.subscription.domain.events import (
+    PlanCreated, PlanDeleted, SubUsageUpdated, SubUpdated, SubUsageRemoved
+)
+from backend.webhook.adapters import subscription_handlers
+from backend.webhook.adapters.schemas import WebhookCreate
+
+container = get_container()
+
+
+def plan_event(event_class, auth_id):
+    return event_class(
+        id=uuid4(),
+        title="Plan",
+        price=100,
+        currency="USD",
+        billing_cycle=Period.Monthly,
+        auth_id=auth_id,
+    )
+
+
+@pytest.mark.asyncio
+async def test_handle_many_events_in_one_batch(current_user):
+    hooks = [
+        WebhookCreate(event_code="plan_created", target_url="http://first.com").to_webhook(current_user.id),
+        WebhookCreate(event_code="plan_created", target_url="http://second.com").to_webhook(current_user.id),
+    ]
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_many(hooks)
+        await uow.commit()
+
+    events = [plan_event(PlanCreated, current_user.id) for _ in range(5)]
+    events.append(plan_event(PlanDeleted, current_user.id))
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await subscription_handlers.handle_subscription_domain_events(events, Context(uow))
+        await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all(lock="none")
+
+    # Для plan_deleted вебхуков нет, поэтому доставок 5 * 2
+    assert len(deliveries) == 10
+    assert {x.url for x in deliveries} == {"http://first.com", "http://second.com"}
+    assert {x.partkey for x in deliveries} == {str(ev.id) for ev in events[:5]}
+    # Каждое сообщение хранится один раз и разделяется вебхуками
+    assert len({x.data.id for x in deliveries}) == 5
+
+
+def usage_event(subscription_id, delta, used_units, auth_id):
+    return SubUsageUpdated(
+        subscription_id=subscription_id,
+        code="api_calls",
+        changes={"used_units": used_units},
+        delta=delta,
+        auth_id=auth_id,
+    )
+
+
+@pytest.mark.asyncio
+async def test_usage_events_are_aggregated_within_window(current_user):
+    hook = WebhookCreate(
+        event_code="sub_usage_updated", target_url="http://first.com", aggregation_window=60,
+    ).to_webhook(current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_one(hook)
+        await uow.commit()
+
+    subscription_id = uuid4()
+    used_units = 0
+    # Первая пачка сливается внутри себя, вторая - в уже сохраненную доставку
+    for deltas in [(1, 2), (3,)]:
+        async with container.unit_of_work_factory().create_uow() as uow:
+            events = []
+            for delta in deltas:
+                used_units += delta
+                events.append(usage_event(subscription_id, delta, used_units, current_user.id))
+            await subscription_handlers.handle_subscription_domain_events(events, Context(uow))
+            await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all(lock="none")
+        assert await uow.delivery_task_repo().get_deliveries_for_send(lock="none") == []
+
+    assert len(deliveries) == 1
+    assert deliveries[0].data.payload["delta"] == 6
+    assert deliveries[0].data.payload["changes"] == {"used_units": 6}
+    assert deliveries[0].postponed_until is not None
+
+
+@pytest.mark.asyncio
+async def test_aggregation_updates_message_in_place(current_user):
+    hooks = [
+        WebhookCreate(event_code="sub_usage_updated", target_url="http://first.com", aggregation_window=60),
+        WebhookCreate(event_code="sub_usage_updated", target_url="http://second.com"),
+    ]
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_many([x.to_webhook(current_user.id) for x in hooks])
+        await uow.commit()
+
+    subscription_id = uuid4()
+    message_ids = []
+    for delta, used_units in [(1, 1), (2, 3)]:
+        async with container.unit_of_work_factory().create_uow() as uow:
+            event = usage_event(subscription_id, delta, used_units, current_user.id)
+            await subscription_handlers.handle_subscription_domain_events([event], Context(uow))
+            await uow.commit()
+        async with container.unit_of_work_factory().create_uow() as uow:
+            deliveries = await uow.delivery_task_repo().get_all(lock="none")
+        aggregated = [x for x in deliveries if x.aggregation_key is not None]
+        assert len(aggregated) == 1
+        message_ids.append(aggregated[0].data.id)
+
+    # Слияние не плодит сообщений, а неагрегируемые доставки сохраняют исходные
+    assert message_ids[0] == message_ids[1]
+    assert aggregated[0].data.payload["delta"] == 3
+    first_plain = [x for x in deliveries if x.aggregation_key is None][0]
+    assert first_plain.data.payload["delta"] == 1
+    assert first_plain.data.id != message_ids[0]
+
+
+def test_only_usage_updates_are_aggregated_per_code():
+    subscription_id = uuid4()
+    event = usage_event(subscription_id, 1, 1, uuid4())
+    assert subscription_handlers.get_aggregation_key(event) == f"{subscription_id}:usages.api_calls"
+
+    changes = {"usages.used_units": "action:updated"}
+    event = SubUpdated(id=subscription_id, subscriber_id="AnySubscriberId", changes=changes, auth_id=uuid4())
+    assert subscription_handlers.get_aggregation_key(event) is None
+
+
+@pytest.mark.asyncio
+async def test_plain_delivery_releases_held_aggregation(current_user):
+    hooks = [
+        WebhookCreate(event_code="sub_usage_updated", target_url="http://first.com", aggregation_window=60),
+        WebhookCreate(event_code="sub_usage_removed", target_url="http://first.com"),
+    ]
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_many([x.to_webhook(current_user.id) for x in hooks])
+        await uow.commit()
+
+    subscription_id = uuid4()
+    removed = SubUsageRemoved(
+        subscription_id=subscription_id, title="Api calls", code="api_calls", unit="call", available_units=10,
+        renew_cycle=Period.Monthly, used_units=1, last_renew=get_current_datetime(), auth_id=current_user.id,
+    )
+    for event in [usage_event(subscription_id, 1, 1, current_user.id), removed]:
+        async with container.unit_of_work_factory().create_uow() as uow:
+            await subscription_handlers.handle_subscription_domain_events([event], Context(uow))
+            await uow.commit()
+
+    # Удаление usage не обгоняет отложенное списание по той же подписке
+    async with container.unit_of_work_factory().create_uow() as uow:
+        due = await uow.delivery_task_repo().get_deliveries_for_send(lock="none")
+    assert [x.data.event_code for x in due] == ["sub_usage_updated", "sub_usage_removed"]
+    assert due[0].aggregation_key is None
+
+
+@pytest.mark.asyncio
+async def test_merged_message_keeps_compressed_body(current_user, monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_COMPRESSION_THRESHOLD", 0)
+    hook = WebhookCreate(
+        event_code="sub_usage_updated", target_url="http://first.com", aggregation_window=60, compression="gzip",
+    ).to_webhook(current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_one(hook)
+        await uow.commit()
+
+    subscription_id = uuid4()
+    for delta, used_units in [(1, 1), (2, 3)]:
+        async with container.unit_of_work_factory().create_uow() as uow:
+            event = usage_event(subscription_id, delta, used_units, current_user.id)
+            await subscription_handlers.handle_subscription_domain_events([event], Context(uow))
+            await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all(lock="none")
+    assert len(deliveries) == 1
+    assert deliveries[0].data.payload["delta"] == 3
+    assert gzip.decompress(deliveries[0].compressed_body) == deliveries[0].encoded_body
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding, decompress", [("gzip", gzip.decompress), ("zstd", zstandard.decompress)])
+async def test_compressed_body_is_stored_with_message(current_user, monkeypatch, encoding, decompress):
+    monkeypatch.setattr(config, "WEBHOOK_COMPRESSION_THRESHOLD", 0)
+    hook = WebhookCreate(
+        event_code="plan_created", target_url="http://first.com", compression=encoding,
+    ).to_webhook(current_user.id)
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_one(hook)
+        await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await subscription_handlers.handle_subscription_domain_events(
+            [plan_event(PlanCreated, current_user.id)], Context(uow)
+        )
+        await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all(lock="none")
+
+    assert len(deliveries) == 1
+    assert deliveries[0].content_encoding == encoding
+    assert decompress(deliveries[0].compressed_body) == deliveries[0].encoded_body
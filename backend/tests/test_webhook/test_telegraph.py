@@ -1,4 +1,5 @@
 import asyncio
+import gzip
 import uuid
 from collections import defaultdict
 from typing import Callable
@@ -6,13 +7,16 @@ from typing import Callable
 import pytest
 import pytest_asyncio
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 
+from backend.auth.application.auth_usecases import AuthUserCreate
 from backend.auth.domain.auth_user import AuthId
 from backend.bootstrap import get_container
 from backend.shared.utils.dt import get_current_datetime
 from backend.shared.utils.worker import Worker
-from backend.webhook.application.telegraph import Telegraph
+from backend.webhook.adapters.schemas import WebhookCreate
+from backend.webhook.application.circuit_breaker import CircuitBreaker
+from backend.webhook.application.telegraph import Telegraph, RequestClient, group_deliveries_by_target, split_batches
 from backend.webhook.domain.delivery_task import Message, DeliveryTask
 
 container = get_container()
@@ -51,6 +55,10 @@ store = MessageStore()
 @pytest.fixture(autouse=True)
 def clear_store():
     store.clear()
+    batch_sizes.clear()
+    content_encodings.clear()
+    queue = container.delivery_queue()
+    queue.pop_many(len(queue))
 
 
 @app.post("/message-handler")
@@ -60,6 +68,36 @@ async def message_handler(msg: Message) -> str:
     return "OK"
 
 
+batch_sizes: list[int] = []
+
+
+@app.post("/batch-message-handler")
+async def batch_message_handler(items: list[dict]) -> dict:
+    batch_sizes.append(len(items))
+    failed = []
+    for item in items:
+        msg = Message(**item["message"])
+        if msg.payload.get("reject"):
+            failed.append(item["delivery_id"])
+        else:
+            store.add_message(msg)
+    return {"failed": failed}
+
+
+content_encodings: list[str] = []
+
+
+@app.post("/compressed-message-handler")
+async def compressed_message_handler(request: Request) -> str:
+    encoding = request.headers.get("content-encoding")
+    content_encodings.append(encoding)
+    body = await request.body()
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    store.add_message(Message.model_validate_json(body))
+    return "OK"
+
+
 @app.post("/bad-message-handler")
 async def bad_message_handler(_msg: Message):
     raise NotImplemented
@@ -76,7 +114,16 @@ async def fastapi_server():
     task.cancel()
 
 
-async def create_deliveries(count: int, url: str, partkey_func: Callable[[], str], auth_id: AuthId, delays=(0, 0, 0,)):
+async def create_deliveries(
+        count: int,
+        url: str,
+        partkey_func: Callable[[], str],
+        auth_id: AuthId,
+        delays=(0, 0, 0,),
+        batch_size=1,
+        reject_numbers: tuple[int, ...] = (),
+        content_encoding=None,
+):
     deliveries = []
     for i in range(count):
         partkey = partkey_func()
@@ -84,7 +131,7 @@ async def create_deliveries(count: int, url: str, partkey_func: Callable[[], str
             type="event",
             event_code=f"code_{i}",
             occurred_at=get_current_datetime(),
-            payload={"partkey": partkey, "number": i},
+            payload={"partkey": partkey, "number": i, "reject": i in reject_numbers},
         )
         delivery = DeliveryTask(
             url=url,
@@ -92,6 +139,8 @@ async def create_deliveries(count: int, url: str, partkey_func: Callable[[], str
             delays=delays,
             partkey=partkey,
             auth_id=auth_id,
+            batch_size=batch_size,
+            content_encoding=content_encoding,
         )
         deliveries.append(delivery)
 
@@ -178,22 +227,219 @@ async def test_concurrency_deliveries_with_different_partkeys(deliveries_with_di
 
 
 @pytest.mark.asyncio
-async def test_deliveries_with_bad_url(deliveries_with_wrong_url):
+async def test_deliveries_with_bad_url(deliveries_with_wrong_url, current_user):
     await telegraph_worker()
     async with container.unit_of_work_factory().create_uow() as uow:
-        deliveries = await uow.delivery_task_repo().get_all()
-        assert len(deliveries) == 3
-        for delivery in deliveries:
+        assert len(await uow.delivery_task_repo().get_all()) == 0
+        archived = await uow.delivery_task_repo().get_archived(current_user.id)
+        assert len(archived) == 3
+        for delivery in archived:
             assert delivery.retries == 3
             assert delivery.status == "failed_sent"
 
 
 @pytest.mark.asyncio
-async def test_deliveries_with_bad_handler(deliveries_with_bad_handler):
+async def test_deliveries_with_bad_handler(deliveries_with_bad_handler, current_user):
     await telegraph_worker()
     async with container.unit_of_work_factory().create_uow() as uow:
-        deliveries = await uow.delivery_task_repo().get_all()
-        assert len(deliveries) == 3
-        for delivery in deliveries:
+        assert len(await uow.delivery_task_repo().get_all()) == 0
+        archived = await uow.delivery_task_repo().get_archived(current_user.id)
+        assert len(archived) == 3
+        for delivery in archived:
             assert delivery.retries == 3
             assert delivery.status == "failed_sent"
+
+
+@pytest.mark.asyncio
+async def test_committed_deliveries_are_sent_from_queue(deliveries_with_different_partkeys):
+    queue = container.delivery_queue()
+    assert len(queue) == len(deliveries_with_different_partkeys)
+
+    telegraph = Telegraph(container.unit_of_work_factory(), queue=queue, poll_interval=3600)
+    await telegraph.notify()
+
+    assert len(queue) == 0
+    assert len(store.get_all_messages()) == len(deliveries_with_different_partkeys)
+
+
+@pytest.mark.asyncio
+async def test_parallel_telegraphs_keep_partkey_order(deliveries_with_the_same_partkey):
+    telegraphs = [Telegraph(container.unit_of_work_factory()) for _ in range(3)]
+    await asyncio.gather(*[telegraph.notify() for telegraph in telegraphs])
+
+    messages = store.get_all_messages()
+    assert len(messages) == len(deliveries_with_the_same_partkey)
+    assert messages == list(sorted(messages, key=lambda x: x.payload["number"]))
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_postpones_deliveries(current_user):
+    await create_deliveries(3, "http://very-bad-url.com", lambda: "Hello", current_user.id)
+    telegraph = Telegraph(container.unit_of_work_factory(), breaker=CircuitBreaker(min_requests=1, open_time=60))
+    await telegraph.notify()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all()
+    assert len([x for x in deliveries if x.retries == 1]) == 1
+    postponed = [x for x in deliveries if x.postponed_until is not None]
+    assert len(postponed) == 2
+    assert all(x.retries == 0 for x in postponed)
+
+
+@pytest.mark.asyncio
+async def test_dead_target_disables_only_webhooks_of_its_tenant(current_user):
+    url = "http://dead-shared-url.com"
+    auth_usecase = container.auth_usecase()
+    try:
+        other_user = await auth_usecase.get_auth_user_by_email("other_tenant_for_test@gmaiil.com")
+    except Exception:
+        other_user = await auth_usecase.create_auth_user(
+            AuthUserCreate(email="other_tenant_for_test@gmaiil.com", password="1234qwerty")
+        )
+    mine, other = [
+        WebhookCreate(event_code="plan_created", target_url=url).to_webhook(user.id)
+        for user in (current_user, other_user)
+    ]
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.webhook_repo().add_many([mine, other])
+        await uow.commit()
+
+    await create_deliveries(1, url, lambda: str(uuid.uuid4()), current_user.id)
+    breaker = CircuitBreaker(min_requests=1, open_time=60)
+    await Telegraph(container.unit_of_work_factory(), breaker=breaker, auto_disable_after=1e-6).notify()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        mine = await uow.webhook_repo().get_one_by_id(mine.id)
+        other = await uow.webhook_repo().get_one_by_id(other.id)
+        await uow.webhook_repo().delete_many([mine, other])
+        await uow.commit()
+    assert not mine.enabled
+    assert "status=500" in mine.disabled_reason
+    assert other.enabled
+    assert other.disabled_reason is None
+
+
+@pytest.mark.asyncio
+async def test_batched_deliveries(current_user):
+    url = f"http://{HOST}:{PORT}/batch-message-handler"
+    await create_deliveries(10, url, lambda: str(uuid.uuid4()), current_user.id, batch_size=4, reject_numbers=(5,))
+    await Telegraph(container.unit_of_work_factory()).notify()
+
+    assert batch_sizes == [4, 4, 2]
+    messages = store.get_all_messages()
+    assert [x.payload["number"] for x in messages] == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all()
+        archived = await uow.delivery_task_repo().get_archived(current_user.id)
+    assert len(archived) == 9
+    assert len(deliveries) == 1
+    assert deliveries[0].status == "failed_sent"
+    assert deliveries[0].data.payload["number"] == 5
+
+
+@pytest.mark.asyncio
+async def test_failed_item_stops_its_partkey_in_batches(current_user):
+    url = f"http://{HOST}:{PORT}/batch-message-handler"
+    await create_deliveries(
+        10, url, lambda: "Hello", current_user.id, delays=(0, 60, 60), batch_size=4, reject_numbers=(5,)
+    )
+    await Telegraph(container.unit_of_work_factory()).notify()
+
+    # 6 и 7 ушли в одной пачке с 5, следующая пачка ждет повтора 5
+    assert batch_sizes == [4, 4]
+    assert [x.payload["number"] for x in store.get_all_messages()] == [0, 1, 2, 3, 4, 6, 7]
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        deliveries = await uow.delivery_task_repo().get_all()
+    assert [x.data.payload["number"] for x in deliveries] == [5, 8, 9]
+    assert [x.retries for x in deliveries] == [1, 0, 0]
+    assert deliveries[1].next_retry_at >= deliveries[0].next_retry_at
+
+
+@pytest.mark.asyncio
+async def test_telegraph_sleeps_until_next_retry(current_user):
+    telegraph = Telegraph(container.unit_of_work_factory(), poll_interval=3600, min_poll_gap=0)
+    await telegraph.notify()
+    # В базе нет ожидающих доставок - спим до страховочного опроса
+    assert telegraph.next_run_delay() > 3000
+
+    await create_deliveries(1, "http://very-bad-url.com", lambda: "Hello", current_user.id, delays=(0, 30, 30))
+    telegraph = Telegraph(container.unit_of_work_factory(), poll_interval=3600, min_poll_gap=0)
+    await telegraph.notify()
+    assert 20 < telegraph.next_run_delay() <= 30
+
+
+@pytest.mark.asyncio
+async def test_compressed_deliveries(current_user):
+    url = f"http://{HOST}:{PORT}/compressed-message-handler"
+    await create_deliveries(2, url, lambda: "Hello", current_user.id, content_encoding="gzip")
+    client = RequestClient(compression_threshold=0)
+    await Telegraph(container.unit_of_work_factory(), client=client).notify()
+
+    assert content_encodings == ["gzip", "gzip"]
+    assert [x.payload["number"] for x in store.get_all_messages()] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_http2_client_sends_deliveries(current_user):
+    # Без пакета h2 httpx не создаст клиента
+    await create_deliveries(2, f"http://{HOST}:{PORT}/message-handler", lambda: "Hello", current_user.id)
+    client = RequestClient(http2=True)
+    await Telegraph(container.unit_of_work_factory(), client=client).notify()
+
+    assert [x.payload["number"] for x in store.get_all_messages()] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_during_long_send(current_user):
+    await create_deliveries(5, f"http://{HOST}:{PORT}/message-handler", lambda: "Hello", current_user.id)
+    # Отправка занимает 5 * DELAY, это дольше аренды: без продления вторая телеграф-инстанция перехватит строки
+    slow = Telegraph(container.unit_of_work_factory(), lease_time=0.3)
+    task = asyncio.create_task(slow.notify())
+    await asyncio.sleep(0.6)
+    await Telegraph(container.unit_of_work_factory()).notify()
+    await task
+
+    assert [x.payload["number"] for x in store.get_all_messages()] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_taken_over_lease_is_not_saved(current_user):
+    deliveries = await create_deliveries(2, "http://very-bad-url.com", lambda: str(uuid.uuid4()), current_user.id)
+    ids = [x.id for x in deliveries]
+    first, second = uuid.uuid4(), uuid.uuid4()
+    async with container.unit_of_work_factory().create_uow() as uow:
+        # Нулевая аренда истекает сразу, строки может забрать следующий воркер
+        await uow.delivery_task_repo().claim_deliveries(10, 0, first, ids)
+        await uow.commit()
+    async with container.unit_of_work_factory().create_uow() as uow:
+        await uow.delivery_task_repo().claim_deliveries(10, 60, second, ids)
+        await uow.commit()
+
+    async with container.unit_of_work_factory().create_uow() as uow:
+        assert await uow.delivery_task_repo().get_leased_by(ids, first) == set()
+        assert await uow.delivery_task_repo().get_leased_by(ids, second) == set(ids)
+
+
+def test_batches_do_not_mix_tenants_or_settings():
+    first, second = uuid.uuid4(), uuid.uuid4()
+    url = "http://shared.com/hook"
+
+    def delivery(auth_id, batch_size, content_encoding=None):
+        msg = Message(type="event", event_code="code", occurred_at=get_current_datetime(), payload={})
+        return DeliveryTask(
+            url=url, data=msg, delays=(0,), partkey="Hello", auth_id=auth_id,
+            batch_size=batch_size, content_encoding=content_encoding,
+        )
+
+    deliveries = [
+        delivery(first, 3), delivery(second, 3), delivery(first, 3),
+        delivery(first, 2, "gzip"), delivery(first, 3), delivery(first, 3),
+    ]
+    groups = group_deliveries_by_target(deliveries)
+    assert {key: len(value) for key, value in groups.items()} == {(first, url): 5, (second, url): 1}
+
+    batches = split_batches(groups[(first, url)])
+    assert [len(x) for x in batches] == [2, 1, 2]
+    assert [x for batch in batches for x in batch] == groups[(first, url)]
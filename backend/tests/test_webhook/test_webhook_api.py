@@ -2,8 +2,10 @@ import pytest
 from loguru import logger
 
 from backend.bootstrap import get_container
+from backend.shared.utils.dt import get_current_datetime
 from backend.subscription.domain.events import PlanCreated, PlanUpdated
 from backend.webhook.adapters.schemas import WebhookCreate, WebhookUpdate
+from backend.webhook.domain.delivery_task import DeliveryTask, Message
 from backend.webhook.domain.webhook_repo import WebhookSby
 from tests.conftest import client, get_async_client
 from tests.fakes import simple_webhook, many_webhooks
@@ -45,6 +47,38 @@ class TestGet:
         response.raise_for_status()
         assert len(response.json()) == 4
 
+    @pytest.mark.asyncio
+    async def test_get_delivery_stats(self, simple_webhook, client):
+        response = await client.get("/webhook/delivery-stats")
+        response.raise_for_status()
+        assert response.json()["in_flight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_get_delivery_history(self, current_user, client):
+        msg = Message(type="event", event_code="plan_created", occurred_at=get_current_datetime(), payload={})
+        deliveries = [
+            DeliveryTask(url="http://my-site.com", data=msg, delays=(0,), partkey=str(i), auth_id=current_user.id)
+            for i in range(3)
+        ]
+        async with container.unit_of_work_factory().create_uow() as uow:
+            await uow.delivery_task_repo().add_many(deliveries)
+            await uow.commit()
+        async with container.unit_of_work_factory().create_uow() as uow:
+            await uow.delivery_task_repo().archive_many([x.success_sent() for x in deliveries])
+            await uow.commit()
+
+        response = await client.get("/webhook/deliveries", params={"limit": 2})
+        response.raise_for_status()
+        first_page = response.json()
+        assert len(first_page) == 2
+
+        params = {"limit": 2, "before_archived_at": first_page[-1]["archived_at"], "before_id": first_page[-1]["id"]}
+        response = await client.get("/webhook/deliveries", params=params)
+        response.raise_for_status()
+        second_page = response.json()
+        assert len(second_page) == 1
+        assert second_page[0]["id"] not in {x["id"] for x in first_page}
+
 
 class TestUpdate:
     @pytest.mark.asyncio
@@ -54,6 +88,49 @@ class TestUpdate:
         response = await client.put(f"/webhook/{simple_webhook.id}", json=payload)
         response.raise_for_status()
 
+    @pytest.mark.asyncio
+    async def test_update_one_invalidates_cache(self, simple_webhook, client):
+        cache = container.webhook_cache()
+        async with container.unit_of_work_factory().create_uow() as uow:
+            cached = await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow)
+            assert [x.target_url for x in cached] == [simple_webhook.target_url]
+
+        simple_webhook = simple_webhook.model_copy(update={"target_url": "http://updated-site.com"})
+        payload = WebhookUpdate.from_webhook(simple_webhook).model_dump(mode="json")
+        response = await client.put(f"/webhook/{simple_webhook.id}", json=payload)
+        response.raise_for_status()
+
+        async with container.unit_of_work_factory().create_uow() as uow:
+            cached = await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow)
+            assert [x.target_url for x in cached] == ["http://updated-site.com"]
+
+    @pytest.mark.asyncio
+    async def test_rolled_back_update_keeps_cache(self, simple_webhook):
+        cache = container.webhook_cache()
+        async with container.unit_of_work_factory().create_uow() as uow:
+            await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow)
+            await uow.webhook_repo().update_one(simple_webhook.model_copy(update={"enabled": False}))
+
+        async with container.unit_of_work_factory().create_uow() as uow:
+            cached = await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow)
+            assert [x.id for x in cached] == [simple_webhook.id]
+
+    @pytest.mark.asyncio
+    async def test_event_code_change_invalidates_old_key(self, simple_webhook, client):
+        cache = container.webhook_cache()
+        async with container.unit_of_work_factory().create_uow() as uow:
+            await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow)
+
+        updated = simple_webhook.model_copy(update={"event_code": "plan_updated"})
+        payload = WebhookUpdate.from_webhook(updated).model_dump(mode="json")
+        response = await client.put(f"/webhook/{simple_webhook.id}", json=payload)
+        response.raise_for_status()
+
+        async with container.unit_of_work_factory().create_uow() as uow:
+            assert await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow) == []
+            cached = await cache.get_webhooks(simple_webhook.auth_id, "plan_updated", uow)
+            assert [x.id for x in cached] == [simple_webhook.id]
+
 
 class TestDelete:
     @pytest.mark.asyncio
@@ -61,6 +138,18 @@ class TestDelete:
         response = await client.delete(f"/webhook/{simple_webhook.id}")
         response.raise_for_status()
 
+    @pytest.mark.asyncio
+    async def test_delete_one_invalidates_cache(self, simple_webhook, client):
+        cache = container.webhook_cache()
+        async with container.unit_of_work_factory().create_uow() as uow:
+            await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow)
+
+        response = await client.delete(f"/webhook/{simple_webhook.id}")
+        response.raise_for_status()
+
+        async with container.unit_of_work_factory().create_uow() as uow:
+            assert await cache.get_webhooks(simple_webhook.auth_id, simple_webhook.event_code, uow) == []
+
     @pytest.mark.asyncio
     async def test_delete_all_webhooks(self, many_webhooks, client):
         response = await client.delete(f"/webhook/")